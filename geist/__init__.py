@@ -1,6 +1,8 @@
 from .visualfinders import (
     ApproxTemplateFinder,
+    MultipleApproxTemplateFinder,
     ExactTemplateFinder,
+    NormalisedCorrelationFinder,
     ThresholdTemplateFinder,
     ColourRegionFinder,
     BinaryRegionFinder,
@@ -25,19 +27,27 @@ from .layoutfinders import (
     intersects,
 )
 
+from .hints import (
+    RegionHint,
+)
+
 from .repo import (
     DirectoryRepo,
+    CachingRepo,
+    PackedRepo,
     TemplateFinderFromRepo,
 )
 
 from .core import (
     NotFoundError,
     GUI,
+    PollScheduler,
 )
 
 from .finders import (
     Location,
     LocationList,
+    LocationArray,
 )
 
 from .filters import (
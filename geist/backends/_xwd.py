@@ -0,0 +1,73 @@
+from __future__ import division, absolute_import, print_function
+
+import numpy
+import struct
+
+
+class XwdToNumpyReader(object):
+    _XWD_HEADER = struct.Struct('>lllllllhhhhhh')
+    _FB_OFFSET = 3232
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._check_header(self._read_header())
+
+    def _read_header(self):
+        with open(self._filename, 'rb') as f:
+            return f.read(XwdToNumpyReader._XWD_HEADER.size)
+
+    def _read_dump(self):
+        with open(self._filename, 'rb') as f:
+            return numpy.fromfile(f, numpy.uint8)
+
+    def _check_header(self, fb):
+        _, ver, _, planes = XwdToNumpyReader._XWD_HEADER.unpack_from(fb)[:4]
+        assert ver == 7, "Only understand xwd version 7"
+        assert planes == 24, "Can only handle 24bit screens"
+
+    def _read_w_h_from_header(self, fb):
+        return XwdToNumpyReader._XWD_HEADER.unpack_from(fb)[4:6]
+
+    def get_rect(self):
+        w, h = self._read_w_h_from_header(self._read_header())
+        return (0, 0, w, h)
+
+    def get_image(self):
+        fb = self._read_dump()
+        w, h = self._read_w_h_from_header(fb)
+        return fb[self._FB_OFFSET:].reshape((h, w, 4))[:, :, (2, 1, 0)]
+
+
+class XwdToNumpyMemmapReader(XwdToNumpyReader):
+    """Maps the xwd frame buffer into memory once and parses its header once.
+
+    get_image returns a strided view on the live frame buffer so no data is
+    read or copied, but its contents change as the X server draws. Use
+    snapshot to get a copy which won't change.
+    """
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._fb = numpy.memmap(filename, numpy.uint8, mode='r')
+        self._check_header(self._fb)
+        w, h = self._read_w_h_from_header(self._fb)
+        self._rect = (0, 0, w, h)
+        pixels = self._fb[self._FB_OFFSET:self._FB_OFFSET + (w * h * 4)]
+        # BGRX to RGB without copying, the channel axis is simply reversed
+        self._image = pixels.reshape((h, w, 4))[:, :, 2::-1]
+
+    def get_rect(self):
+        return self._rect
+
+    def get_image(self):
+        return self._image
+
+    def snapshot(self):
+        return numpy.array(self._image)
+
+    def close(self):
+        """Drop the memory map, the file is closed once any images still
+        viewing it are gone too.
+        """
+        del self._image
+        del self._fb
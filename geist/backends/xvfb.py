@@ -1,56 +1,34 @@
 from __future__ import division, absolute_import, print_function
 
-import numpy
 import subprocess
 import time
 import os
 import shutil
-import struct
 from . import logger
 from ._x11_common import GeistXBase
+from ._xwd import XwdToNumpyReader, XwdToNumpyMemmapReader
 from ..finders import Location, LocationList
 
 
 XVFB_PATH = '/var/tmp/Xvfb_display%d'
 
 
-class XwdToNumpyReader(object):
-    _XWD_HEADER = struct.Struct('>lllllllhhhhhh')
-
-    def __init__(self, filename):
-        self._filename = filename
-        self._check_header()
-
-    def _read_dump(self):
-        return numpy.fromfile(open(self._filename, 'rb'), numpy.uint8)
-
-    def _check_header(self):
-        _, ver, _, planes = XwdToNumpyReader._XWD_HEADER.unpack_from(
-            self._read_dump()
-        )[:4]
-        assert ver == 7, "Only understand xwd version 7"
-        assert planes == 24, "Can only handle 24bit screens"
-
-    def _read_w_h_from_header(self, fb):
-        return XwdToNumpyReader._XWD_HEADER.unpack_from(fb)[4:6]
-
-    def get_rect(self):
-        w, h = self._read_w_h_from_header(self._read_dump())
-        return (0, 0, w, h)
-
-    def get_image(self):
-        fb = self._read_dump()
-        w, h = self._read_w_h_from_header(fb)
-        return fb[3232:].reshape((h, w, 4))[:, :, (2, 1, 0)]
-
-
 class GeistXvfbBackend(GeistXBase):
-    _FB_OFFSET = 3232
+    """Starts an Xvfb server and captures its screen from the frame buffer file.
+
+    With mmap=True the frame buffer is memory mapped once rather than read on
+    every capture. Captured images are then copied unless mmap_snapshot=False,
+    in which case they are views on the live frame buffer; this is fastest for
+    find and wait loops but means an image won't keep its content once the
+    screen changes (e.g. wait_for_image_change_* options can't see a change).
+    """
 
     def __init__(self, **kwargs):
         self.display_num = kwargs.get('display_num', None)
         width = kwargs.get('width', 1280)
         height = kwargs.get('height', 1024)
+        use_mmap = kwargs.get('mmap', False)
+        self._mmap_snapshot = kwargs.get('mmap_snapshot', True)
 
         if self.display_num is None:
             self._find_display()
@@ -79,7 +57,10 @@ class GeistXvfbBackend(GeistXBase):
                 raise Exception('Xvfb mmap file did not appear')
         time.sleep(1)
         GeistXBase.__init__(self, display=display)
-        self._xwd_reader = XwdToNumpyReader(fb_filepath)
+        if use_mmap:
+            self._xwd_reader = XwdToNumpyMemmapReader(fb_filepath)
+        else:
+            self._xwd_reader = XwdToNumpyReader(fb_filepath)
         logger.info("Started Xvfb with file in %s", self._display_dir)
 
     def _find_display(self):
@@ -91,12 +72,19 @@ class GeistXvfbBackend(GeistXBase):
             self.display_num += 1
 
     def capture_locations(self):
-        image = self._xwd_reader.get_image()
+        if self._mmap_snapshot and hasattr(self._xwd_reader, 'snapshot'):
+            image = self._xwd_reader.snapshot()
+        else:
+            image = self._xwd_reader.get_image()
         h, w = image.shape[:2]
         return LocationList([Location(0, 0, w, h, image=image)])
 
     def close(self):
         GeistXBase.close(self)
+        if hasattr(self, '_xwd_reader'):
+            if hasattr(self._xwd_reader, 'close'):
+                self._xwd_reader.close()
+            del self._xwd_reader
         if hasattr(self, '_xvfb_proc'):
             self._xvfb_proc.kill()
             self._xvfb_proc.wait()
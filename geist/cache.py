@@ -0,0 +1,108 @@
+from __future__ import division, absolute_import, print_function
+from collections import OrderedDict
+import hashlib
+import threading
+
+
+_MISSING = object()
+
+
+def array_digest(array):
+    """Return a hex digest of an array's dtype, shape and content
+    """
+    digest = hashlib.sha1()
+    digest.update(('%s%r' % (array.dtype.str, array.shape)).encode('ascii'))
+    digest.update(array.tobytes())
+    return digest.hexdigest()
+
+
+def template_digest(template):
+    """Return array_digest(template.image), remembered on the template so
+    that finding it again doesn't hash the whole image again.
+    """
+    image = template.image
+    remembered = getattr(template, '_image_digest', None)
+    if remembered is not None and remembered[0] is image:
+        return remembered[1]
+    digest = array_digest(image)
+    try:
+        template._image_digest = (image, digest)
+    except AttributeError:
+        pass
+    return digest
+
+
+def _nbytes(value):
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return getattr(value, 'nbytes', 0)
+
+
+class LRUByteCache(object):
+    """A least recently used cache bounded by the total size of its values.
+
+    The size of a value is its nbytes attribute (the sum of them for tuples and
+    lists) unless given explicitly when it is put. Values larger than max_bytes
+    are not cached at all. The cache can be shared between threads.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, nbytes = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = (value, nbytes)
+            return value
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = _nbytes(value)
+        with self._lock:
+            self._discard(key)
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted_nbytes) = self._entries.popitem(last=False)
+                self.nbytes -= evicted_nbytes
+
+    def get_or_create(self, key, factory):
+        """Return the value for key, calling factory to create it if needed
+        """
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.put(key, value)
+        return value
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        if key in self._entries:
+            _, nbytes = self._entries.pop(key)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def __repr__(self):
+        return "LRUByteCache of %d entries using %d of %d bytes" % (
+            len(self._entries), self.nbytes, self.max_bytes)
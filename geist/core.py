@@ -1,12 +1,16 @@
 from __future__ import division, absolute_import, print_function
 
 import time
+import random
 import logging
+from itertools import islice
+import numpy
 from hamcrest import (
     has_length, greater_than_or_equal_to, less_than_or_equal_to)
 from hamcrest.core.string_description import tostring as describe_to_string
 from .keyboard import KeyDown, KeyUp, KeyDownUp, keyboard_layout_factory
 from .finders import LocationList, Location
+from .vision import tile_checksums
 
 
 logger = logging.getLogger(__name__)
@@ -63,6 +67,39 @@ class _GuiOptionsHelper(object):
             raise NameError(item)
 
 
+class PollScheduler(object):
+    """Decides how long wait methods sleep between tries.
+
+    The first wait is min_interval and each following wait is backoff times
+    longer, up to max_interval. Each wait is shortened by a random fraction of
+    up to jitter so that many sessions don't poll in step. reset starts again
+    from min_interval.
+    """
+
+    def __init__(self, min_interval=0.01, max_interval=0.5, backoff=2,
+                 jitter=0.1, sleep=time.sleep, random=random.random):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self._sleep = sleep
+        self._random = random
+        self._interval = min_interval
+
+    def reset(self):
+        self._interval = self.min_interval
+
+    def wait(self, remaining=None):
+        """Sleep for the next interval, but no longer than remaining seconds
+        """
+        interval = self._interval * (1 - (self.jitter * self._random()))
+        if remaining is not None:
+            interval = min(interval, remaining)
+        if interval > 0:
+            self._sleep(interval)
+        self._interval = min(self._interval * self.backoff, self.max_interval)
+
+
 class GUI(object):
     """A high level facade combining finders and backends.
 
@@ -93,6 +130,24 @@ class GUI(object):
             The wait time after pressing a key.
         * key_up_wait [default 0.01 seconds]
             The wait time after releasing a key.
+        * reuse_unchanged_results [default False]
+            If True, methods which wait for results only re-run the finder
+            when the captured screen has changed since the last try, otherwise
+            the last results are used again. Only use this with finders whose
+            results depend on nothing but the screen (e.g. not
+            StopChangingFinder).
+        * poll_scheduler [default PollScheduler]
+            Called with the poll_* options below as keyword arguments to
+            create the object deciding how long to sleep between tries when
+            waiting, see PollScheduler for the interface.
+        * poll_min_interval [default 0.01 seconds]
+            The sleep after the first try and after the results change.
+        * poll_max_interval [default 0.5 seconds]
+            The longest sleep between tries.
+        * poll_backoff [default 2 times]
+            How much longer each sleep is than the one before.
+        * poll_jitter [default 0.1 fraction]
+            Sleeps are randomly shortened by up to this fraction.
 
     The following additional keyword options are supported on methods which
     take options:
@@ -111,8 +166,18 @@ class GUI(object):
             keyboard_layout = keyboard_layout_factory('default')
         self._keyboard_layout = keyboard_layout
 
-    def _find_all_gen(self, finder):
-        for in_location in self.capture_locations():
+    def _find_all_gen(self, finder, in_locations=None, limit=None):
+        results = self._find_each(finder, in_locations)
+        if limit is not None:
+            # Finders are generators, so they stop working once enough
+            # results have been taken
+            results = islice(results, limit)
+        return results
+
+    def _find_each(self, finder, in_locations):
+        if in_locations is None:
+            in_locations = self.capture_locations()
+        for in_location in in_locations:
             for loc in finder.find(in_location):
                 if (in_location.x, in_location.y) != (0, 0):
                     loc = loc.copy(
@@ -121,14 +186,25 @@ class GUI(object):
                     )
                 yield loc
 
+    def _create_poll_scheduler(self, merged_opts):
+        return merged_opts.poll_scheduler(
+            min_interval=merged_opts.poll_min_interval,
+            max_interval=merged_opts.poll_max_interval,
+            backoff=merged_opts.poll_backoff,
+            jitter=merged_opts.poll_jitter,
+        )
+
     def _wait_for_image_change(self, location, merged_opts):
+        scheduler = self._create_poll_scheduler(merged_opts)
         start_time = time.time()
         while True:
             updated_location = next(self._find_all_gen(location))
             if not location.equals_considering_only_image(updated_location):
                 return
-            if time.time() - start_time > merged_opts.timeout:
+            elapsed = time.time() - start_time
+            if elapsed > merged_opts.timeout:
                 raise NotFoundError("Image in %r didn't change" % (location,))
+            scheduler.wait(merged_opts.timeout - elapsed)
 
     def _move(self, actions, to_point, merged_opts):
         if merged_opts.mouse_warping:
@@ -184,23 +260,60 @@ class GUI(object):
     def find_all(self, finder):
         return LocationList(self._find_all_gen(finder))
 
-    def wait_find_with_result_matcher(self, finder, matcher, **options):
+    def _capture_fingerprint(self, in_locations):
+        return [(loc.rect, tile_checksums(loc.image)) for loc in in_locations]
+
+    def _fingerprints_equal(self, fingerprint1, fingerprint2):
+        if len(fingerprint1) != len(fingerprint2):
+            return False
+        for (rect1, checksums1), (rect2, checksums2) in zip(fingerprint1,
+                                                            fingerprint2):
+            if rect1 != rect2 or not numpy.array_equal(checksums1, checksums2):
+                return False
+        return True
+
+    def wait_find_with_result_matcher(self, finder, matcher, limit=None,
+                                      **options):
+        """Wait for the results of finder to match matcher. If limit is given
+        only up to that many results are found and matched.
+        """
+        merged_opts = self._opts.merge(options)
+        scheduler = self._create_poll_scheduler(merged_opts)
         start_time = time.time()
+        last_fingerprint = None
+        last_results = None
         while True:
-            results = self.find_all(finder)
+            in_locations = self.capture_locations()
+            if merged_opts.reuse_unchanged_results:
+                fingerprint = self._capture_fingerprint(in_locations)
+                if last_fingerprint is None or not self._fingerprints_equal(
+                        fingerprint, last_fingerprint):
+                    results = LocationList(
+                        self._find_all_gen(finder, in_locations, limit))
+                last_fingerprint = fingerprint
+            else:
+                results = LocationList(
+                    self._find_all_gen(finder, in_locations, limit))
             if matcher.matches(results):
                 return results
-            if time.time() - start_time > self._opts.merge(options).timeout:
+            elapsed = time.time() - start_time
+            if elapsed > merged_opts.timeout:
                 raise NotFoundError("Waited for results matching %s from %s."
                                     "Last result %r" % (
                                         describe_to_string(matcher),
                                         finder,
                                         results))
+            if last_results is not None and results != last_results:
+                scheduler.reset()
+            last_results = results
+            scheduler.wait(merged_opts.timeout - elapsed)
 
     def wait_find_n(self, n, finder, **options):
+        # One more than n is enough to know there are too many
         return self.wait_find_with_result_matcher(
             finder,
             has_length(n),
+            limit=n + 1,
             **options
         )
 
@@ -305,13 +418,14 @@ class GUI(object):
                     raise ValueError('Key action must be a KeyUp or KeyDown')
 
     def exists(self, finder):
-        return True if self.find_all(finder) else False
+        return True if list(self._find_all_gen(finder, limit=1)) else False
 
     def exists_within_timeout(self, finder, **options):
         try:
             self.wait_find_with_result_matcher(
                 finder,
                 has_length(greater_than_or_equal_to(1)),
+                limit=1,
                 **options
             )
             return True
@@ -323,6 +437,7 @@ class GUI(object):
             self.wait_find_with_result_matcher(
                 finder,
                 has_length(less_than_or_equal_to(0)),
+                limit=1,
                 **options
             )
             return True
@@ -5,6 +5,13 @@ import numpy as np
 from .finders import BaseFinder
 
 
+def _find_array(finder, in_location):
+    find_array = getattr(finder, 'find_array', None)
+    if find_array is None:
+        return None
+    return find_array(in_location)
+
+
 class BinaryFractionFilter(BaseFinder):
     def __init__(self, finder, binaryfier, fraction):
         self.finder = finder
@@ -32,11 +39,32 @@ class BinaryFractionFilter(BaseFinder):
 
         
 class LocationFinderFilter(BaseFinder):
-    def __init__(self, filter_func, finder):
+    """
+    Filter found locations with filter_func. If vectorised, filter_func also
+    works on a whole LocationArray at once (see LocationArray.filtered), and
+    is called once for all the locations when finder can find them in bulk.
+    Otherwise locations are filtered one at a time as they are found, so
+    filter_func is only called for as many as are needed.
+    """
+    def __init__(self, filter_func, finder, vectorised=False):
         self.filter_func = filter_func
         self.finder = finder
+        self.vectorised = vectorised
+
+    def find_array(self, in_location):
+        if not self.vectorised:
+            return None
+        locations = _find_array(self.finder, in_location)
+        if locations is None:
+            return None
+        return locations.filtered(self.filter_func, vectorised=True)
 
     def find(self, in_location):
+        locations = self.find_array(in_location)
+        if locations is not None:
+            for loc in locations:
+                yield loc
+            return
         for loc in self.finder.find(in_location):
             if self.filter_func(loc):
                 yield loc
@@ -50,19 +78,31 @@ class LocationFinderFilter(BaseFinder):
 
 class SortingFinder(BaseFinder):
     """
-    Sort found locations with the given key
+    Sort found locations with the given key. If vectorised, key also works on
+    a whole LocationArray at once (see LocationArray.sorted).
     """
-    def __init__(self, finder, key, reverse=False):
+    def __init__(self, finder, key, reverse=False, vectorised=False):
         self.finder = finder
         self.key = key
         self.reverse = reverse
+        self.vectorised = vectorised
+
+    def find_array(self, in_location):
+        locations = _find_array(self.finder, in_location)
+        if locations is None:
+            return None
+        return locations.sorted(self.key, reverse=self.reverse,
+                                vectorised=self.vectorised)
 
     def find(self, in_location):
-        for loc in sorted(
-            self.finder.find(in_location),
-            key=self.key,
-            reverse=self.reverse
-        ):
+        locations = self.find_array(in_location)
+        if locations is None:
+            locations = sorted(
+                self.finder.find(in_location),
+                key=self.key,
+                reverse=self.reverse
+            )
+        for loc in locations:
             yield loc
 
     def __repr__(self):
@@ -71,19 +111,43 @@ class SortingFinder(BaseFinder):
 
 class SliceFinderFilter(BaseFinder):
     """
-    Slice the returned results
+    Slice the returned results. As the results are found lazily, negative
+    start, stop and step are not supported.
     """
 
     def __init__(self, finder, slice=None):
         self.finder = finder
         self.slice = slice
 
+    def _check_slice(self):
+        for value in [self.slice.start, self.slice.stop]:
+            if value is not None and value < 0:
+                raise ValueError('negative slice %r of found locations' % (
+                    self.slice,))
+        if self.slice.step is not None and self.slice.step < 1:
+            raise ValueError('slice step %r of found locations must be '
+                             'positive' % (self.slice.step,))
+
+    def find_array(self, in_location):
+        if self.slice is not None:
+            self._check_slice()
+        locations = _find_array(self.finder, in_location)
+        if locations is None or self.slice is None:
+            return locations
+        return locations[self.slice]
+
     def find(self, in_location):
         if self.slice is None:
             for loc in self.finder.find(in_location):
                 yield loc
             return
 
+        locations = self.find_array(in_location)
+        if locations is not None:
+            for loc in locations:
+                yield loc
+            return
+
         for loc in islice(self.finder.find(in_location),
                           self.slice.start, self.slice.stop, self.slice.step):
             yield loc
@@ -104,20 +168,20 @@ class SliceFinderFilter(BaseFinder):
 
 
 left_most = lambda finder: SliceFinderFilter(
-    SortingFinder(finder, lambda loc: loc.x)
+    SortingFinder(finder, lambda loc: loc.x, vectorised=True)
 )[0]
 
 
 right_most = lambda finder: SliceFinderFilter(
-    SortingFinder(finder, lambda loc: loc.x, reverse=True)
+    SortingFinder(finder, lambda loc: loc.x, reverse=True, vectorised=True)
 )[0]
 
 
 top_most = lambda finder: SliceFinderFilter(
-    SortingFinder(finder, lambda loc: loc.y)
+    SortingFinder(finder, lambda loc: loc.y, vectorised=True)
 )[0]
 
 
 bottom_most = lambda finder: SliceFinderFilter(
-    SortingFinder(finder, lambda loc: loc.y, reverse=True)
+    SortingFinder(finder, lambda loc: loc.y, reverse=True, vectorised=True)
 )[0]
@@ -6,6 +6,7 @@ class BaseFinder(object):
     """
     Base class for all finders.
     """
+    __slots__ = ()
 
     def find(self, in_location):
         raise NotImplemented(
@@ -14,12 +15,29 @@ class BaseFinder(object):
     def find_list(self, in_location, **kwargs):
         return list(self.find(in_location, **kwargs))
 
+    def find_array(self, in_location):
+        """Return everything found in in_location as a LocationArray, or None
+        if this finder can not produce its results in bulk.
+        """
+        return None
+
 
 class Location(BaseFinder):
+    __slots__ = ('_rel_x', '_rel_y', '_w', '_h', '_x', '_y',
+                 '_main_point_offset', '_parent', '_image', '_score',
+                 '_root', '_root_x', '_root_y')
+
     def __init__(self, rel_x, rel_y, w=1, h=1, main_point_offset=None,
-                 parent=None, image=None):
+                 parent=None, image=None, score=None):
         """rel_x, rel_y, w, h are all cast to integers as its assumed we are
         dealing with whole pixels.
+
+        score is how well the location matched, for finders which rank their
+        results. It is not considered when comparing locations.
+
+        The absolute position and the position within the top most parent, the
+        root, are worked out here so that reading them does not need to walk
+        the chain of parents.
         """
         rel_x, rel_y, w, h = int(rel_x), int(rel_y), int(w), int(h)
 
@@ -36,12 +54,16 @@ class Location(BaseFinder):
         if parent is not None and rel_y + h > parent.h:
             raise ValueError('rel_y + h must be <= parent.h or parent must be None')
 
-        self._rel_x, self._rel_y, self._w, self._h = (
-            int(rel_x),
-            int(rel_y),
-            int(w),
-            int(h)
-        )
+        self._rel_x, self._rel_y, self._w, self._h = rel_x, rel_y, w, h
+
+        if parent is None:
+            self._x, self._y = rel_x, rel_y
+            self._root, self._root_x, self._root_y = None, 0, 0
+        else:
+            self._x, self._y = rel_x + parent.x, rel_y + parent.y
+            self._root = getattr(parent, '_root', None) or parent
+            self._root_x = self._x - self._root.x
+            self._root_y = self._y - self._root.y
 
         if main_point_offset is None:
             self._main_point_offset = (w // 2, h // 2)
@@ -54,6 +76,16 @@ class Location(BaseFinder):
                 raise AssertionError('image width and height should be the '
                                      'same as the locations')
         self._image = image
+        self._score = score
+
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in Location.__slots__)
+        state.update(getattr(self, '__dict__', {}))
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
 
     @property
     def parent(self):
@@ -61,17 +93,17 @@ class Location(BaseFinder):
 
     @property
     def image(self):
-        if self.w < 1 or self.h < 1:
-            raise AttributeError(
-                "Can not get image from Locations with zero width or height"
-            )
-        if self.parent is not None:
-            return self.parent.image[self.rel_y:self.rel_y + self.h,
-                                     self.rel_x:self.rel_x + self.w]
+        if self._root is not None:
+            return self._root.image[self._root_y:self._root_y + self._h,
+                                    self._root_x:self._root_x + self._w]
         if self._image is not None:
             return self._image
         else:
-            return np.zeros((self.h, self.w, 3), dtype=np.uint8)
+            return np.zeros((self._h, self._w, 3), dtype=np.uint8)
+
+    @property
+    def score(self):
+        return self._score
 
     @property
     def rel_x(self):
@@ -83,17 +115,11 @@ class Location(BaseFinder):
 
     @property
     def x(self):
-        if self.parent is None:
-            return self.rel_x
-        else:
-            return self.rel_x + self.parent.x
+        return self._x
 
     @property
     def y(self):
-        if self.parent is None:
-            return self.rel_y
-        else:
-            return self.rel_y + self.parent.y
+        return self._y
 
     @property
     def w(self):
@@ -105,18 +131,23 @@ class Location(BaseFinder):
 
     def find(self, in_location):
         if (
-            self.rel_x + self.w <= in_location.x + in_location.w
+            self._rel_x + self._w <= in_location.x + in_location.w
         ) and (
-            self.rel_y + self.h <= in_location.y + in_location.h
+            self._rel_y + self._h <= in_location.y + in_location.h
         ):
             yield self.copy(parent=in_location)
 
     def copy(self, **update_attrs):
         attrs = dict(
-            (attr, getattr(self, attr)) for attr in
-            ['rel_x', 'rel_y', 'w', 'h', 'main_point_offset', 'parent']
+            rel_x=self._rel_x,
+            rel_y=self._rel_y,
+            w=self._w,
+            h=self._h,
+            main_point_offset=self._main_point_offset,
+            parent=self._parent,
+            image=self._image,
+            score=self._score,
         )
-        attrs['image'] = self._image
         attrs.update(update_attrs)
         return Location(**attrs)
 
@@ -127,43 +158,50 @@ class Location(BaseFinder):
     @property
     def main_point(self):
         return (
-            self.x + self._main_point_offset[0],
-            self.y + self._main_point_offset[1]
+            self._x + self._main_point_offset[0],
+            self._y + self._main_point_offset[1]
         )
 
     @property
     def center(self):
-        return (self.x + (self.w // 2), self.y + (self.h // 2))
+        return (self._x + (self._w // 2), self._y + (self._h // 2))
 
     @property
     def rect(self):
-        return (self.x, self.y, self.w, self.h)
+        return (self._x, self._y, self._w, self._h)
 
     @property
     def area(self):
-        return self.w * self.h
+        return self._w * self._h
 
     def __repr__(self):
-        return "Location(x=%r, y=%r, w=%r, h=%r, main_point_offset=%r, parent=%r)" % (
-            self.x,
-            self.y,
-            self.w,
-            self.h,
+        # Only the rectangle of the parent is shown, as formatting every
+        # parent in turn gets slow and unreadable for deeply nested locations
+        if self._parent is None:
+            parent = None
+        else:
+            parent = 'Location(x=%r, y=%r, w=%r, h=%r, ...)' % (
+                self._parent.rect)
+        return "Location(x=%r, y=%r, w=%r, h=%r, main_point_offset=%r, parent=%s)" % (
+            self._x,
+            self._y,
+            self._w,
+            self._h,
             self._main_point_offset,
-            self.parent,
+            parent,
         )
 
     def equals_considering_only_image(self, other):
         return np.all(np.equal(self.image, other.image))
 
     def __eq__(self, other):
-        if self.parent != other.parent:
-            return False
         if ((self.rel_x, self.rel_y, self.w, self.h) !=
                 (other.rel_x, other.rel_y, other.w, other.h)):
             return False
         if self.main_point_offset != other.main_point_offset:
             return False
+        if self.parent is not other.parent and self.parent != other.parent:
+            return False
         return True
 
     def __ne__(self, other):
@@ -177,3 +215,184 @@ class LocationList(list, BaseFinder):
                 yield next(loc.find(in_location))
             except StopIteration:
                 pass
+
+
+def _as_column(values, dtype=int):
+    return np.asarray(values, dtype=dtype).reshape(-1)
+
+
+class LocationArray(BaseFinder):
+    """Many locations with the same parent, held as numpy columns rather than
+    as Location objects.
+
+    rel_x, rel_y, w, h and score (which may be None when the locations are not
+    scored) are arrays with one entry per location. Indexing with an integer
+    creates the Location, while slices, boolean masks and arrays of indices
+    return a smaller LocationArray, so that large numbers of results can be
+    filtered, sorted and sliced before any Location is made.
+    """
+
+    def __init__(self, rel_x, rel_y, w, h, score=None, parent=None):
+        self._rel_x = _as_column(rel_x)
+        self._rel_y = _as_column(rel_y)
+        self._w = _as_column(w)
+        self._h = _as_column(h)
+        self._score = None if score is None else _as_column(score, float)
+        self._parent = parent
+        n = len(self._rel_x)
+        if not (len(self._rel_y) == len(self._w) == len(self._h) == n):
+            raise ValueError('rel_x, rel_y, w and h must be the same length')
+        if self._score is not None and len(self._score) != n:
+            raise ValueError('score must be the same length as rel_x')
+
+    @classmethod
+    def from_locations(cls, locations, parent=None):
+        """Make a LocationArray of locations relative to parent. Only the
+        rectangles and scores of the locations are kept.
+        """
+        locations = list(locations)
+        px, py = (0, 0) if parent is None else (parent.x, parent.y)
+        scores = [loc.score for loc in locations]
+        if any(score is None for score in scores):
+            scores = None
+        return cls([loc.x - px for loc in locations],
+                   [loc.y - py for loc in locations],
+                   [loc.w for loc in locations],
+                   [loc.h for loc in locations],
+                   score=scores,
+                   parent=parent)
+
+    @property
+    def parent(self):
+        return self._parent
+
+    @property
+    def rel_x(self):
+        return self._rel_x
+
+    @property
+    def rel_y(self):
+        return self._rel_y
+
+    @property
+    def x(self):
+        if self.parent is None:
+            return self.rel_x
+        return self.rel_x + self.parent.x
+
+    @property
+    def y(self):
+        if self.parent is None:
+            return self.rel_y
+        return self.rel_y + self.parent.y
+
+    @property
+    def w(self):
+        return self._w
+
+    @property
+    def h(self):
+        return self._h
+
+    @property
+    def score(self):
+        return self._score
+
+    @property
+    def area(self):
+        return self.w * self.h
+
+    def __len__(self):
+        return len(self._rel_x)
+
+    def _location(self, i):
+        return Location(
+            self._rel_x[i],
+            self._rel_y[i],
+            self._w[i],
+            self._h[i],
+            parent=self._parent,
+            score=None if self._score is None else float(self._score[i])
+        )
+
+    def _take(self, index):
+        return LocationArray(
+            self._rel_x[index],
+            self._rel_y[index],
+            self._w[index],
+            self._h[index],
+            score=None if self._score is None else self._score[index],
+            parent=self._parent
+        )
+
+    def __getitem__(self, index):
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += len(self)
+            if not 0 <= index < len(self):
+                raise IndexError('LocationArray index out of range')
+            return self._location(index)
+        return self._take(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._location(i)
+
+    def _per_location(self, func, vectorised):
+        """Call func with each Location in turn or, if vectorised, once with
+        the whole array, which works for functions like lambda loc: loc.x that
+        only use the columns.
+        """
+        if not vectorised:
+            return [func(loc) for loc in self]
+        values = np.asarray(func(self))
+        if values.shape != (len(self),):
+            raise ValueError('%r gave shape %r for %d locations' % (
+                func, values.shape, len(self)))
+        return values
+
+    def filtered(self, predicate, vectorised=False):
+        """Return the locations for which predicate is true. If vectorised
+        predicate is called once with the whole array (see _per_location).
+        """
+        mask = np.asarray(self._per_location(predicate, vectorised),
+                          dtype=bool)
+        return self._take(mask.reshape(-1))
+
+    def sorted(self, key, reverse=False, vectorised=False):
+        """Return the locations sorted by key, in the same order as the builtin
+        sorted would give. If vectorised key is called once with the whole
+        array (see _per_location).
+        """
+        values = self._per_location(key, vectorised)
+        if isinstance(values, np.ndarray):
+            if reverse:
+                n = len(values)
+                order = n - 1 - np.argsort(values[::-1], kind='mergesort')
+                order = order[::-1]
+            else:
+                order = np.argsort(values, kind='mergesort')
+        else:
+            order = sorted(range(len(values)), key=values.__getitem__,
+                           reverse=reverse)
+        return self._take(np.asarray(order, dtype=int))
+
+    def _fits(self, in_location):
+        # The same test Location.find makes
+        return ((self.rel_x + self.w <= in_location.x + in_location.w) &
+                (self.rel_y + self.h <= in_location.y + in_location.h))
+
+    def find_array(self, in_location):
+        array = self._take(self._fits(in_location))
+        array._parent = in_location
+        return array
+
+    def find(self, in_location):
+        for loc in self.find_array(in_location):
+            yield loc
+
+    def to_list(self):
+        return LocationList(self)
+
+    def __repr__(self):
+        return "LocationArray of %d locations in %r" % (len(self), self.parent)
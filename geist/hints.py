@@ -0,0 +1,89 @@
+from __future__ import division, absolute_import, print_function
+from collections import deque
+from .finders import Location
+
+
+class RegionHint(object):
+    """Remembers where each template was last found so that the next search
+    can be limited to a small region around it.
+
+    For each key the bounding rectangles of the last history successful
+    searches are kept, most recent first. find searches each of these, padded
+    by padding pixels, in turn and returns the results of the first which has
+    any. Only if none do is the whole of in_location searched. This means that
+    while a template keeps being found near where it was last seen, copies of
+    it elsewhere on the screen are not returned.
+
+    hits counts searches answered from a hinted region, misses those where the
+    hinted regions were searched without success and cold those with no
+    history for the key, which always search the whole location.
+    """
+
+    def __init__(self, padding=32, history=4):
+        self.padding = padding
+        self.history = history
+        self._seen = {}
+        self.hits = 0
+        self.misses = 0
+        self.cold = 0
+
+    def find(self, key, find, in_location):
+        """Return a list of the results of find (a function of a location)
+        within in_location, trying the regions key was last seen in first.
+        """
+        seen = self._seen.get(key)
+        if seen:
+            for rect in list(seen):
+                region = self._region(rect, in_location)
+                if region is None:
+                    continue
+                results = [
+                    loc.copy(rel_x=loc.rel_x + region.rel_x,
+                             rel_y=loc.rel_y + region.rel_y,
+                             parent=in_location)
+                    for loc in find(region)
+                ]
+                if results:
+                    self.hits += 1
+                    self._record(key, results)
+                    return results
+            self.misses += 1
+        else:
+            self.cold += 1
+        results = list(find(in_location))
+        if results:
+            self._record(key, results)
+        return results
+
+    def _record(self, key, locations):
+        rect = (min(loc.x for loc in locations),
+                min(loc.y for loc in locations),
+                max(loc.x + loc.w for loc in locations),
+                max(loc.y + loc.h for loc in locations))
+        seen = self._seen.setdefault(key, deque(maxlen=self.history))
+        if rect in seen:
+            seen.remove(rect)
+        seen.appendleft(rect)
+
+    def _region(self, rect, in_location):
+        x1, y1, x2, y2 = rect
+        x1 = max(x1 - self.padding, in_location.x)
+        y1 = max(y1 - self.padding, in_location.y)
+        x2 = min(x2 + self.padding, in_location.x + in_location.w)
+        y2 = min(y2 + self.padding, in_location.y + in_location.h)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        return Location(x1 - in_location.x, y1 - in_location.y,
+                        x2 - x1, y2 - y1, parent=in_location)
+
+    def forget(self, key=None):
+        """Forget where key, or if not given every key, was seen
+        """
+        if key is None:
+            self._seen.clear()
+        else:
+            self._seen.pop(key, None)
+
+    def __repr__(self):
+        return "region hint with %d hits, %d misses and %d cold searches" % (
+            self.hits, self.misses, self.cold)
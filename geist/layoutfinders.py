@@ -1,5 +1,5 @@
 from __future__ import division, absolute_import, print_function
-from itertools import groupby
+import numpy
 from .finders import Location, BaseFinder
 
 
@@ -20,16 +20,121 @@ class FinderInFinder(BaseFinder):
         )
 
 
+class _LazyList(object):
+    """Iterates over the items of iterable, keeping them to iterate over
+    again, but only taking them from iterable as they are needed.
+    """
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._items = []
+
+    def __iter__(self):
+        i = 0
+        while True:
+            if i == len(self._items):
+                try:
+                    self._items.append(next(self._iterator))
+                except StopIteration:
+                    return
+            yield self._items[i]
+            i += 1
+
+
+class _LocationIndex(object):
+    """The locations sorted by each of their x, y, right and bottom edges, so
+    those within given bounds (see Operation.bounds) can be found with binary
+    searches rather than by looking at each one.
+    """
+    def __init__(self, locations):
+        self.locations = list(locations)
+        self._values = {
+            'x': numpy.array([loc.x for loc in self.locations]),
+            'y': numpy.array([loc.y for loc in self.locations]),
+            'right': numpy.array([loc.x + loc.w for loc in self.locations]),
+            'bottom': numpy.array([loc.y + loc.h for loc in self.locations]),
+        }
+        self._sorted = {}
+        for key, values in self._values.items():
+            order = numpy.argsort(values, kind='mergesort')
+            self._sorted[key] = (order, values[order])
+        self._max_w = max([loc.w for loc in self.locations] or [0])
+        self._max_h = max([loc.h for loc in self.locations] or [0])
+
+    def _with_edges_bounded(self, bounds):
+        # No location is wider or taller than the largest, so a bound on one
+        # edge bounds the other, which may give a narrower range
+        derived = {}
+        for start, end, size in [('x', 'right', self._max_w),
+                                 ('y', 'bottom', self._max_h)]:
+            start_low, start_high = bounds.get(start, (None, None))
+            end_low, end_high = bounds.get(end, (None, None))
+            if end_low is not None:
+                derived[start] = (end_low - size, None)
+            if start_high is not None:
+                derived[end] = (None, start_high + size)
+        return _intersect_bounds(bounds, derived)
+
+    def within(self, bounds):
+        """Return the locations within bounds, in their original order
+        """
+        return [self.locations[i] for i in self.indices_within(bounds)]
+
+    def indices_within(self, bounds):
+        """Return the indexes of the locations within bounds, in order
+        """
+        bounds = self._with_edges_bounded(bounds)
+        ranges = []
+        for key, (low, high) in bounds.items():
+            order, values = self._sorted[key]
+            start = 0 if low is None else numpy.searchsorted(values, low,
+                                                             'left')
+            stop = (len(values) if high is None else
+                    numpy.searchsorted(values, high, 'right'))
+            ranges.append((stop - start, key, start, stop))
+        # Take the locations in the narrowest range and check the others
+        _, key, start, stop = min(ranges)
+        indices = self._sorted[key][0][start:stop]
+        for other_key, (low, high) in bounds.items():
+            if other_key == key:
+                continue
+            values = self._values[other_key][indices]
+            mask = numpy.ones(len(indices), bool)
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+            indices = indices[mask]
+        return numpy.sort(indices)
+
+
 class LocationOperatorFinder(BaseFinder):
+    """Finds the locations found by a_finder for which operator is True with
+    any location found by b_finder.
+
+    If the operator knows the bounds the b locations must be within (see
+    Operation.bounds) the b locations are indexed after the first a, so each
+    following a is only checked against those within the bounds.
+    """
     def __init__(self, a_finder, operator, b_finder):
         self._operator = operator
         self._a_finder = a_finder
         self._b_finder = b_finder
 
     def find(self, in_location):
-        b_locations = list(self._b_finder.find(in_location))
-        for a_location in self._a_finder.find(in_location):
-            for b_location in b_locations:
+        # b is only found as far as is needed to find an a for it
+        b_locations = _LazyList(self._b_finder.find(in_location))
+        b_index = None
+        bounds_func = getattr(self._operator, 'bounds', None)
+        for i, a_location in enumerate(self._a_finder.find(in_location)):
+            # The first a may not need all of b, so isn't worth indexing for
+            bounds = bounds_func(a_location) if bounds_func and i else None
+            if bounds:
+                if b_index is None:
+                    b_index = _LocationIndex(b_locations)
+                candidates = b_index.within(bounds)
+            else:
+                candidates = b_locations
+            for b_location in candidates:
                 if self._operator(a_location, b_location):
                     yield a_location
                     break
@@ -42,7 +147,48 @@ class LocationOperatorFinder(BaseFinder):
         )
 
 
+def _intersect_bounds(a_bounds, b_bounds):
+    if a_bounds is None:
+        return b_bounds
+    if b_bounds is None:
+        return a_bounds
+    bounds = dict(a_bounds)
+    for key, (low, high) in b_bounds.items():
+        if key in bounds:
+            a_low, a_high = bounds[key]
+            if low is None or (a_low is not None and a_low > low):
+                low = a_low
+            if high is None or (a_high is not None and a_high < high):
+                high = a_high
+        bounds[key] = (low, high)
+    return bounds
+
+
+def _bounds_hull(a_bounds, b_bounds):
+    if a_bounds is None or b_bounds is None:
+        return None
+    bounds = {}
+    for key in set(a_bounds) & set(b_bounds):
+        (a_low, a_high), (b_low, b_high) = a_bounds[key], b_bounds[key]
+        low = None if a_low is None or b_low is None else min(a_low, b_low)
+        high = (None if a_high is None or b_high is None else
+                max(a_high, b_high))
+        bounds[key] = (low, high)
+    return bounds or None
+
+
 class Operation(object):
+    def bounds(self, a):
+        """Return the bounds which the b locations this is True for with a
+        must be within, or None if they could be anywhere.
+
+        The bounds are a dict from any of 'x', 'y', 'right' (x + w) and
+        'bottom' (y + h) to an inclusive (low, high) range, either of which
+        can be None for no limit. Being within them doesn't have to mean this
+        is True.
+        """
+        return None
+
     def __and__(self, other):
         return _and(self, other)
 
@@ -60,6 +206,9 @@ class _and(Operation):
     def __call__(self, a, b):
         return self.a_op(a, b) and self.b_op(a, b)
 
+    def bounds(self, a):
+        return _intersect_bounds(_bounds(self.a_op, a), _bounds(self.b_op, a))
+
     def __repr__(self):
         return "%r and %r" % (self.a_op, self.b_op)
 
@@ -71,6 +220,9 @@ class _or(Operation):
     def __call__(self, a, b):
         return self.a_op(a, b) or self.b_op(a, b)
 
+    def bounds(self, a):
+        return _bounds_hull(_bounds(self.a_op, a), _bounds(self.b_op, a))
+
     def __repr__(self):
         return "%r or %r" % (self.a_op, self.b_op)
 
@@ -86,20 +238,35 @@ class _invert(Operation):
         return "invert %r" % (self.a_op)
 
 
+def _bounds(op, a):
+    bounds_func = getattr(op, 'bounds', None)
+    return bounds_func(a) if bounds_func else None
+
+
 class _SimpleOperation(Operation):
-    def __init__(self, op_func, doc):
+    def __init__(self, op_func, doc, bounds_func=None):
         self.op_func, self.doc = op_func, doc
+        self.bounds_func = bounds_func
 
     def __call__(self, a, b):
         return self.op_func(a, b)
 
+    def bounds(self, a):
+        if self.bounds_func is None:
+            return None
+        return self.bounds_func(a)
+
     def __repr__(self):
         return self.doc
 
-below = _SimpleOperation(lambda a, b: b.y + b.h <= a.y, "is below")
-above = _SimpleOperation(lambda a, b: b.y >= (a.y + a.h), "is above")
-left_of = _SimpleOperation(lambda a, b: b.x + b.w >= a.x, "is left of")
-right_of = _SimpleOperation(lambda a, b: b.x <= (a.x + a.w), "is right of")
+below = _SimpleOperation(lambda a, b: b.y + b.h <= a.y, "is below",
+                         lambda a: {'bottom': (None, a.y)})
+above = _SimpleOperation(lambda a, b: b.y >= (a.y + a.h), "is above",
+                         lambda a: {'y': (a.y + a.h, None)})
+left_of = _SimpleOperation(lambda a, b: b.x + b.w >= a.x, "is left of",
+                           lambda a: {'right': (a.x, None)})
+right_of = _SimpleOperation(lambda a, b: b.x <= (a.x + a.w), "is right of",
+                            lambda a: {'x': (None, a.x + a.w)})
 
 
 class max_horizontal_separation(Operation):
@@ -115,6 +282,10 @@ class max_horizontal_separation(Operation):
             sep = 0
         return sep <= self.max_sep
 
+    def bounds(self, a):
+        return {'x': (None, a.x + a.w + self.max_sep),
+                'right': (a.x - self.max_sep, None)}
+
     def __repr__(self):
         return "has horizontal seperation less than or equal to %r" % (
             self.max_sep,
@@ -134,6 +305,10 @@ class max_vertical_separation(Operation):
             sep = 0
         return sep <= self.max_sep
 
+    def bounds(self, a):
+        return {'y': (None, a.y + a.h + self.max_sep),
+                'bottom': (a.y - self.max_sep, None)}
+
     def __repr__(self):
         return "has vertical seperation less than or equal to %r" % (
             self.max_sep,
@@ -147,26 +322,48 @@ not_intersects = ~intersects
 
 
 class MergeLocationsFinderFilter(BaseFinder):
+    """Merges the locations found by finder into groups, of those op is True
+    for with any other in the group (directly or through others), and yields
+    the bounding box of each group.
+
+    Groups are yielded in the order of the last location found in each. If op
+    knows its bounds (see Operation.bounds) the locations are indexed so only
+    those within each location's bounds are checked against it.
+    """
     def __init__(self, op, finder):
         self.op = op
         self.finder = finder
 
     def find(self, in_location):
-        number_grouped_locations = [[num, loc] for num, loc in
-                                    enumerate(self.finder.find(in_location))]
-        for group1 in number_grouped_locations:
-            groups = [group for group in number_grouped_locations if
-                      self.op(group1[1], group[1])]
-            groups.append(group1)
-            num_max = max(i[0] for i in groups)
-            for group in groups:
-                group[0] = num_max
-        for num, group in groupby(
-            sorted(number_grouped_locations),
-            lambda x: x[0]
-        ):
-            locations = [i[1] for i in group]
-            image = locations[0]._image
+        all_locations = list(self.finder.find(in_location))
+        # Union-find, each location's parent is itself for a group's root
+        parents = list(range(len(all_locations)))
+
+        def root(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        bounds_func = getattr(self.op, 'bounds', None)
+        index = _LocationIndex(all_locations) if bounds_func else None
+        for i, a in enumerate(all_locations):
+            bounds = bounds_func(a) if bounds_func else None
+            if bounds:
+                candidates = index.indices_within(bounds)
+            else:
+                candidates = range(len(all_locations))
+            for j in candidates:
+                a_root, b_root = root(i), root(j)
+                if a_root != b_root and self.op(a, all_locations[j]):
+                    # Roots are the last location in their group
+                    parents[min(a_root, b_root)] = max(a_root, b_root)
+
+        groups = {}
+        for i in range(len(all_locations)):
+            groups.setdefault(root(i), []).append(all_locations[i])
+        for last in sorted(groups):
+            locations = groups[last]
             x = min(loc.x for loc in locations)
             y = min(loc.y for loc in locations)
             w = max(loc.x + loc.w for loc in locations) - x
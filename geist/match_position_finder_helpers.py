@@ -7,6 +7,13 @@ def find_potential_match_regions(template, transformed_array, method='correlatio
        This function uses the definitions of the matching functions to calculate the expected match value
        and finds positions in the transformed array matching these- normalisation will then eliminate false positives
     """
+    condition = potential_match_mask(template, transformed_array, method=method, raw_tolerance=raw_tolerance)
+    return np.transpose(condition.nonzero())# trsnposition and omparison above take most time
+
+
+def potential_match_mask(template, transformed_array, method='correlation', raw_tolerance=0.666):
+    """As find_potential_match_regions, but returns a boolean array which is True at the potential match points
+    """
     if method == 'correlation':
         match_value  = np.sum(template**2) # this will be the value of the match in the
     elif method == 'squared difference':
@@ -16,9 +23,9 @@ def find_potential_match_regions(template, transformed_array, method='correlatio
         match_value = np.sum(temp_minus_mean**2)
     else:
         raise ValueError('Matching method not implemented')
-    condition = ((np.round(transformed_array, decimals=3)>=match_value*raw_tolerance) &
-                 (np.round(transformed_array, decimals=3)<=match_value*(1./raw_tolerance)))
-    return np.transpose(condition.nonzero())# trsnposition and omparison above take most time
+    rounded = np.round(transformed_array, decimals=3)
+    return ((rounded >= match_value*raw_tolerance) &
+            (rounded <= match_value*(1./raw_tolerance)))
 
 
 
@@ -38,6 +45,78 @@ def get_tiles_at_potential_match_regions(image, template, transformed_array, met
 
 
 
+###############################################
+
+# Score maps: these give the normalised value of every window of the image at once, indexed by the window's top
+# left pixel like the trimmed transformed arrays. The window sums they need come from summed-area tables, so each
+# window costs a few array lookups however big the template is.
+
+def summed_area_table(image):
+    """Returns the summed-area table (integral image) of image, padded with a row and column of zeros at the top
+       and left so table[y, x] is the sum of image[:y, :x]
+    """
+    h, w = image.shape
+    table = np.zeros((h + 1, w + 1))
+    np.cumsum(image, axis=0, dtype=np.float64, out=table[1:, 1:])
+    np.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+
+def window_sums(table, shape):
+    """Returns the sums of every window of size shape (h, w) of the image the summed-area table was made from,
+       indexed by the top left pixel of the window
+    """
+    h, w = shape
+    return table[h:, w:] - table[:-h, w:] - table[h:, :-w] + table[:-h, :-w]
+
+
+def _divide_where_positive(numerator, denominator):
+    # Windows where the denominator is zero (or rounding error) score zero rather than nan or inf
+    result = np.zeros(numerator.shape)
+    np.divide(numerator, denominator, out=result, where=denominator > 1e-6)
+    return result
+
+
+def normalised_correlation_map(image, template, transformed_array):
+    """Returns the correlation at every match position divided by the norms of the template and image window,
+       as normalise_correlation does for the match positions it is given
+    """
+    image = np.asarray(image, dtype=np.float64)
+    template_norm = np.linalg.norm(template)
+    image_norms = np.sqrt(np.maximum(window_sums(summed_area_table(image ** 2), template.shape), 0))
+    return _divide_where_positive(transformed_array, image_norms * template_norm)
+
+
+def normalised_correlation_coefficient_map(image, template, transformed_array):
+    """As normalised_correlation_map, but for the correlation coefficient, so the norms are of the template and
+       image window less their means
+    """
+    template_norm = np.linalg.norm(template - np.mean(template))
+    # The score doesn't depend on the image's mean, taking it away keeps the sums small so the variance of
+    # windows (the difference of two sums) is accurate
+    image = np.asarray(image, dtype=np.float64) - np.mean(image)
+    n = template.size
+    sums = window_sums(summed_area_table(image), template.shape)
+    sums_of_squares = window_sums(summed_area_table(image ** 2), template.shape)
+    image_norms = np.sqrt(np.maximum(sums_of_squares - (sums ** 2) / n, 0))
+    return _divide_where_positive(transformed_array, image_norms * template_norm)
+
+
+def squared_differences_map(image, template, transformed_array):
+    """Returns the sum of squared differences between the template and the image window at every match position,
+       from the correlation of the two
+    """
+    image = np.asarray(image, dtype=np.float64)
+    image_norms_squared = window_sums(summed_area_table(image ** 2), template.shape)
+    return -2 * transformed_array + image_norms_squared + np.sum(template ** 2)
+
+
+def points_in_mask(mask):
+    """Returns a list of the (row, column) points where mask is True
+    """
+    return [tuple(point) for point in np.transpose(mask.nonzero())]
+
+
 ###############################################
 
 # image tiles dict is of form match_point coord:tile at that point
@@ -1,4 +1,12 @@
-from .match_position_finder_helpers import get_tiles_at_potential_match_regions, normalise_correlation, normalise_correlation_coefficient, find_potential_match_regions
+from .match_position_finder_helpers import (
+    find_potential_match_regions,
+    potential_match_mask,
+    normalised_correlation_map,
+    normalised_correlation_coefficient_map,
+    squared_differences_map,
+    points_in_mask,
+)
+from .vision import rescale2avg
 from scipy.signal import fftconvolve
 from scipy.ndimage.measurements import label, find_objects
 import numpy as np
@@ -16,10 +24,10 @@ def match_via_correlation(image, template, raw_tolerance=1, normed_tolerance=0.9
     # trim the returned image, fftconvolve returns an image of width: (Temp_w-1) + Im_w + (Temp_w -1), likewise height
     correlation = correlation[th-1:h, tw-1:w]
     # find images regions which are potentially matches
-    match_position_dict = get_tiles_at_potential_match_regions(image, template, correlation, raw_tolerance=raw_tolerance)
+    potential_matches = potential_match_mask(template, correlation, raw_tolerance=raw_tolerance)
     # bright spots in images can lead to false positivies- the normalisation carried out here eliminates those
-    results = normalise_correlation(match_position_dict, correlation, template, normed_tolerance=normed_tolerance)
-    return results
+    normalised = normalised_correlation_map(image, template, correlation)
+    return points_in_mask(potential_matches & (np.round(normalised, decimals=3) >= normed_tolerance))
 
 
 def match_via_squared_difference(image, template, raw_tolerance=1, sq_diff_tolerance=0.1):
@@ -33,10 +41,11 @@ def match_via_squared_difference(image, template, raw_tolerance=1, sq_diff_toler
     # trim the returned image, fftconvolve returns an image of width: (Temp_w-1) + Im_w + (Temp_w -1), likewise height
     correlation = correlation[th-1:h, tw-1:w]
     # find images regions which are potentially matches
-    match_position_dict = get_tiles_at_potential_match_regions(image, template, correlation, raw_tolerance=raw_tolerance)
+    potential_matches = potential_match_mask(template, correlation, raw_tolerance=raw_tolerance)
     # bright spots in images can lead to false positivies- the normalisation carried out here eliminates those
-    results = calculate_squared_differences(match_position_dict, correlation, template, sq_diff_tolerance=sq_diff_tolerance)
-    return results
+    squared_differences = squared_differences_map(image, template, correlation)
+    cutoff = th*tw*255**2*sq_diff_tolerance
+    return points_in_mask(potential_matches & (np.round(squared_differences, decimals=3) <= cutoff))
 
 
 
@@ -53,10 +62,9 @@ def match_via_correlation_coefficient(image, template, raw_tolerance=1, normed_t
     temp_minus_mean = template - temp_mean
     convolution = fftconvolve(image, temp_minus_mean[::-1,::-1])
     convolution = convolution[th-1:h, tw-1:w]
-    match_position_dict = get_tiles_at_potential_match_regions(image, template, convolution, method='correlation coefficient', raw_tolerance=raw_tolerance)
-    # this is empty, so think condition is wrong
-    results = normalise_correlation_coefficient(match_position_dict, convolution, template, normed_tolerance=normed_tolerance)
-    return results
+    potential_matches = potential_match_mask(template, convolution, method='correlation coefficient', raw_tolerance=raw_tolerance)
+    normalised = normalised_correlation_coefficient_map(image, template, convolution)
+    return points_in_mask(potential_matches & (np.round(normalised, decimals=3) >= normed_tolerance))
 
 
 
@@ -75,8 +83,9 @@ def fuzzy_match(image, template, normed_tolerance=None, raw_tolerance=None, meth
 
        The raw_tolerance is the proportion of the value at match positions (i.e. the value returned for an exact match)
        that we count as a match. For fuzzy matching, this value will not be exactly the value returned for an exact match
-       N. B. Lowering raw_tolerance increases the number of potential match tiles requiring normalisation.
-       This DRAMATICALLY slows down matching as normalisation (a process which eliminates false positives)
+       N. B. Every position is normalised at once using summed-area tables, so lowering raw_tolerance no longer
+       slows down matching, it only lets more positions through to normalisation (a process which eliminates
+       false positives)
 
        The normed_tolerance is how far a potential match value can differ from one after normalisation.
 
@@ -111,6 +120,46 @@ def fuzzy_match(image, template, normed_tolerance=None, raw_tolerance=None, meth
 
 
 
+def pyramid_fuzzy_match(image, template, factor=2, coarse_tolerance=0.6, normed_tolerance=None, raw_tolerance=None,
+                        method='correlation'):
+    """As fuzzy_match, but first finds where the template might be using copies of the image and template shrunk by
+       factor (a power of 2) with rescale2avg, then only runs fuzzy_match on the regions of the image around them.
+
+       Candidates are the positions where the shrunk images' correlation coefficient is at least coarse_tolerance,
+       which is lower than the full size tolerances as shrinking blurs the template differently depending on how it
+       lines up. Matches which only score well for the 'correlation' method can be missed.
+    """
+    h, w = image.shape
+    th, tw = template.shape
+    # rescale2avg works on 8 bit images
+    coarse_image, coarse_template = image.astype(np.uint8), template.astype(np.uint8)
+    scale = 1
+    while scale < factor:
+        coarse_image, coarse_template = rescale2avg(coarse_image), rescale2avg(coarse_template)
+        scale *= 2
+    cth, ctw = coarse_template.shape
+    if cth < 2 or ctw < 2 or np.all(coarse_template == coarse_template.flat[0]):
+        # Too small or plain to tell anything from when shrunk
+        return fuzzy_match(image, template, normed_tolerance=normed_tolerance, raw_tolerance=raw_tolerance,
+                           method=method)
+    ch, cw = coarse_image.shape
+    convolution = fftconvolve(coarse_image, (coarse_template - np.mean(coarse_template))[::-1, ::-1])
+    scores = normalised_correlation_coefficient_map(coarse_image, coarse_template,
+                                                    convolution[cth-1:ch, ctw-1:cw])
+    # Search each group of candidates with a margin for the shrunk positions being out by up to a couple of pixels
+    margin = 2 * scale
+    results = set()
+    for (slice_y, slice_x) in find_objects(label(scores >= coarse_tolerance)[0]):
+        y1 = max(slice_y.start * scale - margin, 0)
+        x1 = max(slice_x.start * scale - margin, 0)
+        y2 = min((slice_y.stop - 1) * scale + th + margin, h)
+        x2 = min((slice_x.stop - 1) * scale + tw + margin, w)
+        for x, y in fuzzy_match(image[y1:y2, x1:x2], template, normed_tolerance=normed_tolerance,
+                                raw_tolerance=raw_tolerance, method=method):
+            results.add((x + x1, y + y1))
+    return sorted(results)
+
+
 def match_positions(shape, list_of_coords):
     """ In cases where we have multiple matches, each highlighted by a region of coordinates,
         we need to separate matches, and find mean of each to return as match position
@@ -3,9 +3,11 @@ import numpy
 from PIL import Image
 import math
 import json
+import os
 import logging
 from scipy.ndimage.measurements import label
 from scipy.ndimage import binary_erosion, binary_dilation
+from scipy.spatial import cKDTree
 
 logger = logging.getLogger(__name__)
 
@@ -164,8 +166,10 @@ def empty_span_line_segmentation(arr):
 def create_scaller_adjuster(data):
     mins = numpy.array([min(i) for i in zip(*data)], dtype=numpy.float64)
     maxs = numpy.array([max(i) for i in zip(*data)], dtype=numpy.float64)
-    scale = maxs - mins
+    return scaller_adjuster(mins, maxs - mins)
 
+
+def scaller_adjuster(mins, scale):
     def adjuster(d):
         return (d - mins) / scale
     return adjuster
@@ -257,6 +261,94 @@ def extract_properties(image):
     ], dtype=numpy.float64)
 
 
+def _projections(ids, xs, ys, weights, n, angle):
+    """Returns an array with a row for each of n images of the histogram of
+    their pixels projected onto the y axis after rotating them by angle
+    degrees, as ft_of_rotation would give. ids gives which image each pixel is
+    in. Each pixel's weight is split between the two nearest bins by how near
+    it is to each, rather than resampling the rotated image.
+    """
+    a = math.radians(angle)
+    sin, cos = math.sin(a), math.cos(a)
+    # So that 0 and 90 degrees give whole pixel positions
+    sin, cos = round(sin, 12), round(cos, 12)
+    positions = sin * xs + cos * ys
+    if len(positions):
+        positions = positions - numpy.floor(positions.min())
+    bins = numpy.floor(positions).astype(numpy.intp)
+    fractions = positions - bins
+    width = bins.max() + 2 if len(bins) else 2
+    index = ids * width + bins
+    histograms = (
+        numpy.bincount(index, weights * (1 - fractions), minlength=n * width) +
+        numpy.bincount(index + 1, weights * fractions, minlength=n * width)
+    )
+    return histograms.reshape((n, width))
+
+
+def _skew_and_kurtosis(histograms):
+    """ft_skew_and_kurtosis of each row of histograms"""
+    positions = numpy.arange(histograms.shape[1])
+    totals = fast_sum(histograms, 1)
+    mn = fast_sum(histograms * positions, 1) / totals
+    mn_adj = positions - mn[:, numpy.newaxis]
+    m2 = fast_sum(numpy.power(mn_adj, 2) * histograms, 1) / totals
+    m3 = fast_sum(numpy.power(mn_adj, 3) * histograms, 1) / totals
+    m4 = fast_sum(numpy.power(mn_adj, 4) * histograms, 1) / totals
+    flat = m2 == 0
+    m2 = numpy.where(flat, 1, m2)
+    return (numpy.where(flat, 0, m3 / m2 ** 1.5),
+            numpy.where(flat, 0, m4 / m2 ** 2.0 - 3))
+
+
+def projected_properties_many(images):
+    """Returns extract_properties of each of images, as rows of an array,
+    except that the projections at 30 and 60 degrees are worked out from the
+    positions of the pixels (see _projections) instead of by rotating the
+    images, which is much faster. The values differ slightly from
+    extract_properties at these angles, so a Classifier must be trained with
+    the same one it classifies with.
+    """
+    images = list(images)
+    n = len(images)
+    ids, xs, ys, weights = [], [], [], []
+    for i, image in enumerate(images):
+        y, x = numpy.nonzero(image)
+        ids.append(numpy.full(len(y), i, dtype=numpy.intp))
+        xs.append(x)
+        ys.append(y)
+        weights.append(image[y, x])
+    if n == 0:
+        return numpy.zeros((0, 10))
+    ids, xs, ys = (numpy.concatenate(a) for a in (ids, xs, ys))
+    weights = numpy.concatenate(weights).astype(numpy.float64)
+    totals = numpy.bincount(ids, weights, minlength=n)
+    properties = numpy.empty((n, 10), dtype=numpy.float64)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        properties[:, 0] = (numpy.bincount(ids, weights * ys, minlength=n) /
+                            totals /
+                            numpy.array([image.shape[0] for image in images]))
+        properties[:, 1] = totals / numpy.array([image.max()
+                                                 for image in images])
+        for column, angle in zip([2, 4, 6, 8], [0, 30, 60, 90]):
+            skew, kurtosis = _skew_and_kurtosis(
+                _projections(ids, xs, ys, weights, n, angle))
+            properties[:, column] = skew
+            properties[:, column + 1] = kurtosis
+    return properties
+
+
+def projected_properties(image):
+    return projected_properties_many([image])[0]
+
+
+# The names Classifier.to_json records for its properties_func
+PROPERTIES_FUNCS = {
+    'rotation': extract_properties,
+    'projection': projected_properties,
+}
+
+
 def split_characters(image, max_w_h_ratio=0.85):
     pimage = process(image)
     for x1, x2 in max_pixel_and_max_vertical_threshold_segmentation(pimage):
@@ -272,6 +364,11 @@ def split_characters(image, max_w_h_ratio=0.85):
             yield c
 
 
+def _split_region(task):
+    extract_func, image, max_w_h_ratio = task
+    return list(extract_func(image, max_w_h_ratio))
+
+
 def remove_subpixel_aa(image):
     image = image.repeat(3, 0)
     return image.reshape((image.shape[0], -1))
@@ -311,45 +408,174 @@ def best_n_distance_factory(n):
                 array_concat(((d2[:2] - d1[:2]) ** 2, diff[:n]))
             )
         )
+    # So that Classifier can use best_n_distances instead
+    best_n_distance.n = n
     return best_n_distance
 
 
+def best_n_distances(data, d, n):
+    """Returns the best_n_distance_factory(n) distance from each row of data to
+    d, or if d is 2d to each of its rows (as an array with a row for each row
+    of d and a column for each row of data).
+
+    Only the n smallest differences are needed, so they are picked out with
+    numpy.partition rather than by sorting.
+    """
+    d = numpy.asarray(d)
+    diff = (data[numpy.newaxis, :, :] -
+            numpy.atleast_2d(d)[:, numpy.newaxis, :]) ** 2
+    rest = diff[:, :, 2:]
+    if n < rest.shape[2]:
+        rest = numpy.partition(rest, max(n - 1, 0), axis=2)[:, :, :n]
+    distances = numpy.sqrt(fast_sum(diff[:, :, :2], 2) + fast_sum(rest, 2))
+    return distances if d.ndim == 2 else distances[0]
+
+
+# The most distances worked out at once, to bound the memory used
+DISTANCE_BLOCK_SIZE = 2 ** 20
+
+MODEL_FORMAT = 'geist classifier'
+MODEL_VERSION = 1
+
+
 class Classifier(object):
-    def __init__(self, cutoff=0.03):
-        self._data = []
+    """Classifies characters by the training data nearest to them.
+
+    If use_index is True, a k-d tree of the first two properties (which
+    best_n_distance always includes) is used to find only the training data
+    which can be within cut_off of a character, so characters are classified
+    without comparing them to all of it. The characters classified are the
+    same, but for unrecognised characters the nearest character reported (in
+    UnclassifiedCharacterError say) is only the nearest of those compared, or
+    None.
+
+    Characters are described by extract_properties or, if properties is
+    'projection', by projected_properties, which is much faster but gives
+    slightly different properties. Which was used is saved with the training
+    data and used again when it is loaded, and more data can only be trained
+    with the same one.
+
+    The training data can be saved as JSON (to_json) or, much faster to load,
+    as a directory of numpy arrays which are memory mapped by load, and so
+    shared between processes using the same model.
+    """
+    def __init__(self, cutoff=0.03, use_index=False, properties='rotation'):
+        self._set_data([], numpy.zeros((0, 10)))
         self.cut_off = cutoff
+        self.use_index = use_index
         self.distance_func = best_n_distance_factory(6)
         self.extract_func = split_characters
-        self.properties_func = extract_properties
+        self.properties_func = PROPERTIES_FUNCS[properties]
+        self._trained_with = None
 
     def train(self, image, text, max_w_h_ratio=0.85):
+        if (len(self._matrix) and
+                self.properties_func is not self._trained_with):
+            raise ValueError('can not add properties from %r to data trained '
+                             'with %r' % (self.properties_func,
+                                          self._trained_with))
         char_images = list(self.extract_func(image, max_w_h_ratio))
         assert len(char_images) == len(text), (
             "%d == %d" % (len(char_images), len(text))
         )
-        for c, im in zip(text, char_images):
-            self._data.append(
-                (c, self.properties_func(im))
-            )
-        self._normalize()
-
-    def _normalize(self):
-        self._adjuster = create_scaller_adjuster([d for c, d in self._data])
-        self._adjusted_data = [(c, self._adjuster(d)) for c, d in self._data]
+        properties = self._properties(char_images)
+        if len(self._matrix):
+            properties = numpy.vstack([self._matrix, properties])
+        self._set_data(list(self._labels) + list(text), properties)
+        self._trained_with = self.properties_func
+
+    def _set_data(self, labels, matrix, normaliser=None, adjusted_matrix=None):
+        """Use the training data of the characters labels with the properties
+        in the rows of matrix. normaliser is an array of the minimum and range
+        of each property, and adjusted_matrix matrix scaled by it, which are
+        worked out if not given.
+        """
+        if normaliser is None:
+            if len(matrix):
+                mins = matrix.min(0).astype(numpy.float64)
+                normaliser = numpy.array([mins, matrix.max(0) - mins])
+            else:
+                normaliser = numpy.zeros((2, matrix.shape[1]))
+        self._labels = labels
+        self._matrix = matrix
+        self._normaliser = normaliser
+        self._adjuster = scaller_adjuster(*normaliser)
+        if adjusted_matrix is None:
+            adjusted_matrix = self._adjuster(matrix)
+        self._adjusted_matrix = adjusted_matrix
+        self._tree = None
+
+    @property
+    def _data(self):
+        return list(zip(self._labels, self._matrix))
+
+    @property
+    def _adjusted_data(self):
+        return list(zip(self._labels, self._adjusted_matrix))
+
+    def _index(self):
+        if self._tree is None:
+            points = self._adjusted_matrix[:, :2]
+            if len(points) and numpy.all(numpy.isfinite(points)):
+                self._tree = cKDTree(points)
+        return self._tree
+
+    def _best(self, distances, indices=None):
+        distances = numpy.where(numpy.isnan(distances), numpy.inf, distances)
+        if len(distances) == 0:
+            return numpy.inf, None
+        best = distances.min()
+        nearest = numpy.flatnonzero(distances == best)
+        if indices is not None:
+            nearest = indices[nearest]
+        return best, min(self._labels[i] for i in nearest)
+
+    def _nearest(self, properties):
+        """Yields the (distance, character) of the nearest training data to
+        each row of properties, the character which sorts first if several
+        are as near.
+        """
+        adjusted = self._adjuster(properties)
+        n = getattr(self.distance_func, 'n', None)
+        if n is None:
+            for d2 in adjusted:
+                yield self._best(numpy.array([
+                    self.distance_func(d1, d2)
+                    for t, d1 in self._adjusted_data
+                ]))
+        elif (self.use_index and numpy.isfinite(self.cut_off) and
+                self._index() is not None):
+            # best_n_distance is at least the distance in the first two
+            # properties, so nothing outside this radius can be within cut_off
+            radius = self.cut_off * (1 + 1e-9)
+            for d2, near in zip(adjusted, self._index().query_ball_point(
+                    adjusted[:, :2], radius)):
+                near = numpy.array(near, dtype=int)
+                yield self._best(
+                    best_n_distances(self._adjusted_matrix[near], d2, n),
+                    near)
+        else:
+            size = self._adjusted_matrix.size
+            step = max(1, DISTANCE_BLOCK_SIZE // max(size, 1))
+            for start in range(0, len(adjusted), step):
+                for row in best_n_distances(self._adjusted_matrix,
+                                            adjusted[start:start + step], n):
+                    yield self._best(row)
+
+    def _properties(self, images):
+        if self.properties_func is projected_properties:
+            return projected_properties_many(images)
+        return numpy.array([self.properties_func(im) for im in images])
 
     def _classify(self, image, max_w_h_ratio=0.85):
-        for im in list(self.extract_func(image, max_w_h_ratio)):
-            d2 = self._adjuster(self.properties_func(im))
-            result = []
-            for t, d1 in self._adjusted_data:
-                dist = self.distance_func(d1, d2)
-                result.append((dist, t))
-            yield sorted(result)
+        images = list(self.extract_func(image, max_w_h_ratio))
+        if not images:
+            return iter([])
+        return self._nearest(self._properties(images))
 
-    def classify(self, image, unrecognised='ignore', max_w_h_ratio=0.85):
+    def _text(self, nearest, unrecognised):
         text = []
-        for dists in self._classify(image, max_w_h_ratio):
-            d, t = dists[0]
+        for d, t in nearest:
             if d > self.cut_off:
                 if unrecognised == 'ignore':
                     text.append('?')
@@ -359,21 +585,110 @@ class Classifier(object):
                 text.append(t)
         return ''.join(text)
 
+    def classify(self, image, unrecognised='ignore', max_w_h_ratio=0.85):
+        return self._text(self._classify(image, max_w_h_ratio), unrecognised)
+
+    def classify_many(self, image, rects, unrecognised='ignore',
+                      max_w_h_ratio=0.85, pool=None):
+        """Return the text in each of rects, (x, y, w, h) rectangles of
+        image, as classify would read it from that part of the image.
+
+        The regions are split into characters one at a time, with pool.map if
+        a pool is given, but the characters from all of them are classified
+        together, which is much faster than calling classify for each region
+        when there are many of them.
+        """
+        tasks = [(self.extract_func, image[y:y + h, x:x + w], max_w_h_ratio)
+                 for x, y, w, h in rects]
+        if pool is None:
+            regions = [_split_region(task) for task in tasks]
+        else:
+            regions = list(pool.map(_split_region, tasks))
+        images = [im for region in regions for im in region]
+        if images:
+            nearest = list(self._nearest(self._properties(images)))
+        else:
+            nearest = []
+        texts = []
+        start = 0
+        for region in regions:
+            texts.append(self._text(nearest[start:start + len(region)],
+                                    unrecognised))
+            start += len(region)
+        return texts
+
     def to_json(self):
-        return json.dumps(
-            {
-                'cut_off': self.cut_off,
-                'data': [(c, list(d)) for c, d in self._data]
-            }
-        )
+        obj = {
+            'cut_off': self.cut_off,
+            'data': [(c, d.tolist()) for c, d in self._data]
+        }
+        for name, func in PROPERTIES_FUNCS.items():
+            if func is self.properties_func:
+                obj['properties'] = name
+        return json.dumps(obj)
 
     def from_json(self, json_string):
         obj = json.loads(json_string)
         self.cut_off = obj['cut_off']
-        self._data = [
-            (c, numpy.array(d, dtype=numpy.float64)) for c, d in obj['data']
-        ]
-        self._normalize()
+        self._use_properties(obj.get('properties', 'rotation'))
+        data = obj['data']
+        if data:
+            matrix = numpy.array([d for c, d in data], dtype=numpy.float64)
+        else:
+            matrix = numpy.zeros((0, 10))
+        self._set_data([c for c, d in data], matrix)
+
+    def _use_properties(self, name):
+        # Classify with the properties the data was trained with, which are
+        # those of extract_properties for data saved before they were recorded
+        if self.properties_func in PROPERTIES_FUNCS.values():
+            self.properties_func = PROPERTIES_FUNCS[name]
+        self._trained_with = self.properties_func
+
+    def save(self, path):
+        """Save the training data to the directory path, to be loaded by load
+        """
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+        meta = {'format': MODEL_FORMAT, 'version': MODEL_VERSION,
+                'cut_off': self.cut_off}
+        for name, func in PROPERTIES_FUNCS.items():
+            if func is self.properties_func:
+                meta['properties'] = name
+        numpy.save(os.path.join(path, 'labels.npy'),
+                   numpy.array(list(self._labels), dtype='U'))
+        numpy.save(os.path.join(path, 'data.npy'),
+                   self._matrix.astype(numpy.float32))
+        numpy.save(os.path.join(path, 'adjusted.npy'),
+                   self._adjusted_matrix.astype(numpy.float32))
+        numpy.save(os.path.join(path, 'normaliser.npy'), self._normaliser)
+        with open(os.path.join(path, 'model.json'), 'w') as f:
+            f.write(json.dumps(meta))
+
+    def load(self, path, mmap_mode='r'):
+        """Load training data saved by save. The arrays are memory mapped,
+        read only, unless mmap_mode (see numpy.load) is None.
+        """
+        with open(os.path.join(path, 'model.json')) as f:
+            meta = json.loads(f.read())
+        if meta.get('format') != MODEL_FORMAT:
+            raise ValueError('%r is not a classifier model' % (path,))
+        if meta['version'] > MODEL_VERSION:
+            raise ValueError('%r is a newer version of classifier model' %
+                             (path,))
+        self.cut_off = meta['cut_off']
+        self._use_properties(meta.get('properties', 'rotation'))
+
+        def load_array(name):
+            return numpy.load(os.path.join(path, name + '.npy'),
+                              mmap_mode=mmap_mode)
+        self._set_data(load_array('labels'),
+                       load_array('data'),
+                       normaliser=load_array('normaliser'),
+                       adjusted_matrix=load_array('adjusted'))
 
     def _distances(self):
         sorted_data = sorted(self._adjusted_data)
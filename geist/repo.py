@@ -3,8 +3,19 @@ import numpy
 import os
 import os.path
 import glob
+import errno
+import json
+import logging
+import re
+import struct
+import shutil
+import tempfile
+from contextlib import contextmanager
+from .cache import LRUByteCache, array_digest, template_digest
 from .finders import BaseFinder
 
+logger = logging.getLogger(__name__)
+
 
 class Template(object):
     def __init__(self, image, name, repo):
@@ -12,43 +23,145 @@ class Template(object):
         self.name = name
         self.repo = repo
 
+    def derived(self, kind, build):
+        return derived_image(self, kind, build)
+
     def __repr__(self):
         return "template %r in repo %r" % (self.name, self.repo)
 
 
+# Increase when the images derived from templates would be built differently,
+# so that those stored in repos are built again
+DERIVED_VERSION = 1
+
+
+def derived_image(template, kind, build):
+    """Return build(template.image), kept in the template's repo if the repo
+    can store derived images.
+
+    kind names build and its parameters. The stored image is keyed by kind and
+    the content of the template image, so changing the template means it is
+    built again. Failing to load or store the image (say the repo is read
+    only) is logged but otherwise ignored.
+    """
+    image = template.image
+    repo = getattr(template, 'repo', None)
+    if not hasattr(repo, 'load_derived'):
+        return build(image)
+    kind = '%s v%d' % (kind, DERIVED_VERSION)
+    digest = template_digest(template)
+    try:
+        return repo.load_derived(kind, digest)
+    except KeyError:
+        pass
+    except Exception:
+        logger.warning('could not load %s of %r', kind, template,
+                       exc_info=True)
+    derived = build(image)
+    try:
+        repo.save_derived(kind, digest, derived)
+    except Exception:
+        logger.warning('could not store %s of %r', kind, template,
+                       exc_info=True)
+    return derived
+
+
 class DirectoryRepo(object):
-    def __init__(self, directory):
+    """Templates stored as .npy files in a directory.
+
+    If mmap_mode is given (see numpy.load) templates are memory mapped rather
+    than read into memory.
+
+    Images derived from the templates (see derived_image) found in the
+    .derived subdirectory are used, but new ones are only saved there if
+    store_derived is true, as finding templates shouldn't otherwise write to
+    the repo.
+    """
+    def __init__(self, directory, mmap_mode=None, store_derived=False):
         self.__directory = os.path.abspath(directory)
+        self.__mmap_mode = mmap_mode
+        self.__store_derived = store_derived
         self.__ensure_dir_exists()
 
     def __ensure_dir_exists(self):
         try:
             os.makedirs(self.__directory)
-        except:
-            pass
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
 
-    def __getitem__(self, key):
-        self.__ensure_dir_exists()
-        imgpath = os.path.join(self.__directory, key + '.npy')
-        if os.path.exists(imgpath):
-            return Template(numpy.load(imgpath), name=key, repo=self)
-        else:
+    def __path(self, key):
+        return os.path.join(self.__directory, key + '.npy')
+
+    def __derived_path(self, kind, digest):
+        return os.path.join(self.__directory, '.derived',
+                            re.sub(r'[^A-Za-z0-9]+', '_', kind),
+                            digest + '.npy')
+
+    def load_derived(self, kind, digest):
+        try:
+            return numpy.load(self.__derived_path(kind, digest),
+                              mmap_mode=self.__mmap_mode)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                raise KeyError((kind, digest))
+            raise
+
+    def save_derived(self, kind, digest, value):
+        if not self.__store_derived:
+            return
+        path = self.__derived_path(kind, digest)
+        directory = os.path.dirname(path)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Written under another name first so that other processes never
+        # load part of it
+        fd, temp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.save(f, value)
+            os.rename(temp_path, path)
+        except Exception:
+            os.remove(temp_path)
+            # On Windows another process may have saved it first
+            if not os.path.exists(path):
+                raise
+
+    def signature(self, key):
+        """Return a value which changes when the template key is changed
+        """
+        try:
+            stat = os.stat(self.__path(key))
+        except OSError:
             raise KeyError(key)
+        return (stat.st_mtime, stat.st_ctime, stat.st_size, stat.st_ino)
+
+    def __getitem__(self, key):
+        try:
+            image = numpy.load(self.__path(key), mmap_mode=self.__mmap_mode)
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                raise KeyError(key)
+            raise
+        return Template(image, name=key, repo=self)
 
     def __setitem__(self, key, value):
-        self.__ensure_dir_exists()
         if type(value) is numpy.ndarray:
-            numpy.save(os.path.join(self.__directory, key + '.npy'), value)
+            self.__ensure_dir_exists()
+            numpy.save(self.__path(key), value)
         else:
             raise ValueError('type not supported: %s' % (type(value),))
 
     def __delitem__(self, key):
-        self.__ensure_dir_exists()
-        imgpath = os.path.join(self.__directory, key + '.npy')
-        if os.path.exists(imgpath):
-            os.remove(imgpath)
-        else:
-            raise KeyError(key)
+        try:
+            os.remove(self.__path(key))
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                raise KeyError(key)
+            raise
 
     @property
     def entries(self):
@@ -62,13 +175,340 @@ class DirectoryRepo(object):
         return "directory repo %r" % (self.__directory, )
 
 
+_PACK_MAGIC = b'GEISTPK1'
+# magic, offset of the index and length of the index
+_PACK_HEADER = struct.Struct('<8sQQ')
+_PACK_ALIGNMENT = 64
+_PACK_DERIVED = '.derived/'
+
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+@contextmanager
+def _file_lock(path):
+    """Hold an exclusive lock on the file path, created if need be, while in
+    the with block, waiting for any other process holding it first.
+    """
+    with open(path, 'a+b') as f:
+        if fcntl is not None:
+            # Released when f is closed
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            yield
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class PackedRepo(object):
+    """Templates stored together in a single file, which is memory mapped so
+    that getting a template does not read or open anything.
+
+    The file starts with a header giving the position of a JSON index of the
+    name, offset, dtype and shape of each template. The templates follow the
+    header, each aligned to _PACK_ALIGNMENT bytes, and the index is after the
+    last of them. Writes append the new templates and a new index to the end of
+    the file then point the header at the new index, so templates which have
+    been replaced or deleted and old indexes are left as unused space until
+    compact is called. Use update to add many templates with one index.
+
+    Derived images are kept in the same file, under names starting with
+    _PACK_DERIVED which are not listed in entries. As with DirectoryRepo new
+    ones are only saved if store_derived is true.
+
+    Writers, in this process or others, take turns by locking the file path
+    with '.lock' appended, and read the index again once they have the lock.
+    Readers don't lock, they only ever see the index before or after a write.
+    """
+    def __init__(self, path, store_derived=False):
+        self.__path = os.path.abspath(path)
+        self.__store_derived = store_derived
+        self.__signature = None
+        if not self.__exists():
+            with _file_lock(self.__path + '.lock'):
+                if not self.__exists():
+                    with open(self.__path, 'wb') as f:
+                        self.__write_index(f, {}, _PACK_HEADER.size)
+        self.__refresh()
+
+    def __exists(self):
+        return (os.path.exists(self.__path) and
+                os.path.getsize(self.__path) > 0)
+
+    @contextmanager
+    def __lock(self):
+        with _file_lock(self.__path + '.lock'):
+            # Another writer may have changed the file without changing its
+            # signature, if both happened within the resolution of its mtime
+            self.__signature = None
+            self.__refresh()
+            yield
+
+    def __stat(self):
+        stat = os.stat(self.__path)
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def __refresh(self):
+        # Read the index again if the file has been changed, by us or anyone
+        # else, since it was last read
+        signature = self.__stat()
+        if signature == self.__signature:
+            return
+        with open(self.__path, 'rb') as f:
+            magic, offset, length = _PACK_HEADER.unpack(
+                f.read(_PACK_HEADER.size))
+            if magic != _PACK_MAGIC:
+                raise ValueError('%r is not a packed repo' % (self.__path,))
+            f.seek(offset)
+            self.__index = json.loads(f.read(length).decode('utf-8'))
+        self.__index_length = length
+        self.__data = numpy.memmap(self.__path, dtype=numpy.uint8, mode='r')
+        self.__signature = signature
+
+    def __write_index(self, f, index, end):
+        data = json.dumps(index, sort_keys=True).encode('utf-8')
+        f.seek(end)
+        f.write(data)
+        f.flush()
+        f.seek(0)
+        f.write(_PACK_HEADER.pack(_PACK_MAGIC, end, len(data)))
+
+    def __array(self, entry):
+        dtype = numpy.dtype(str(entry['dtype']))
+        shape = tuple(entry['shape'])
+        nbytes = int(numpy.prod(shape)) * dtype.itemsize
+        offset = entry['offset']
+        return numpy.asarray(
+            self.__data[offset:offset + nbytes]).view(dtype).reshape(shape)
+
+    def signature(self, key):
+        """Return a value which changes when the template key is changed
+        """
+        self.__refresh()
+        try:
+            return (self.__signature[2], self.__index[key]['offset'])
+        except KeyError:
+            raise KeyError(key)
+
+    def __getitem__(self, key):
+        self.__refresh()
+        try:
+            entry = self.__index[key]
+        except KeyError:
+            raise KeyError(key)
+        return Template(self.__array(entry), name=key, repo=self)
+
+    def load_derived(self, kind, digest):
+        self.__refresh()
+        try:
+            entry = self.__index['%s%s/%s' % (_PACK_DERIVED, kind, digest)]
+        except KeyError:
+            raise KeyError((kind, digest))
+        return self.__array(entry)
+
+    def save_derived(self, kind, digest, value):
+        if self.__store_derived:
+            self.update({'%s%s/%s' % (_PACK_DERIVED, kind, digest): value})
+
+    def update(self, templates):
+        """Add or replace every template in templates, a dict of name to image
+        """
+        for value in templates.values():
+            if type(value) is not numpy.ndarray or value.dtype.hasobject:
+                raise ValueError('type not supported: %s' % (type(value),))
+        if not templates:
+            return
+        with self.__lock():
+            with open(self.__path, 'r+b') as f:
+                self.__append(f, templates, dict(self.__index))
+            self.__refresh()
+
+    def __append(self, f, templates, index):
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        for key, value in templates.items():
+            offset = -(-end // _PACK_ALIGNMENT) * _PACK_ALIGNMENT
+            f.write(b'\0' * (offset - end))
+            f.write(numpy.ascontiguousarray(value).tobytes())
+            end = offset + value.nbytes
+            index[key] = dict(offset=offset,
+                              dtype=value.dtype.str,
+                              shape=list(value.shape))
+        self.__write_index(f, index, end)
+
+    def __setitem__(self, key, value):
+        self.update({key: value})
+
+    def __delitem__(self, key):
+        with self.__lock():
+            if key not in self.__index:
+                raise KeyError(key)
+            index = dict(self.__index)
+            del index[key]
+            with open(self.__path, 'r+b') as f:
+                f.seek(0, os.SEEK_END)
+                self.__write_index(f, index, f.tell())
+            self.__refresh()
+
+    @property
+    def unused_bytes(self):
+        """The number of bytes compact would free, roughly
+        """
+        self.__refresh()
+        used = sum(self.__array(entry).nbytes
+                   for entry in self.__index.values())
+        return (len(self.__data) - _PACK_HEADER.size - self.__index_length -
+                used)
+
+    def compact(self):
+        """Rewrite the file without the space left by replaced and deleted
+        templates, or the images derived from them
+        """
+        with self.__lock():
+            templates = dict((key, self.__array(entry))
+                             for key, entry in self.__index.items())
+            digests = set(array_digest(image)
+                          for key, image in templates.items()
+                          if not key.startswith(_PACK_DERIVED))
+            for key in list(templates):
+                if (key.startswith(_PACK_DERIVED) and
+                        key.rsplit('/', 1)[1] not in digests):
+                    del templates[key]
+            fd, path = tempfile.mkstemp(dir=os.path.dirname(self.__path))
+            try:
+                with os.fdopen(fd, 'w+b') as f:
+                    f.write(b'\0' * _PACK_HEADER.size)
+                    self.__append(f, templates, {})
+                shutil.copymode(self.__path, path)
+                # Let go of the old file before replacing it
+                del templates
+                self.__data = self.__signature = None
+                if os.name == 'nt':
+                    os.remove(self.__path)
+                os.rename(path, self.__path)
+            except:
+                os.remove(path)
+                raise
+            self.__refresh()
+
+    @property
+    def entries(self):
+        return list(self)
+
+    def __iter__(self):
+        self.__refresh()
+        return iter(sorted(key for key in self.__index
+                           if not key.startswith(_PACK_DERIVED)))
+
+    def __repr__(self):
+        return "packed repo %r" % (self.__path, )
+
+
+class CachingRepo(object):
+    """Keeps the templates of another repo in memory, up to max_bytes of them,
+    dropping the least recently used first.
+
+    If the repo has a signature method (as DirectoryRepo does) it is checked
+    on every access, so a template changed on disk is read again, but checking
+    is much cheaper than reading. The cached images are shared, so are made
+    read only.
+
+    DirectoryRepo's signature is the file's modification and change times,
+    size and inode, not its content. A file rewritten in place with the same
+    size within the resolution of the file system's times (a second or two on
+    FAT and some network file systems) is not noticed; clear the cache after
+    changing templates like that.
+    """
+    def __init__(self, repo, max_bytes=64 * 1024 * 1024):
+        self._repo = repo
+        self._cache = LRUByteCache(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    def _signature(self, key):
+        signature = getattr(self._repo, 'signature', None)
+        if signature is None:
+            return None
+        return signature(key)
+
+    def __getitem__(self, key):
+        signature = self._signature(key)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == signature:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        image = self._repo[key].image
+        image.flags.writeable = False
+        # The template itself is kept, so its digest is only worked out once
+        template = Template(image, name=key, repo=self)
+        self._cache.put(key, (signature, template), nbytes=image.nbytes)
+        return template
+
+    def __setitem__(self, key, value):
+        self._cache.discard(key)
+        self._repo[key] = value
+
+    def __delitem__(self, key):
+        self._cache.discard(key)
+        del self._repo[key]
+
+    def load_derived(self, kind, digest):
+        if not hasattr(self._repo, 'load_derived'):
+            raise KeyError((kind, digest))
+        return self._repo.load_derived(kind, digest)
+
+    def save_derived(self, kind, digest, value):
+        if hasattr(self._repo, 'save_derived'):
+            self._repo.save_derived(kind, digest, value)
+
+    def clear(self):
+        self._cache.clear()
+
+    @property
+    def entries(self):
+        return self._repo.entries
+
+    def __iter__(self):
+        return iter(self._repo)
+
+    def __repr__(self):
+        return "cached %r" % (self._repo,)
+
+
 class TemplateBasedFinder(BaseFinder):
-    def __init__(self, repo, name, finder_constructor):
+    """
+    Finds the template name in repo using the finder made for it by
+    finder_constructor.
+
+    If a hint (a RegionHint) is given, the template is first looked for near
+    where it was last found.
+    """
+    def __init__(self, repo, name, finder_constructor, hint=None):
         self._name = name
         self._repo = repo
         self._finder_constructor = finder_constructor
+        self._hint = hint
 
     def find(self, in_location):
+        if self._hint is None:
+            return self._find(in_location)
+        return iter(self._hint.find((repr(self._repo), self._name),
+                                    self._find, in_location))
+
+    def _find(self, in_location):
         for loc in self._finder_constructor(self._repo[self._name]).find(
             in_location
         ):
@@ -79,12 +519,14 @@ class TemplateBasedFinder(BaseFinder):
 
 
 class TemplateFinderFromRepo(object):
-    def __init__(self, repo, finder_constructor):
+    def __init__(self, repo, finder_constructor, hint=None):
         self._repo = repo
         self._finder_constructor = finder_constructor
+        self._hint = hint
 
     def __dir__(self):
         return self._repo.entries
 
     def __getattr__(self, name):
-        return TemplateBasedFinder(self._repo, name, self._finder_constructor)
+        return TemplateBasedFinder(self._repo, name, self._finder_constructor,
+                                   hint=self._hint)
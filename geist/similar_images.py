@@ -1,6 +1,7 @@
 # want to build a function which finds out if any image in repository is 'similar' to existing image.
 # use convolution
 from geist.vision import pad_bin_image_to_shape, grey_scale, find_edges
+from geist.match_position_finder_helpers import summed_area_table
 import numpy
 from numpy.fft import irfft2, rfft2
 
@@ -29,6 +30,9 @@ def matches_exist(template, image, tolerance=1):
         bin_image = pad_bin_image_to_shape(image, (ih, iw))
     if expected == 0:
         return []
+    # The template can not be covered by fewer pixels than it has
+    if numpy.count_nonzero(image) <= expected - tolerance:
+        return False
 
     # Calculate the convolution of the FFT's of the image & template
     convolution_freqs = rfft2(image) * rfft2(template[::-1, ::-1],
@@ -89,3 +93,141 @@ def find_similar_in_repo(template, repo, match_tolerance=1, size_tolerance=0.1):
             no_match.append(key)
     return similar, matches_different_size, no_match
 
+
+HASH_SIZE = 8
+_POPCOUNT = numpy.array([bin(i).count('1') for i in range(256)],
+                        dtype=numpy.uint8)
+
+
+def perceptual_hash(bin_image):
+    """Returns the bits, packed into HASH_SIZE ** 2 / 8 bytes, of whether each
+    of a HASH_SIZE by HASH_SIZE grid of blocks of the binary image has more
+    pixels set than the average block. Images which look alike have hashes
+    which differ in few bits.
+    """
+    h, w = bin_image.shape
+    # Repeat pixels so every block has at least one
+    bin_image = bin_image.repeat(-(-HASH_SIZE // h), axis=0)
+    bin_image = bin_image.repeat(-(-HASH_SIZE // w), axis=1)
+    h, w = bin_image.shape
+    ys = numpy.arange(HASH_SIZE + 1) * h // HASH_SIZE
+    xs = numpy.arange(HASH_SIZE + 1) * w // HASH_SIZE
+    table = summed_area_table(bin_image)[ys][:, xs]
+    sums = table[1:, 1:] - table[:-1, 1:] - table[1:, :-1] + table[:-1, :-1]
+    means = sums / numpy.outer(numpy.diff(ys), numpy.diff(xs))
+    return numpy.packbits(means > means.mean())
+
+
+def hamming_distances(hashes, target):
+    """Returns the number of bits by which each row of hashes differs from
+    target
+    """
+    return _POPCOUNT[numpy.bitwise_xor(hashes, target)].sum(axis=1)
+
+
+class SimilarImageIndex(object):
+    """An index of images which finds those similar to an image, in the sense of
+    is_similar, without comparing it to every image.
+
+    For each image the index keeps the binary image, its size, how many of its
+    pixels are set and its perceptual_hash. Only images of a similar size
+    (within size_tolerance, as compare_sizes tests), with enough pixels set to
+    contain the image being looked for are compared to it with is_similar, so
+    by default exactly the images is_similar accepts are found.
+
+    If max_distance is given only images with a hash differing in at most that
+    many bits are compared too. Many fewer images are compared, but images
+    is_similar would accept can be missed, as its tolerances don't bound how
+    much the hashes differ.
+    """
+    def __init__(self, repo=None, match_tolerance=1, size_tolerance=0.1,
+                 max_distance=None):
+        self.match_tolerance = match_tolerance
+        self.size_tolerance = size_tolerance
+        self.max_distance = max_distance
+        self._keys = []
+        self._bin_images = []
+        self._arrays = None
+        if repo is not None:
+            for key in repo:
+                self.add(key, repo[key].image)
+
+    def add(self, key, image):
+        self._keys.append(key)
+        self._bin_images.append(binarise_image(image))
+        self._arrays = None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _columns(self):
+        if self._arrays is None:
+            n = len(self._bin_images)
+            shapes = numpy.array([b.shape for b in self._bin_images],
+                                 dtype=int).reshape(n, 2)
+            counts = numpy.array([numpy.count_nonzero(b)
+                                  for b in self._bin_images], dtype=int)
+            hashes = numpy.array([perceptual_hash(b)
+                                  for b in self._bin_images],
+                                 dtype=numpy.uint8).reshape(n, -1)
+            self._arrays = shapes[:, 0], shapes[:, 1], counts, hashes
+        return self._arrays
+
+    def _candidates(self, bin_image, contained=True):
+        """Returns a mask of the images bin_image could be similar to, or if
+        contained is False of those which could be similar to it
+        """
+        hs, ws, counts, hashes = self._columns()
+        h, w = bin_image.shape
+        tolerance = self.size_tolerance
+        dh, dw = abs(hs - h), abs(ws - w)
+        mask = (((dh < tolerance * hs) | (dh < tolerance * h)) &
+                ((dw < tolerance * ws) | (dw < tolerance * w)))
+        if contained:
+            mask &= (counts >
+                     numpy.count_nonzero(bin_image) - self.match_tolerance)
+        if self.max_distance is not None:
+            mask &= (hamming_distances(hashes, perceptual_hash(bin_image)) <=
+                     self.max_distance)
+        return mask
+
+    def _is_similar(self, bin_template, bin_image):
+        return is_similar(bin_template, bin_image,
+                          match_tolerance=self.match_tolerance,
+                          size_tolerance=self.size_tolerance) is True
+
+    def find_similar(self, template):
+        """Returns the keys of the images template is similar to"""
+        bin_template = binarise_image(template)
+        return [self._keys[i]
+                for i in numpy.flatnonzero(self._candidates(bin_template))
+                if self._is_similar(bin_template, self._bin_images[i])]
+
+    def find_duplicates(self):
+        """Returns groups, each a list of at least two keys in the order they
+        were added, of images which are similar to each other, directly or
+        through other images in the group.
+        """
+        parents = list(range(len(self._keys)))
+
+        def root(i):
+            while parents[i] != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for i, bin_image in enumerate(self._bin_images):
+            candidates = self._candidates(bin_image, contained=False)
+            candidates[:i + 1] = False
+            for j in numpy.flatnonzero(candidates):
+                if root(i) == root(j):
+                    continue
+                if (self._is_similar(bin_image, self._bin_images[j]) or
+                        self._is_similar(self._bin_images[j], bin_image)):
+                    parents[root(j)] = root(i)
+        groups = {}
+        for i in range(len(self._keys)):
+            groups.setdefault(root(i), []).append(i)
+        return [[self._keys[i] for i in group]
+                for group in sorted(groups.values()) if len(group) > 1]
+
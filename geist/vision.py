@@ -1,8 +1,10 @@
 from __future__ import division
 from numpy.fft import irfft2, rfft2
+from .cache import LRUByteCache, array_digest
 import numpy
 import itertools
 import operator
+import zlib
 
 
 def subimage(rect, image):
@@ -53,12 +55,78 @@ OVERLAP_TABLE = {
 # If you get false matches consider reducing this number.
 ACCURACY_LIMIT = 2 ** (64 - 23)
 
+# Templates with at most this many pixels set are matched with
+# bitset_convolution rather than an FFT. Its cost grows with the number of
+# pixels it takes to rule out most positions, which for edges is a handful,
+# but for templates that fit nearly everywhere can approach the pixel count.
+BITSET_MAX_COUNT = 4096
+
+# Shared by all prepared templates, increase max_bytes if many templates are
+# matched against large screens, each FFT is about h * w * 8 bytes.
+TEMPLATE_CACHE = LRUByteCache(256 * 1024 ** 2)
+
+
+class PreparedTemplate(object):
+    """
+    A binary template with the values the convolutions need from it worked
+    out once.
+
+    The FFT of the template for each padded shape is kept in TEMPLATE_CACHE,
+    keyed by the template's content, so it is reused by any prepared template
+    with the same content.
+    """
+    def __init__(self, bin_template):
+        self.bin_template = bin_template
+        self.shape = bin_template.shape
+        self.count = numpy.count_nonzero(bin_template)
+        self.digest = array_digest(bin_template)
+
+    @property
+    def nbytes(self):
+        return self.bin_template.nbytes
+
+    def spectrum(self, shape):
+        shape = tuple(shape)
+
+        def create():
+            spectrum = rfft2(self.bin_template[::-1, ::-1], shape)
+            spectrum.flags.writeable = False
+            return spectrum
+        return TEMPLATE_CACHE.get_or_create(
+            ('spectrum', self.digest, shape), create)
+
+
+def prepare_template(bin_template):
+    if isinstance(bin_template, PreparedTemplate):
+        return bin_template
+    return PreparedTemplate(bin_template)
+
+
+def prepared_template_from_image(image, binarise, binarise_key, digest=None):
+    """
+    Return the PreparedTemplate of binarise(image).
+
+    The result is cached by binarise_key and the image content so, as long as
+    binarise_key identifies binarise and its parameters, the image is only
+    binarised once. digest is array_digest(image), if already known.
+    """
+    if digest is None:
+        digest = array_digest(image)
+    return TEMPLATE_CACHE.get_or_create(
+        ('prepared', binarise_key, digest),
+        lambda: PreparedTemplate(binarise(image))
+    )
+
 
 def best_convolution(bin_template, bin_image,
-                     tollerance=0.5, overlap_table=OVERLAP_TABLE):
+                     tollerance=0.5, overlap_table=OVERLAP_TABLE,
+                     bitset_max_count=BITSET_MAX_COUNT):
     """
     Selects and applies the best convolution method to find template in image.
 
+    Exact matches (a tollerance under 1) of templates with at most
+    bitset_max_count pixels set use bitset_convolution, which needs no FFT.
+
     Returns a list of matches in (width, height, x offset, y offset)
     format (where the x and y offsets are from the top left corner).
 
@@ -67,10 +135,13 @@ def best_convolution(bin_template, bin_image,
     grayscale values.
 
     This allows converting a sparse binary image into a dense(r) grayscale one.
+
+    bin_template can be a PreparedTemplate.
     """
 
-    template_sum = numpy.count_nonzero(bin_template)
-    th, tw = bin_template.shape
+    template = prepare_template(bin_template)
+    template_sum = template.count
+    th, tw = template.shape
     ih, iw = bin_image.shape
     if template_sum == 0 or th == 0 or tw == 0:
         # If we don't have a template
@@ -78,10 +149,12 @@ def best_convolution(bin_template, bin_image,
     if th > ih or tw > iw:
         # If the template is bigger than the image
         return []
+    if tollerance < 1 and template_sum <= bitset_max_count:
+        return bitset_convolution(template, bin_image)
 
     # How many cells can we split the image into?
     max_vert_cells = ih // th
-    max_hor_cells = iw // th
+    max_hor_cells = iw // tw
 
     # Try to work out how many times we can stack the image
     usable_factors = {n: factors for n, factors in overlap_table.iteritems()
@@ -93,17 +166,18 @@ def best_convolution(bin_template, bin_image,
                            n // factor <= max_hor_cells)]
     if not overlap_options:
         # We can't stack the image
-        return convolution(bin_template, bin_image, tollerance=tollerance)
+        return convolution(template, bin_image, tollerance=tollerance)
     best_overlap = min(overlap_options,
                        key=lambda x: ((ih // x[0] + th) * (iw // x[1] + tw)))
-    return overlapped_convolution(bin_template, bin_image,
+    return overlapped_convolution(template, bin_image,
                                   tollerance=tollerance, splits=best_overlap)
 
 
 def convolution(bin_template, bin_image, tollerance=0.5):
-    expected = numpy.count_nonzero(bin_template)
+    template = prepare_template(bin_template)
+    expected = template.count
     ih, iw = bin_image.shape
-    th, tw = bin_template.shape
+    th, tw = template.shape
 
     # Padd image to even dimensions
     if ih % 2 or iw % 2:
@@ -116,8 +190,7 @@ def convolution(bin_template, bin_image, tollerance=0.5):
         return []
 
     # Calculate the convolution of the FFT's of the image & template
-    convolution_freqs = rfft2(bin_image) * rfft2(bin_template[::-1, ::-1],
-                                                 bin_image.shape)
+    convolution_freqs = rfft2(bin_image) * template.spectrum(bin_image.shape)
     # Reverse the FFT to find the result image
     convolution_image = irfft2(convolution_freqs)
     # At this point, the maximum point in convolution_image should be the
@@ -135,6 +208,124 @@ def convolution(bin_template, bin_image, tollerance=0.5):
     return [((fx - (tw - 1)), (fy - (th - 1))) for (fy, fx) in match_points]
 
 
+def batched_convolution(bin_templates, bin_image, tollerance=0.5,
+                        max_batch_bytes=128 * 1024 ** 2):
+    """
+    Find each of several templates in image using one FFT of the image.
+
+    The image's spectrum is multiplied by each (cached) template spectrum and
+    the inverse FFTs are done in stacks of up to max_batch_bytes.
+
+    Returns a list of matches for each template, in the same format as
+    convolution, except that only matches fully inside the image are returned.
+    """
+    templates = [prepare_template(t) for t in bin_templates]
+    results = [[] for _ in templates]
+    ih, iw = bin_image.shape
+    todo = [(i, template) for i, template in enumerate(templates)
+            if template.count and
+            template.shape[0] <= ih and template.shape[1] <= iw]
+    if not todo:
+        return results
+
+    # Padd image to even dimensions
+    shape = (ih + ih % 2, iw + iw % 2)
+    image_freqs = rfft2(pad_bin_image_to_shape(bin_image, shape))
+    batch_size = max(1, max_batch_bytes // (image_freqs.nbytes +
+                                            (shape[0] * shape[1] * 8)))
+    for start in range(0, len(todo), batch_size):
+        batch = todo[start:start + batch_size]
+        convolution_images = irfft2(
+            numpy.array([image_freqs * template.spectrum(shape)
+                         for _, template in batch]),
+            shape
+        )
+        for (i, template), convolution_image in zip(batch,
+                                                    convolution_images):
+            th, tw = template.shape
+            expected = template.count
+            # Bottom right points of matches which are inside the image, so
+            # the indexes into this are the top left points
+            inside = convolution_image[th - 1:ih, tw - 1:iw]
+            found_bitmap = ((inside > (expected - tollerance)) &
+                            (inside < (expected + tollerance)))
+            results[i] = [(x, y) for (y, x) in
+                          numpy.transpose(numpy.nonzero(found_bitmap))]
+    return results
+
+
+def pack_rows(bin_image, words=None):
+    """
+    Pack each row of bin_image into words uint64s (by default as few as will
+    hold it), column x being bit 63 - x % 64 of word x // 64.
+    """
+    ih, iw = bin_image.shape
+    if words is None:
+        words = -(-iw // 64)
+    padded = numpy.zeros((ih, words * 64), bool)
+    padded[:, :iw] = bin_image[:, :words * 64]
+    return numpy.packbits(padded, axis=1).view('>u8').astype(numpy.uint64)
+
+
+def _shifted_words(packed, ys, ks, shift):
+    # The words of packed rows ys starting from bit shift of words ks
+    word, bit = divmod(shift, 64)
+    words = packed[ys, ks + word]
+    if bit:
+        words = ((words << numpy.uint64(bit)) |
+                 (packed[ys, ks + word + 1] >> numpy.uint64(64 - bit)))
+    return words
+
+
+def bitset_convolution(bin_template, bin_image):
+    """
+    Find template in image exactly, by testing 64 positions at a time with
+    the image's rows packed into uint64 bitsets.
+
+    For each position a word has a bit for, the word is ANDed with the image
+    row under each of the template's pixels in turn, so a bit survives only
+    where the template is entirely contained in the image. Words with no bits
+    left are dropped as they go, so after the first few template pixels very
+    few words are left to test. The cost depends mostly on the size of the
+    image and not on the template's size.
+
+    Returns the same matches as best_convolution, for binary images, but
+    only those fully inside the image.
+    """
+    template = prepare_template(bin_template)
+    th, tw = template.shape
+    ih, iw = bin_image.shape
+    if template.count == 0 or th > ih or tw > iw:
+        return []
+    max_x = iw - tw
+    # Enough words for every position, plus the template width beyond
+    words = max_x // 64 + 1
+    packed = pack_rows(bin_image != 0, words + -(-tw // 64) + 1)
+    ys, ks = numpy.mgrid[0:ih - th + 1, 0:words]
+    ys = ys.ravel()
+    ks = ks.ravel()
+    bits = numpy.full(ys.shape, ~numpy.uint64(0))
+    # Clear the bits for positions past max_x in the last word
+    bits[ks == words - 1] = ~numpy.uint64(0) << numpy.uint64(63 - max_x % 64)
+    # Visit the template's pixels in a fixed random order, pixels far apart
+    # rule positions out faster than neighbouring ones
+    pixels = numpy.transpose(numpy.nonzero(template.bin_template))
+    pixels = pixels[numpy.random.RandomState(0).permutation(len(pixels))]
+    for i, (ty, tx) in enumerate(pixels):
+        bits &= _shifted_words(packed, ys + ty, ks, tx)
+        if i % 8 == 7:
+            keep = bits != 0
+            ys, ks, bits = ys[keep], ks[keep], bits[keep]
+            if not len(bits):
+                return []
+    keep = bits != 0
+    ys, ks, bits = ys[keep], ks[keep], bits[keep]
+    match_words, match_bits = numpy.nonzero(numpy.unpackbits(
+        bits.astype('>u8').view(numpy.uint8)).reshape((-1, 64)))
+    return [(int(x), int(y)) for x, y in
+            zip(ks[match_words] * 64 + match_bits, ys[match_words])]
+
+
 def overlapped_convolution(bin_template, bin_image,
                            tollerance=0.5, splits=(4, 2)):
     """
@@ -146,18 +337,22 @@ def overlapped_convolution(bin_template, bin_image,
     We then apply the convolution to this 'stack' of images, and adjust the
     resultant position matches.
     """
-    th, tw = bin_template.shape
+    template = prepare_template(bin_template)
+    th, tw = template.shape
     ih, iw = bin_image.shape
     hs, ws = splits
     h = ih // hs
     w = iw // ws
-    count = numpy.count_nonzero(bin_template)
+    count = template.count
     assert count > 0
     assert h >= th
     assert w >= tw
 
-    yoffset = [(i * h, ((i + 1) * h) + (th - 1)) for i in range(hs)]
-    xoffset = [(i * w, ((i + 1) * w) + (tw - 1)) for i in range(ws)]
+    # The last sections also take the remainder of the image
+    yoffset = [(i * h, ((i + 1) * h) + (th - 1) if i < hs - 1 else ih)
+               for i in range(hs)]
+    xoffset = [(i * w, ((i + 1) * w) + (tw - 1) if i < ws - 1 else iw)
+               for i in range(ws)]
 
     # image_stacks is Origin (x,y), array, z (height in stack)
     image_stacks = [((x1, y1), bin_image[y1:y2, x1:x2], float((count + 1) ** (num)))
@@ -179,8 +374,7 @@ def overlapped_convolution(bin_template, bin_image,
 
     # Calculate the convolution of the FFT's of the overlapped image & template
     convolution_freqs = (rfft2(overlapped_image) *
-                         rfft2(bin_template[::-1, ::-1],
-                               overlapped_image.shape))
+                         template.spectrum(overlapped_image.shape))
 
     # Reverse the FFT to find the result overlapped image
     convolution_image = irfft2(convolution_freqs)
@@ -188,8 +382,11 @@ def overlapped_convolution(bin_template, bin_image,
     # bottom right (why?) of the area of greatest match
 
     results = set()
+    # Each point is the sum of the section's count times its num, with the
+    # lower sections adding at most num - 1, so the section's count is the
+    # floor of the division (allowing for rounding errors of under 0.5).
     for (x, y), _, num in image_stacks[::-1]:
-        test = convolution_image / num
+        test = numpy.floor((convolution_image + 0.5) / num)
         filtered = ((test >= (count - tollerance)) &
                    (test <= (count + tollerance)))
         match_points = numpy.transpose(numpy.nonzero(filtered))  # bottom right
@@ -197,10 +394,122 @@ def overlapped_convolution(bin_template, bin_image,
             if fx < (tw - 1) or fy < (th - 1):
                 continue
             results.add((x + fx - (tw - 1), y + fy - (th - 1)))
-        convolution_image %= num
+        convolution_image -= test * num
     return list(results)
 
 
+def _tile_convolution(args):
+    (x, y), bin_template, bin_tile, tollerance = args
+    th, tw = bin_template.shape
+    max_x = bin_tile.shape[1] - tw
+    max_y = bin_tile.shape[0] - th
+    return [(x + mx, y + my) for mx, my in
+            best_convolution(bin_template, bin_tile, tollerance=tollerance)
+            if 0 <= mx <= max_x and 0 <= my <= max_y]
+
+
+def tiled_convolution(bin_template, bin_image, tollerance=0.5,
+                      tile_size=(1024, 1024), pool=None):
+    """
+    Find template in image by matching it in each of a grid of tiles.
+
+    Tiles are tile_size (h, w) plus the template size - 1, so that they
+    overlap and every match fully inside the image is fully inside a tile.
+    Only such matches are returned. Peak memory is bounded by the tile size
+    rather than the image size.
+
+    The tiles are matched with pool.map, so pool can be a
+    concurrent.futures executor or a multiprocessing (thread) pool. Numpy's
+    FFT releases the GIL, so a thread pool is enough to use several cores.
+    Without a pool the tiles are matched one after another.
+
+    Returns a list of (x, y) top left points ordered by y then x.
+    """
+    template = prepare_template(bin_template)
+    th, tw = template.shape
+    ih, iw = bin_image.shape
+    if template.count == 0 or th > ih or tw > iw:
+        return []
+    tile_h, tile_w = tile_size
+    tasks = [((x, y), template,
+              bin_image[y:y + tile_h + th - 1, x:x + tile_w + tw - 1],
+              tollerance)
+             for y in range(0, ih - th + 1, tile_h)
+             for x in range(0, iw - tw + 1, tile_w)]
+    if pool is None:
+        tile_results = map(_tile_convolution, tasks)
+    else:
+        tile_results = pool.map(_tile_convolution, tasks)
+    results = set()
+    for tile_result in tile_results:
+        results.update(tile_result)
+    return sorted(results, key=lambda point: point[::-1])
+
+
+def or_pool(bin_image, factor, size=None):
+    """
+    Shrink bin_image by factor, each result pixel being True if any pixel of
+    the size x size (default factor x factor) block starting at factor times
+    its position is. The image is padded with False as needed.
+    """
+    if size is None:
+        size = factor
+    ih, iw = bin_image.shape
+    h = -(-ih // factor)
+    w = -(-iw // factor)
+    padded = numpy.zeros((h * factor + size - factor,
+                          w * factor + size - factor), bool)
+    padded[:ih, :iw] = bin_image
+    # OR each pixel with the size - factor pixels after it, so the blocks of
+    # factor pixels OR together blocks of size pixels
+    for axis in (0, 1):
+        dilated = padded.copy()
+        for i in range(1, size - factor + 1):
+            if axis == 0:
+                dilated[:-i] |= padded[i:]
+            else:
+                dilated[:, :-i] |= padded[:, i:]
+        padded = dilated
+    padded = padded[:h * factor, :w * factor]
+    return padded.reshape((h, factor, w, factor)).any(axis=3).any(axis=1)
+
+
+def pyramid_convolution(bin_template, bin_image, factor=2, tollerance=0.5):
+    """
+    Find template in image by first finding it in versions of both shrunk by
+    factor, then checking the few positions at full size that each of these
+    candidates stands for.
+
+    The shrunk image ORs together overlapping blocks of 2 * factor - 1 pixels,
+    so the template's shrunk edges are in it wherever the template's edges
+    are in the image, whatever the alignment, and no match is missed. Only
+    matches fully inside the image are returned.
+    """
+    template = prepare_template(bin_template)
+    th, tw = template.shape
+    ih, iw = bin_image.shape
+    if template.count == 0 or th > ih or tw > iw:
+        return []
+    coarse_template = TEMPLATE_CACHE.get_or_create(
+        ('or pooled', template.digest, factor),
+        lambda: PreparedTemplate(or_pool(template.bin_template, factor))
+    )
+    coarse_image = or_pool(bin_image, factor, size=2 * factor - 1)
+    max_x = iw - tw
+    max_y = ih - th
+    ys, xs = numpy.nonzero(template.bin_template)
+    results = []
+    for cx, cy in best_convolution(coarse_template, coarse_image,
+                                   tollerance=tollerance):
+        if not (0 <= cx * factor <= max_x and 0 <= cy * factor <= max_y):
+            continue
+        for y in range(cy * factor, min(cy * factor + factor, max_y + 1)):
+            for x in range(cx * factor, min(cx * factor + factor, max_x + 1)):
+                if numpy.all(bin_image[ys + y, xs + x]):
+                    results.append((x, y))
+    return results
+
+
 def get_possible_convolution_regions(bin_template, bin_image,
                                      tollerance=0.5, rescale=10):
     result = []
@@ -353,7 +662,7 @@ def rescale2avg(image):
     res = numpy.zeros(sub1.shape, numpy.uint32)
     res += sub1
     res += sub2
-    res /= 2
+    res //= 2
     return res.astype(numpy.uint8)
 
 
@@ -379,7 +688,7 @@ def rescale3avg(image):
     res += sub1
     res += sub2
     res += sub3
-    res /= 3
+    res //= 3
     return res.astype(numpy.uint8)
 
 
@@ -430,6 +739,30 @@ def grey_scale(image):
     return image.astype(numpy.int32).sum(axis=2) // 3
 
 
+def tile_checksums(image, tile_size=64):
+    """Fingerprint an image with a crc32 checksum per tile
+
+    Captures with equal checksums are (barring crc collisions) byte identical
+    and differing checksums show which tiles have changed.
+
+    :param image: input image
+    :type image: 2d or 3d :class:`numpy.ndarray`
+    :param tile_size: width and height of the square tiles
+    :rtype: 2d uint32 :class:`numpy.ndarray` of shape
+        (ceil(h / tile_size), ceil(w / tile_size))
+    """
+    h, w = image.shape[:2]
+    ys = range(0, h, tile_size)
+    xs = range(0, w, tile_size)
+    result = numpy.zeros((len(ys), len(xs)), numpy.uint32)
+    for row, y in enumerate(ys):
+        band = image[y:y + tile_size]
+        for col, x in enumerate(xs):
+            tile = numpy.ascontiguousarray(band[:, x:x + tile_size])
+            result[row, col] = zlib.crc32(tile.tobytes()) & 0xffffffff
+    return result
+
+
 def find_edges(image):
     base = image[:, :, numpy.newaxis].astype(numpy.int16)
     c = base[1:-1, 1:-1]
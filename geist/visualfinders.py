@@ -1,61 +1,140 @@
 from __future__ import division, absolute_import, print_function
 
-from .finders import Location
-from .vision import best_convolution, grey_scale, find_edges
+from .finders import Location, LocationArray
+from .vision import (
+    best_convolution,
+    batched_convolution,
+    grey_scale,
+    find_edges,
+    prepared_template_from_image,
+    pyramid_convolution,
+    tiled_convolution,
+    TEMPLATE_CACHE,
+)
+from .cache import template_digest
+from .repo import derived_image
 from .colour import rgb_to_hsv
 from .ocr import Classifier
-from .matchers import fuzzy_match
+from .matchers import fuzzy_match, pyramid_fuzzy_match
+from .match_position_finder_helpers import (
+    normalised_correlation_map,
+    normalised_correlation_coefficient_map,
+)
 import numpy
+from scipy.signal import fftconvolve
 from scipy.ndimage.measurements import (
     label,
     find_objects,
 )
 from scipy.ndimage.morphology import binary_propagation, binary_erosion
+from scipy.ndimage.filters import maximum_filter
 import logging
+import os
+from itertools import islice
 from .finders import BaseFinder
 
 logger = logging.getLogger(__name__)
 
 
 class TextFinderFilter(BaseFinder):
-    def __init__(self, classifier, finder, text):
+    """Finds the locations found by finder which read as text.
+
+    The locations are read in batches with Classifier.classify_many,
+    splitting them into characters on pool if given. The first batch is of one
+    location, and each is twice the size of the last up to batch_size, so that
+    when only the first few matches are wanted (by GUI.exists say) few more
+    locations than needed are read.
+    """
+    def __init__(self, classifier, finder, text, batch_size=64, pool=None):
         self.classifier = classifier
         self.text = text
         self.finder = finder
+        self.batch_size = batch_size
+        self.pool = pool
 
     def find(self, in_location):
         image = in_location.image
-        for loc in self.finder.find(in_location):
-            sub_image = image[loc.y:loc.y + loc.h, loc.x:loc.x + loc.w]
-            text = self.classifier.classify(sub_image)
-            if text.replace('?', '') == self.text:
-                yield loc
+        locations = iter(self.finder.find(in_location))
+        size = 1
+        while True:
+            batch = list(islice(locations, size))
+            if not batch:
+                return
+            size = min(size * 2, self.batch_size)
+            texts = self.classifier.classify_many(
+                image, [(loc.x, loc.y, loc.w, loc.h) for loc in batch],
+                pool=self.pool)
+            for loc, text in zip(batch, texts):
+                if text.replace('?', '') == self.text:
+                    yield loc
 
 
 def text_finder_filter_from_path(path):
+    """path is a classifier saved as JSON, or a directory a classifier was
+    saved to with Classifier.save, which loads much faster.
+    """
     classifier = Classifier()
-    with open(path) as f:
-        classifier.from_json(f.read())
+    if os.path.isdir(path):
+        classifier.load(path)
+    else:
+        with open(path) as f:
+            classifier.from_json(f.read())
     return lambda finder, text: TextFinderFilter(classifier, finder, text)
 
 
+def _threshold_edges(image, threshold):
+    return find_edges(grey_scale(image) > threshold) > 0
+
+
+def _approx_edges(image):
+    return find_edges(grey_scale(image)) > 10
+
+
+def _grey_template(template):
+    return TEMPLATE_CACHE.get_or_create(
+        ('grey scale', template_digest(template)),
+        lambda: derived_image(template, 'grey scale', grey_scale)
+    )
+
+
+def _convolution(bin_template, bin_image, tile_size, pool, pyramid=None):
+    if pyramid is not None:
+        return pyramid_convolution(bin_template, bin_image, factor=pyramid)
+    if tile_size is None:
+        return best_convolution(bin_template, bin_image)
+    return tiled_convolution(bin_template, bin_image,
+                             tile_size=tile_size, pool=pool)
+
+
 class ThresholdTemplateFinder(BaseFinder):
-    def __init__(self, template, threshold=10):
+    """Finds template by matching the edges of a thresholded grey scale.
+
+    If tile_size (h, w) is given the screen is matched in overlapping tiles of
+    that size, on pool if given (see vision.tiled_convolution).
+    """
+    def __init__(self, template, threshold=10, tile_size=None, pool=None):
         self.template = template
         self.threshold = threshold
+        self.tile_size = tile_size
+        self.pool = pool
+
+    def _bin_template(self):
+        kind = 'threshold edges %r' % (self.threshold,)
+        return prepared_template_from_image(
+            self.template.image,
+            lambda image: derived_image(
+                self.template, kind,
+                lambda image: _threshold_edges(image, self.threshold)),
+            kind,
+            template_digest(self.template)
+        )
 
     def find(self, in_location):
         h, w = self.template.image.shape[:2]
         image = in_location.image
-        gimage = grey_scale(image)
-        gtemplate = grey_scale(self.template.image)
-        threshold_image = gimage > self.threshold
-        threshold_template = gtemplate > self.threshold
-        edge_image = find_edges(threshold_image)
-        edge_template = find_edges(threshold_template)
-        bin_image = edge_image > 0
-        bin_template = edge_template > 0
-        for x, y in best_convolution(bin_template, bin_image):
+        bin_image = _threshold_edges(image, self.threshold)
+        for x, y in _convolution(self._bin_template(), bin_image,
+                                 self.tile_size, self.pool):
             yield Location(x, y, w, h, parent=in_location)
 
     def __repr__(self):
@@ -63,19 +142,51 @@ class ThresholdTemplateFinder(BaseFinder):
 
 
 class ApproxTemplateFinder(BaseFinder):
-    def __init__(self, template):
+    """Finds template by matching the edges of the grey scale images.
+
+    If tile_size (h, w) is given the screen is matched in overlapping tiles of
+    that size, on pool if given (see vision.tiled_convolution).
+
+    If a hint (a RegionHint) is given, the template is first looked for near
+    where it was last found.
+
+    If pyramid (2 or 4 say) is given the template is first found in the
+    screen shrunk by that factor and then checked at full size (see
+    vision.pyramid_convolution). This finds the same matches, much faster for
+    large templates. The shrunk screen is not tiled, so pyramid can not be
+    given with tile_size or pool; doing so raises ValueError.
+    """
+    def __init__(self, template, tile_size=None, pool=None, hint=None,
+                 pyramid=None):
+        if pyramid is not None and (tile_size is not None or
+                                    pool is not None):
+            raise ValueError('pyramid can not be used with tile_size or pool')
         self.template = template
+        self.tile_size = tile_size
+        self.pool = pool
+        self.hint = hint
+        self.pyramid = pyramid
+
+    def _bin_template(self):
+        return prepared_template_from_image(
+            self.template.image,
+            lambda image: derived_image(self.template, 'approx edges',
+                                        _approx_edges),
+            'approx edges',
+            template_digest(self.template))
 
     def find(self, in_location):
+        if self.hint is None:
+            return self._find(in_location)
+        return iter(self.hint.find(template_digest(self.template),
+                                   self._find, in_location))
+
+    def _find(self, in_location):
         h, w = self.template.image.shape[:2]
         image = in_location.image
-        gimage = grey_scale(image)
-        gtemplate = grey_scale(self.template.image)
-        edge_image = find_edges(gimage)
-        edge_template = find_edges(gtemplate)
-        bin_image = edge_image > 10
-        bin_template = edge_template > 10
-        for x, y in best_convolution(bin_template, bin_image):
+        bin_image = _approx_edges(image)
+        for x, y in _convolution(self._bin_template(), bin_image,
+                                 self.tile_size, self.pool, self.pyramid):
             #print("x=%d, y=%d, in_location=%r" % (x,y,in_location))
             yield Location(x, y, w, h, parent=in_location)
 
@@ -83,29 +194,63 @@ class ApproxTemplateFinder(BaseFinder):
         return "match %r approximately" % (self.template, )
 
 
+class MultipleApproxTemplateFinder(BaseFinder):
+    """Finds each of several templates as ApproxTemplateFinder would, but only
+    works out the edges of the screen and their FFT once for all of them.
+
+    Results are yielded template by template in the order given.
+    """
+    def __init__(self, *templates):
+        self.templates = templates
+
+    def find(self, in_location):
+        bin_image = _approx_edges(in_location.image)
+        bin_templates = [ApproxTemplateFinder(template)._bin_template()
+                         for template in self.templates]
+        for template, matches in zip(
+            self.templates,
+            batched_convolution(bin_templates, bin_image)
+        ):
+            h, w = template.image.shape[:2]
+            for x, y in matches:
+                yield Location(x, y, w, h, parent=in_location)
+
+    def __repr__(self):
+        return "match each of %r approximately" % (self.templates, )
+
+
 class FuzzyTemplateFinder(BaseFinder):
     """ This uses different matching methods to the ApproxTemplateFinder
         These methods have been used to detect letters with different types of anti-aliasing
         They are thus more robust to slight variations in rendering,
 
+        If pyramid (2 or 4) is given, candidates are first found in the screen
+        shrunk by that factor, and only the regions around them are matched
+        at full size (see matchers.pyramid_fuzzy_match).
     """
-    def __init__(self, template, normed_tolerance=None, raw_tolerance=None):
+    def __init__(self, template, normed_tolerance=None, raw_tolerance=None,
+                 pyramid=None):
         self.template = template
         self.normed_tolerance = normed_tolerance
         self.raw_tolerance = raw_tolerance
+        self.pyramid = pyramid
 
     def find(self, in_location, normed_tolerance=None, raw_tolerance=None, method='correlation'):
         h, w = self.template.image.shape[:2]
         image = in_location.image
         gimage = grey_scale(image)
-        gtemplate = grey_scale(self.template.image)
+        gtemplate = _grey_template(self.template)
         
         if normed_tolerance is None:
             normed_tolerance = self.normed_tolerance
         if raw_tolerance is None:
             raw_tolerance = self.raw_tolerance
 
-        for x, y in fuzzy_match(gimage, gtemplate, normed_tolerance=normed_tolerance, raw_tolerance=raw_tolerance, method=method):
+        if self.pyramid is None:
+            matches = fuzzy_match(gimage, gtemplate, normed_tolerance=normed_tolerance, raw_tolerance=raw_tolerance, method=method)
+        else:
+            matches = pyramid_fuzzy_match(gimage, gtemplate, factor=self.pyramid, normed_tolerance=normed_tolerance, raw_tolerance=raw_tolerance, method=method)
+        for x, y in matches:
             #print("x=%d, y=%d, in_location=%r" % (x,y,in_location))
             yield Location(x, y, w, h, parent=in_location)
 
@@ -113,6 +258,68 @@ class FuzzyTemplateFinder(BaseFinder):
         return "match %r fuzzily" % (self.template, )
 
 
+class NormalisedCorrelationFinder(BaseFinder):
+    """Finds template by normalised cross correlation of the grey scale
+    images, scoring every position of the template in the screen.
+
+    The method is 'correlation coefficient' (zero mean, the default, which
+    ignores differences in brightness) or 'correlation'. Positions scoring at
+    least threshold, with no better scoring position overlapping them, are
+    yielded best first with their score.
+
+    The time taken depends only on the sizes of the screen and template, not
+    on how much of the screen nearly matches.
+    """
+    def __init__(self, template, threshold=0.9,
+                 method='correlation coefficient'):
+        if method not in ['correlation', 'correlation coefficient']:
+            raise ValueError('Matching method not implemented')
+        self.template = template
+        self.threshold = threshold
+        self.method = method
+
+    def scores(self, image):
+        """Return the score of the template at every top left position in
+        image
+        """
+        gimage = grey_scale(image)
+        gtemplate = _grey_template(self.template)
+        h, w = gimage.shape
+        th, tw = gtemplate.shape
+        if self.method == 'correlation':
+            correlation = fftconvolve(gimage, gtemplate[::-1, ::-1])
+            score_map = normalised_correlation_map
+        else:
+            correlation = fftconvolve(
+                gimage, (gtemplate - numpy.mean(gtemplate))[::-1, ::-1])
+            score_map = normalised_correlation_coefficient_map
+        return score_map(gimage, gtemplate,
+                         correlation[th - 1:h, tw - 1:w])
+
+    def find(self, in_location):
+        h, w = self.template.image.shape[:2]
+        image = in_location.image
+        if h > image.shape[0] or w > image.shape[1]:
+            return
+        scores = self.scores(image)
+        # Only the best positions within a template's size can survive the
+        # suppression below
+        peaks = ((scores >= self.threshold) &
+                 (scores == maximum_filter(scores, size=(h, w))))
+        ys, xs = numpy.nonzero(peaks)
+        order = numpy.argsort(-scores[ys, xs], kind='mergesort')
+        kept = []
+        for y, x in zip(ys[order], xs[order]):
+            if any(abs(x - kx) < w and abs(y - ky) < h for kx, ky in kept):
+                continue
+            kept.append((x, y))
+            yield Location(x, y, w, h, parent=in_location,
+                           score=float(scores[y, x]))
+
+    def __repr__(self):
+        return "match %r by normalised %s" % (self.template, self.method)
+
+
 class ExactTemplateFinder(BaseFinder):
     def __init__(self, template):
         self.template = template
@@ -148,17 +355,25 @@ class BinaryRegionFinder(BaseFinder):
     def __init__(self, binary_image_function):
         self.binary_image_function = binary_image_function
 
-    def find(self, in_location):
+    def find_array(self, in_location):
         image = in_location.image
         bin_image = self.binary_image_function(image)
-        for y_slice, x_slice in find_objects(*label(bin_image)):
-            yield Location(
-                x_slice.start,
-                y_slice.start,
-                x_slice.stop - x_slice.start,
-                y_slice.stop - y_slice.start,
-                parent=in_location
-            )
+        bounds = numpy.array(
+            [(x_slice.start, y_slice.start, x_slice.stop, y_slice.stop)
+             for y_slice, x_slice in find_objects(*label(bin_image))],
+            dtype=int
+        ).reshape(-1, 4)
+        return LocationArray(
+            bounds[:, 0],
+            bounds[:, 1],
+            bounds[:, 2] - bounds[:, 0],
+            bounds[:, 3] - bounds[:, 1],
+            parent=in_location
+        )
+
+    def find(self, in_location):
+        for loc in self.find_array(in_location):
+            yield loc
 
 
 class ColourRegionFinder(BaseFinder):
@@ -167,6 +382,9 @@ class ColourRegionFinder(BaseFinder):
             lambda image: colour_filter(*rgb_to_hsv(image))
         )
 
+    def find_array(self, in_location):
+        return self.binary_finder.find_array(in_location)
+
     def find(self, in_location):
         return self.binary_finder.find(in_location)
 
@@ -177,6 +395,9 @@ class GreyscaleRegionFinder(BaseFinder):
             lambda image: grey_scale_filter(grey_scale(image))
         )
 
+    def find_array(self, in_location):
+        return self.binary_finder.find_array(in_location)
+
     def find(self, in_location):
         return self.binary_finder.find(in_location)
 
@@ -0,0 +1,103 @@
+import unittest
+import numpy as np
+import geist.cache
+from geist.cache import LRUByteCache, array_digest, template_digest
+
+
+class _Template(object):
+    def __init__(self, image):
+        self.image = image
+
+
+class TestLRUByteCache(unittest.TestCase):
+    def test_get(self):
+        cache = LRUByteCache(100)
+        value = np.zeros(10, np.uint8)
+        cache.put('a', value)
+        self.assertIs(cache.get('a'), value)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.nbytes, 10)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUByteCache(25)
+        cache.put('a', np.zeros(10, np.uint8))
+        cache.put('b', np.zeros(10, np.uint8))
+        cache.get('a')
+        cache.put('c', np.zeros(10, np.uint8))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(cache.nbytes, 20)
+
+    def test_too_big_not_cached(self):
+        cache = LRUByteCache(5)
+        cache.put('a', np.zeros(10, np.uint8))
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.nbytes, 0)
+
+    def test_replace(self):
+        cache = LRUByteCache(100)
+        cache.put('a', np.zeros(10, np.uint8))
+        cache.put('a', np.zeros(20, np.uint8))
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.nbytes, 20)
+
+    def test_get_or_create(self):
+        cache = LRUByteCache(100)
+        calls = []
+
+        def create():
+            calls.append(1)
+            return np.zeros(10, np.uint8)
+        first = cache.get_or_create('a', create)
+        second = cache.get_or_create('a', create)
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+
+    def test_discard(self):
+        cache = LRUByteCache(100)
+        cache.put('a', np.zeros(10, np.uint8))
+        cache.discard('a')
+        cache.discard('a')
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.nbytes, 0)
+
+
+class TestArrayDigest(unittest.TestCase):
+    def test_content(self):
+        a = np.arange(12).reshape((3, 4))
+        self.assertEqual(array_digest(a), array_digest(a.copy()))
+        self.assertNotEqual(array_digest(a), array_digest(a + 1))
+
+    def test_shape_and_dtype(self):
+        a = np.arange(12, dtype=np.uint8)
+        self.assertNotEqual(array_digest(a), array_digest(a.reshape((3, 4))))
+        self.assertNotEqual(array_digest(a), array_digest(a.view(np.int8)))
+
+    def test_not_contiguous(self):
+        a = np.arange(12).reshape((3, 4))
+        self.assertEqual(array_digest(a[:, ::2]),
+                         array_digest(a[:, ::2].copy()))
+
+    def test_template_digest_remembered(self):
+        template = _Template(np.arange(12))
+        expected = array_digest(template.image)
+        self.assertEqual(template_digest(template), expected)
+        digest = geist.cache.array_digest
+        geist.cache.array_digest = None
+        try:
+            self.assertEqual(template_digest(template), expected)
+        finally:
+            geist.cache.array_digest = digest
+        # but not once the template has a different image
+        template.image = np.arange(13)
+        self.assertEqual(template_digest(template),
+                         array_digest(template.image))
+
+
+cache_suite = unittest.TestLoader().loadTestsFromTestCase(TestLRUByteCache)
+digest_suite = unittest.TestLoader().loadTestsFromTestCase(TestArrayDigest)
+all_tests = unittest.TestSuite([cache_suite, digest_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)
@@ -1,8 +1,11 @@
 import unittest
+import pickle
 import numpy as np
 from numpy.testing import assert_array_equal
 
-from geist.finders import Location
+from geist.finders import Location, LocationList
+from geist.core import GUI, NotFoundError, PollScheduler
+from geist.backends.fake import GeistFakeBackend
 
 
 class TestLocation(unittest.TestCase):
@@ -73,6 +76,33 @@ class TestLocation(unittest.TestCase):
         loc = Location(2, 2, parent=parent)
         self.assertEquals(loc.y, 2)
 
+    def test_nested(self):
+        image = np.arange(64 * 64).reshape((64, 64))
+        loc = Location(0, 0, w=64, h=64, image=image)
+        x, y = 0, 0
+        for i in range(20):
+            loc = Location(1, 2, w=loc.w - 2, h=loc.h - 3, parent=loc)
+            x, y = x + 1, y + 2
+        self.assertEqual((loc.x, loc.y), (x, y))
+        assert_array_equal(loc.image, image[y:y + loc.h, x:x + loc.w])
+        self.assertTrue(repr(loc).endswith(
+            'parent=Location(x=19, y=38, w=26, h=7, ...))'))
+        self.assertFalse(hasattr(loc, '__dict__'))
+
+    def test_pickle(self):
+        image = np.arange(10 * 12).reshape((10, 12))
+        parent = Location(0, 0, w=12, h=10, image=image)
+        loc = Location(1, 2, w=5, h=4, parent=Location(3, 1, w=8, h=8,
+                                                        parent=parent),
+                       main_point_offset=(1, 1), score=0.5)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            copy = pickle.loads(pickle.dumps(loc, protocol))
+            self.assertEqual(copy, loc)
+            self.assertEqual((copy.x, copy.y, copy.score, copy.main_point),
+                             (4, 3, 0.5, (5, 4)))
+            self.assertEqual(copy.parent, loc.parent)
+            assert_array_equal(copy.image, loc.image)
+
     def test_copy(self):
         image = np.array([[0, 0, 0, 0, 0, 0, 0, 0],
                           [0, 0, 0, 0, 0, 0, 0, 0],
@@ -98,8 +128,59 @@ class TestLocation(unittest.TestCase):
         loc = Location(0, 0, w=8, h=8, image=image)
         self.assertEqual(loc.area, 64)
 
+
+class TestPollScheduler(unittest.TestCase):
+    def setUp(self):
+        self.sleeps = []
+
+    def create_scheduler(self, jitter=0, random=lambda: 1):
+        return PollScheduler(min_interval=0.1, max_interval=0.5, backoff=2,
+                             jitter=jitter, sleep=self.sleeps.append,
+                             random=random)
+
+    def test_backoff(self):
+        scheduler = self.create_scheduler()
+        for i in range(5):
+            scheduler.wait()
+        self.assertEqual(self.sleeps, [0.1, 0.2, 0.4, 0.5, 0.5])
+
+    def test_reset(self):
+        scheduler = self.create_scheduler()
+        scheduler.wait()
+        scheduler.wait()
+        scheduler.reset()
+        scheduler.wait()
+        self.assertEqual(self.sleeps, [0.1, 0.2, 0.1])
+
+    def test_jitter(self):
+        scheduler = self.create_scheduler(jitter=0.5, random=lambda: 0.5)
+        scheduler.wait()
+        self.assertAlmostEqual(self.sleeps[0], 0.075)
+
+    def test_never_sleeps_past_remaining(self):
+        scheduler = self.create_scheduler()
+        scheduler.wait(remaining=0.05)
+        scheduler.wait(remaining=0)
+        self.assertEqual(self.sleeps, [0.05])
+
+    def test_gui_option(self):
+        schedulers = []
+
+        def create_scheduler(**kwargs):
+            schedulers.append(kwargs)
+            return PollScheduler(sleep=self.sleeps.append, **kwargs)
+        gui = GUI(GeistFakeBackend(), poll_scheduler=create_scheduler,
+                  poll_min_interval=0.001)
+        with self.assertRaises(NotFoundError):
+            gui.wait_find_one(LocationList(), timeout=0.01)
+        self.assertEqual(schedulers[0]['min_interval'], 0.001)
+        self.assertTrue(len(self.sleeps) > 0)
+
+
 location_suite = unittest.TestLoader().loadTestsFromTestCase(TestLocation)
-all_tests = unittest.TestSuite([location_suite])
+poll_scheduler_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPollScheduler)
+all_tests = unittest.TestSuite([location_suite, poll_scheduler_suite])
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=1)
     runner.run(all_tests)
@@ -1,5 +1,7 @@
 import unittest
-from geist import Location, LocationList, GUI
+import numpy as np
+from geist import Location, LocationList, LocationArray, GUI
+from geist import BinaryRegionFinder
 from geist.backends.fake import GeistFakeBackend
 from geist.filters import (SortingFinder,
                            LocationFinderFilter,
@@ -70,12 +72,84 @@ class TestSliceFinderFilter(unittest.TestCase):
         self.assertListEqual(actual, expected)
 
 
+class TestFiltersOfLocationArrays(unittest.TestCase):
+    def setUp(self):
+        self.gui = GUI(GeistFakeBackend())
+        self.screen = self.gui.capture_locations()[0]
+        self.locs = LocationList([Location(0, 0, w=10, h=10),
+                                  Location(0, 8, w=10, h=10),
+                                  Location(0, 2, w=10, h=10),
+                                  Location(6, 8, w=10, h=10)])
+        self.array = LocationArray.from_locations(self.locs)
+
+    def assertSameResults(self, make_finder):
+        expected = self.gui.find_all(make_finder(self.locs))
+        self.assertIsInstance(make_finder(self.array).find_array(self.screen),
+                              LocationArray)
+        self.assertListEqual(self.gui.find_all(make_finder(self.array)),
+                             expected)
+
+    def test_filter(self):
+        finder = LocationFinderFilter(lambda loc: loc.y == 8, self.array)
+        self.assertIsNone(finder.find_array(self.screen))
+        self.assertListEqual(
+            self.gui.find_all(finder),
+            self.gui.find_all(LocationFinderFilter(lambda loc: loc.y == 8,
+                                                   self.locs)))
+
+    def test_exists_filters_lazily(self):
+        image = np.zeros((100, 100, 3), dtype=np.uint8)
+        image[::4, ::4] = 255
+        gui = GUI(GeistFakeBackend(image=image))
+        calls = []
+
+        def predicate(loc):
+            calls.append(loc)
+            return True
+        regions = BinaryRegionFinder(lambda image: image[:, :, 0] > 0)
+        self.assertEqual(len(gui.find_all(regions)), 625)
+        self.assertTrue(gui.exists(LocationFinderFilter(predicate, regions)))
+        self.assertEqual(len(calls), 1)
+
+    def test_sort(self):
+        self.assertSameResults(
+            lambda finder: SortingFinder(finder, key=lambda loc: loc.y))
+        self.assertSameResults(
+            lambda finder: SortingFinder(finder, key=lambda loc: loc.y,
+                                         reverse=True))
+
+    def test_vectorised(self):
+        self.assertSameResults(
+            lambda finder: LocationFinderFilter(lambda loc: loc.y == 8,
+                                                finder, vectorised=True))
+        self.assertSameResults(
+            lambda finder: SortingFinder(finder, key=lambda loc: loc.y,
+                                         vectorised=True))
+
+    def test_slice(self):
+        self.assertSameResults(
+            lambda finder: SliceFinderFilter(finder)[1:3])
+        self.assertSameResults(
+            lambda finder: SliceFinderFilter(
+                SortingFinder(finder, key=lambda loc: loc.x, reverse=True))[0])
+
+    def test_negative_slice(self):
+        for finder in [self.locs, self.array]:
+            for key in [-1, slice(-2, None), slice(0, -1),
+                        slice(None, None, -1)]:
+                with self.assertRaises(ValueError):
+                    self.gui.find_all(SliceFinderFilter(finder)[key])
+
+
 filter_suite = unittest.TestLoader().loadTestsFromTestCase(
     TestLocationFinderFilter)
 sort_suite = unittest.TestLoader().loadTestsFromTestCase(TestSortingFinder)
 slice_suite = unittest.TestLoader().loadTestsFromTestCase(
     TestSliceFinderFilter)
-all_tests = unittest.TestSuite([sort_suite, filter_suite, slice_suite])
+array_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestFiltersOfLocationArrays)
+all_tests = unittest.TestSuite([sort_suite, filter_suite, slice_suite,
+                                array_suite])
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=1)
     runner.run(all_tests)
@@ -1,5 +1,10 @@
 import unittest
-from geist import Location, LocationList, GUI, FinderInFinder
+from geist import Location, LocationList, GUI, FinderInFinder, NotFoundError
+from geist import LocationOperatorFinder, below
+from geist import (ApproxTemplateFinder, MultipleApproxTemplateFinder,
+                   MultipleFinderFinder, NormalisedCorrelationFinder,
+                   BinaryRegionFinder, LocationArray)
+from geist.finders import BaseFinder
 from geist.backends.fake import GeistFakeBackend
 from geist.responsivefinders import LocationChangeFinder, StopChangingFinder, ClickingFinder
 from geist_tests.test_mouse import GeistMouseBackend
@@ -23,6 +28,260 @@ class TestLocationFinderFilter(unittest.TestCase):
         self.assertEqual(parent_y + child_y, result.y)
 
 
+class _Template(object):
+    def __init__(self, image):
+        self.image = image
+
+
+class TestApproxTemplateFinder(unittest.TestCase):
+    def test_pyramid_is_not_tiled(self):
+        template = _Template(np.zeros((10, 10, 3), np.uint8))
+        with self.assertRaises(ValueError):
+            ApproxTemplateFinder(template, tile_size=(512, 512), pyramid=2)
+        with self.assertRaises(ValueError):
+            ApproxTemplateFinder(template, pool=object(), pyramid=2)
+        ApproxTemplateFinder(template, pyramid=2)
+        ApproxTemplateFinder(template, tile_size=(512, 512), pool=object())
+
+
+class TestMultipleApproxTemplateFinder(unittest.TestCase):
+    def test_same_as_approx_template_finders(self):
+        image = np.zeros((60, 80, 3), np.uint8)
+        image[5:15, 10:20] = 200
+        image[30:36, 50:70] = 120
+        image[40:50, 60:70] = 200
+        screen = Location(0, 0, w=80, h=60, image=image)
+        templates = [_Template(image[3:17, 8:22]),
+                     _Template(image[28:38, 48:72])]
+        expected = list(MultipleFinderFinder(
+            *[ApproxTemplateFinder(t) for t in templates]).find(screen))
+        actual = list(MultipleApproxTemplateFinder(*templates).find(screen))
+        self.assertEqual(len(expected), 3)
+        self.assertListEqual(actual, expected)
+
+
+class TestNormalisedCorrelationFinder(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.template = _Template(
+            rng.randint(0, 150, (8, 10, 3)).astype(np.uint8))
+        self.image = np.full((60, 80, 3), 200, np.uint8)
+        self.image[5:13, 10:20] = self.template.image
+        # Brighter, so only an exact match for the zero mean method
+        self.image[40:48, 50:60] = self.template.image + 30
+        # Bright patch, which matches well without normalisation
+        self.image[30:38, 5:15] = 255
+        self.screen = Location(0, 0, w=80, h=60, image=self.image)
+
+    def test_correlation_coefficient(self):
+        results = list(NormalisedCorrelationFinder(
+            self.template).find(self.screen))
+        self.assertEqual(sorted(loc.rect for loc in results),
+                         [(10, 5, 10, 8), (50, 40, 10, 8)])
+        for loc in results:
+            self.assertAlmostEqual(loc.score, 1)
+
+    def test_ranked_by_score(self):
+        results = list(NormalisedCorrelationFinder(
+            self.template, threshold=0.5, method='correlation'
+        ).find(self.screen))
+        self.assertEqual([loc.rect for loc in results[:2]],
+                         [(10, 5, 10, 8), (50, 40, 10, 8)])
+        self.assertAlmostEqual(results[0].score, 1)
+        self.assertLess(results[1].score, 1)
+        scores = [loc.score for loc in results]
+        self.assertEqual(scores, sorted(scores, reverse=True))
+
+    def test_non_maximum_suppression(self):
+        results = list(NormalisedCorrelationFinder(
+            self.template, threshold=0.5).find(self.screen))
+        for i, a in enumerate(results):
+            for b in results[i + 1:]:
+                self.assertFalse(abs(a.x - b.x) < a.w and
+                                 abs(a.y - b.y) < a.h)
+
+    def test_template_bigger_than_screen(self):
+        screen = Location(0, 0, w=5, h=5,
+                          image=np.zeros((5, 5, 3), np.uint8))
+        self.assertEqual(
+            list(NormalisedCorrelationFinder(self.template).find(screen)), [])
+
+    def test_score_kept_by_copy(self):
+        loc = Location(1, 2, 3, 4, score=0.5)
+        self.assertEqual(loc.copy(rel_x=2).score, 0.5)
+        self.assertEqual(loc, Location(1, 2, 3, 4))
+
+
+class _CountingFinder(BaseFinder):
+    def __init__(self, change_screen=False):
+        self.count = 0
+        self.change_screen = change_screen
+
+    def find(self, in_location):
+        self.count += 1
+        if self.change_screen:
+            in_location.image[0, 0, 0] += 1
+        return iter([])
+
+
+class _YieldingFinder(BaseFinder):
+    def __init__(self, n):
+        self.n = n
+        self.yielded = 0
+
+    def find(self, in_location):
+        for i in range(self.n):
+            self.yielded += 1
+            yield Location(i, i, 10, 10, parent=in_location)
+
+
+class TestEarlyExit(unittest.TestCase):
+    def setUp(self):
+        self.gui = GUI(GeistFakeBackend())
+
+    def test_exists(self):
+        finder = _YieldingFinder(100)
+        self.assertTrue(self.gui.exists(finder))
+        self.assertEqual(finder.yielded, 1)
+        self.assertFalse(self.gui.exists(_YieldingFinder(0)))
+
+    def test_wait_find_one(self):
+        finder = _YieldingFinder(1)
+        self.assertEqual(self.gui.wait_find_one(finder).rect, (0, 0, 10, 10))
+        finder = _YieldingFinder(100)
+        with self.assertRaises(NotFoundError):
+            self.gui.wait_find_one(finder, timeout=0)
+        self.assertEqual(finder.yielded, 2)
+
+    def test_exists_within_timeout(self):
+        finder = _YieldingFinder(100)
+        self.assertTrue(self.gui.exists_within_timeout(finder))
+        self.assertFalse(self.gui.does_not_exist_within_timeout(finder,
+                                                                timeout=0))
+        self.assertEqual(finder.yielded, 2)
+
+    def test_finder_in_finder(self):
+        inner = _YieldingFinder(100)
+        outer = _YieldingFinder(100)
+        self.assertTrue(self.gui.exists(FinderInFinder(inner, outer)))
+        self.assertEqual((inner.yielded, outer.yielded), (1, 1))
+
+    def test_location_operator_finder_takes_b_as_needed(self):
+        b = _YieldingFinder(100)
+        # The first b, at (0, 0) and 10 high, is above a
+        finder = LocationOperatorFinder(
+            LocationList([Location(50, 50, 10, 10)]), below, b)
+        self.assertEqual(self.gui.wait_find_one(finder).rect,
+                         (50, 50, 10, 10))
+        self.assertEqual(b.yielded, 1)
+        b = _YieldingFinder(100)
+        finder = LocationOperatorFinder(_YieldingFinder(0), below, b)
+        self.assertFalse(self.gui.exists(finder))
+        self.assertEqual(b.yielded, 0)
+
+
+class TestReuseUnchangedResults(unittest.TestCase):
+    def test_unchanged_screen_not_matched_again(self):
+        gui = GUI(GeistFakeBackend(), reuse_unchanged_results=True)
+        finder = _CountingFinder()
+        with self.assertRaises(NotFoundError):
+            gui.wait_find_one(finder, timeout=0.05)
+        self.assertEqual(finder.count, 1)
+
+    def test_changed_screen_matched_again(self):
+        gui = GUI(GeistFakeBackend(), reuse_unchanged_results=True)
+        finder = _CountingFinder(change_screen=True)
+        with self.assertRaises(NotFoundError):
+            gui.wait_find_one(finder, timeout=0.05)
+        self.assertTrue(finder.count > 1)
+
+    def test_off_by_default(self):
+        gui = GUI(GeistFakeBackend())
+        finder = _CountingFinder()
+        with self.assertRaises(NotFoundError):
+            gui.wait_find_one(finder, timeout=0.05)
+        self.assertTrue(finder.count > 1)
+
+
+class TestLocationArray(unittest.TestCase):
+    def setUp(self):
+        self.screen = Location(0, 0, 200, 100)
+        self.parent = Location(20, 10, 100, 50, parent=self.screen)
+        self.locations = [Location(5, 30, 10, 10, parent=self.parent),
+                          Location(50, 3, 20, 5, parent=self.parent),
+                          Location(5, 0, 30, 10, parent=self.parent)]
+        self.array = LocationArray.from_locations(self.locations, self.parent)
+
+    def test_from_locations(self):
+        self.assertEqual(len(self.array), 3)
+        self.assertListEqual(list(self.array), self.locations)
+        self.assertEqual(self.array[-1], self.locations[-1])
+        self.assertListEqual(list(self.array.x), [25, 70, 25])
+        self.assertListEqual(list(self.array.area), [100, 100, 300])
+        self.assertIsNone(self.array.score)
+        with self.assertRaises(IndexError):
+            self.array[3]
+
+    def test_slice(self):
+        self.assertListEqual(list(self.array[1:]), self.locations[1:])
+        self.assertListEqual(list(self.array[::-1]), self.locations[::-1])
+
+    def test_filtered(self):
+        for vectorised in [False, True]:
+            self.assertListEqual(
+                list(self.array.filtered(lambda loc: loc.x == 25,
+                                         vectorised=vectorised)),
+                [self.locations[0], self.locations[2]])
+        self.assertListEqual(
+            list(self.array.filtered(lambda loc: loc.w == 20 and loc.h == 5)),
+            [self.locations[1]])
+
+    def test_called_once_per_location(self):
+        seen = []
+        self.array.filtered(lambda loc: seen.append(loc))
+        self.assertListEqual(seen, self.locations)
+        with self.assertRaises(ZeroDivisionError):
+            self.array.filtered(lambda loc: 1 // 0)
+
+    def test_not_vectorised(self):
+        with self.assertRaises(ValueError):
+            self.array.sorted(lambda loc: 1, vectorised=True)
+
+    def test_sorted(self):
+        for key in [lambda loc: loc.x, lambda loc: loc.area,
+                    lambda loc: loc.main_point]:
+            for reverse in [False, True]:
+                self.assertListEqual(
+                    list(self.array.sorted(key, reverse=reverse)),
+                    sorted(self.locations, key=key, reverse=reverse))
+        for reverse in [False, True]:
+            self.assertListEqual(
+                list(self.array.sorted(lambda loc: loc.x, reverse=reverse,
+                                       vectorised=True)),
+                sorted(self.locations, key=lambda loc: loc.x,
+                       reverse=reverse))
+
+    def test_scores(self):
+        array = LocationArray([0, 1], [0, 1], [1, 1], [1, 1], score=[0.5, 0.9])
+        self.assertListEqual([loc.score for loc in array], [0.5, 0.9])
+        self.assertEqual(array.sorted(lambda loc: -loc.score)[0].rect,
+                         (1, 1, 1, 1))
+
+    def test_binary_region_finder(self):
+        image = np.zeros((100, 200), dtype=bool)
+        image[10:20, 30:35] = True
+        image[50:52, 100:190] = True
+        image[80:90, 5:8] = True
+        screen = Location(0, 0, 200, 100, image=image)
+        finder = BinaryRegionFinder(lambda image: image)
+        array = finder.find_array(screen)
+        self.assertIsInstance(array, LocationArray)
+        self.assertListEqual([loc.rect for loc in finder.find(screen)],
+                             [(30, 10, 5, 10), (100, 50, 90, 2),
+                              (5, 80, 3, 10)])
+        self.assertEqual(len(finder.find_array(Location(0, 0, 10, 10))), 0)
+
+
 class TestResponsiveFinders(unittest.TestCase):
     def setUp(self):
         # typically images are rgb, and fake backend expects this
@@ -0,0 +1,105 @@
+import unittest
+import numpy as np
+from geist import Location, RegionHint, ApproxTemplateFinder
+
+
+class _Template(object):
+    def __init__(self, image):
+        self.image = image
+
+
+class _RecordingFinder(object):
+    def __init__(self, *rects):
+        self.rects = rects
+        self.searched = []
+
+    def __call__(self, in_location):
+        self.searched.append(in_location.rect)
+        for x, y, w, h in self.rects:
+            if (x >= in_location.x and y >= in_location.y and
+                    x + w <= in_location.x + in_location.w and
+                    y + h <= in_location.y + in_location.h):
+                yield Location(x - in_location.x, y - in_location.y, w, h,
+                               parent=in_location)
+
+
+class TestRegionHint(unittest.TestCase):
+    def setUp(self):
+        self.screen = Location(0, 0, 1000, 800)
+        self.hint = RegionHint(padding=10)
+
+    def test_cold_then_hit(self):
+        find = _RecordingFinder((100, 200, 20, 30))
+        first = self.hint.find('a', find, self.screen)
+        second = self.hint.find('a', find, self.screen)
+        self.assertEqual(first, second)
+        self.assertEqual([loc.rect for loc in second], [(100, 200, 20, 30)])
+        self.assertIs(second[0].parent, self.screen)
+        self.assertEqual(find.searched,
+                         [(0, 0, 1000, 800), (90, 190, 40, 50)])
+        self.assertEqual((self.hint.hits, self.hint.misses, self.hint.cold),
+                         (1, 0, 1))
+
+    def test_miss_falls_back_to_full_search(self):
+        self.hint.find('a', _RecordingFinder((100, 200, 20, 30)), self.screen)
+        find = _RecordingFinder((500, 600, 20, 30))
+        results = self.hint.find('a', find, self.screen)
+        self.assertEqual([loc.rect for loc in results], [(500, 600, 20, 30)])
+        self.assertEqual(find.searched,
+                         [(90, 190, 40, 50), (0, 0, 1000, 800)])
+        self.assertEqual((self.hint.hits, self.hint.misses, self.hint.cold),
+                         (0, 1, 1))
+
+    def test_history(self):
+        self.hint.find('a', _RecordingFinder((100, 200, 20, 30)), self.screen)
+        self.hint.find('a', _RecordingFinder((500, 600, 20, 30)), self.screen)
+        find = _RecordingFinder((100, 200, 20, 30))
+        self.hint.find('a', find, self.screen)
+        self.assertEqual(find.searched,
+                         [(490, 590, 40, 50), (90, 190, 40, 50)])
+        self.assertEqual(self.hint.hits, 1)
+
+    def test_keys_are_separate(self):
+        self.hint.find('a', _RecordingFinder((100, 200, 20, 30)), self.screen)
+        self.hint.find('b', _RecordingFinder((100, 200, 20, 30)), self.screen)
+        self.assertEqual(self.hint.cold, 2)
+
+    def test_forget(self):
+        find = _RecordingFinder((100, 200, 20, 30))
+        self.hint.find('a', find, self.screen)
+        self.hint.forget('a')
+        self.hint.find('a', find, self.screen)
+        self.assertEqual(self.hint.cold, 2)
+
+    def test_region_outside_location(self):
+        find = _RecordingFinder((100, 200, 20, 30))
+        self.hint.find('a', find, self.screen)
+        self.assertEqual(
+            self.hint.find('a', find, Location(500, 500, 100, 100)), [])
+        self.assertEqual(self.hint.misses, 1)
+
+
+class TestApproxTemplateFinderHint(unittest.TestCase):
+    def test_same_results(self):
+        image = np.zeros((300, 400, 3), np.uint8)
+        image[100:120, 200:230] = 200
+        image[105:110, 205:215] = 50
+        template = _Template(image[95:125, 195:235].copy())
+        screen = Location(0, 0, w=400, h=300, image=image)
+        hint = RegionHint()
+        finder = ApproxTemplateFinder(template, hint=hint)
+        expected = list(ApproxTemplateFinder(template).find(screen))
+        self.assertEqual(len(expected), 1)
+        self.assertListEqual(list(finder.find(screen)), expected)
+        self.assertListEqual(list(finder.find(screen)), expected)
+        self.assertEqual((hint.hits, hint.misses, hint.cold), (1, 0, 1))
+
+
+region_hint_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestRegionHint)
+approx_hint_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestApproxTemplateFinderHint)
+all_tests = unittest.TestSuite([region_hint_suite, approx_hint_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)
@@ -0,0 +1,166 @@
+import unittest
+import numpy as np
+from numpy.testing import assert_array_almost_equal, assert_array_equal
+from scipy.signal import fftconvolve
+from geist.match_position_finder_helpers import (
+    summed_area_table,
+    window_sums,
+    normalised_correlation_map,
+    normalised_correlation_coefficient_map,
+    squared_differences_map,
+)
+from geist.matchers import (
+    match_via_correlation,
+    match_via_correlation_coefficient,
+    match_via_squared_difference,
+    fuzzy_match,
+    pyramid_fuzzy_match,
+)
+
+
+def _correlation(image, template):
+    h, w = image.shape
+    th, tw = template.shape
+    return fftconvolve(image, template[::-1, ::-1])[th - 1:h, tw - 1:w]
+
+
+def _windows(image, shape):
+    th, tw = shape
+    h, w = image.shape
+    return [[image[y:y + th, x:x + tw] for x in range(w - tw + 1)]
+            for y in range(h - th + 1)]
+
+
+class TestSummedAreaTable(unittest.TestCase):
+    def test_table(self):
+        image = np.arange(12).reshape((3, 4))
+        table = summed_area_table(image)
+        self.assertEqual(table.shape, (4, 5))
+        for y in range(4):
+            for x in range(5):
+                self.assertEqual(table[y, x], image[:y, :x].sum())
+
+    def test_window_sums(self):
+        image = np.random.RandomState(0).randint(0, 255, (7, 9))
+        expected = [[window.sum() for window in row]
+                    for row in _windows(image, (3, 2))]
+        assert_array_equal(window_sums(summed_area_table(image), (3, 2)),
+                           expected)
+
+
+class TestScoreMaps(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.image = rng.randint(0, 255, (20, 30)).astype(np.uint8)
+        self.image[5:10, 5:15] = 100
+        self.template = rng.randint(0, 255, (4, 6)).astype(float)
+
+    def test_normalised_correlation(self):
+        correlation = _correlation(self.image, self.template)
+        expected = [[(window * self.template).sum() /
+                     (np.linalg.norm(window) * np.linalg.norm(self.template))
+                     for window in row]
+                    for row in _windows(self.image.astype(float),
+                                        self.template.shape)]
+        assert_array_almost_equal(
+            normalised_correlation_map(self.image, self.template,
+                                       correlation),
+            expected)
+
+    def test_normalised_correlation_coefficient(self):
+        template = self.template - self.template.mean()
+        convolution = _correlation(self.image, template)
+        expected = []
+        for row in _windows(self.image.astype(float), template.shape):
+            expected.append([])
+            for window in row:
+                norm = (np.linalg.norm(window - window.mean()) *
+                        np.linalg.norm(template))
+                expected[-1].append(
+                    (window * template).sum() / norm if norm else 0)
+        actual = normalised_correlation_coefficient_map(
+            self.image, self.template, convolution)
+        assert_array_almost_equal(actual, expected)
+        # Windows of flat colour score zero rather than nan
+        self.assertEqual(actual[5, 5], 0)
+
+    def test_squared_differences(self):
+        correlation = _correlation(self.image, self.template)
+        expected = [[((window - self.template) ** 2).sum() for window in row]
+                    for row in _windows(self.image.astype(float),
+                                        self.template.shape)]
+        assert_array_almost_equal(
+            squared_differences_map(self.image, self.template, correlation),
+            expected, decimal=4)
+
+
+class TestMatchers(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.image = np.full((60, 80), 200.0)
+        self.template = rng.randint(0, 150, (6, 8)).astype(float)
+        self.image[10:16, 20:28] = self.template
+        self.image[40:46, 50:58] = self.template + 3
+        # A bright patch which correlates highly without normalisation
+        self.image[30:36, 5:13] = 255
+
+    def test_correlation(self):
+        self.assertEqual(sorted(match_via_correlation(self.image,
+                                                      self.template,
+                                                      raw_tolerance=0.5)),
+                         [(10, 20), (40, 50)])
+
+    def test_correlation_coefficient(self):
+        self.assertEqual(sorted(match_via_correlation_coefficient(
+            self.image, self.template, raw_tolerance=0.5)),
+            [(10, 20), (40, 50)])
+
+    def test_squared_difference(self):
+        self.assertEqual(sorted(match_via_squared_difference(
+            self.image, self.template, raw_tolerance=0.5,
+            sq_diff_tolerance=0.01)),
+            [(10, 20), (40, 50)])
+
+
+class TestPyramidFuzzyMatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.image = np.full((120, 160), 230)
+        self.template = np.full((30, 40), 240)
+        for _ in range(15):
+            y, x = rng.randint(0, 26), rng.randint(0, 34)
+            self.template[y:y + 4, x:x + 6] = rng.randint(0, 200)
+        self.image[10:40, 20:60] = self.template
+        self.image[70:100, 95:135] = self.template
+
+    def test_same_as_fuzzy_match(self):
+        expected = sorted(fuzzy_match(self.image, self.template,
+                                      method='correlation coefficient'))
+        self.assertEqual(expected, [(20, 10), (95, 70)])
+        for factor in [2, 4]:
+            self.assertEqual(
+                pyramid_fuzzy_match(self.image, self.template, factor=factor,
+                                    method='correlation coefficient'),
+                expected)
+
+    def test_small_template(self):
+        template = self.template[:2, :3]
+        self.assertEqual(
+            pyramid_fuzzy_match(self.image, template, factor=2),
+            sorted(fuzzy_match(self.image, template)))
+
+
+summed_area_table_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestSummedAreaTable)
+score_maps_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestScoreMaps)
+matchers_suite = unittest.TestLoader().loadTestsFromTestCase(TestMatchers)
+pyramid_fuzzy_match_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPyramidFuzzyMatch)
+all_tests = unittest.TestSuite([summed_area_table_suite,
+                                score_maps_suite,
+                                matchers_suite,
+                                pyramid_fuzzy_match_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)
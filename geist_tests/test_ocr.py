@@ -0,0 +1,238 @@
+import unittest
+import json
+import shutil
+import tempfile
+from multiprocessing.dummy import Pool
+import numpy as np
+from numpy.testing import assert_array_almost_equal
+import geist.ocr
+from geist import GUI, Location, TextFinderFilter
+from geist.backends.fake import GeistFakeBackend
+from geist.ocr import (Classifier, best_n_distance_factory, best_n_distances,
+                       distance, extract_properties, projected_properties,
+                       projected_properties_many)
+
+
+def _classifier(data, glyphs, cut_off=0.3):
+    classifier = Classifier()
+    classifier.from_json(json.dumps({'cut_off': cut_off, 'data': data}))
+    classifier.extract_func = lambda image, max_w_h_ratio: glyphs
+    classifier.properties_func = lambda im: im
+    return classifier
+
+
+class TestBestNDistances(unittest.TestCase):
+    def test_same_as_best_n_distance(self):
+        rng = np.random.RandomState(0)
+        data = rng.rand(30, 10)
+        ds = rng.rand(4, 10)
+        for n in [0, 3, 6, 8, 20]:
+            distance_func = best_n_distance_factory(n)
+            expected = [[distance_func(d1, d2) for d1 in data] for d2 in ds]
+            assert_array_almost_equal(best_n_distances(data, ds, n), expected)
+            assert_array_almost_equal(best_n_distances(data, ds[0], n),
+                                      expected[0])
+
+
+class TestClassifier(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(1)
+        self.data = [(chr(97 + i % 26), list(rng.rand(10)))
+                     for i in range(200)]
+        self.glyphs = [rng.rand(10) for i in range(20)]
+
+    def expected(self, classifier):
+        text = []
+        for glyph in self.glyphs:
+            d2 = classifier._adjuster(glyph)
+            d, t = sorted((classifier.distance_func(d1, d2), t)
+                          for t, d1 in classifier._adjusted_data)[0]
+            text.append('?' if d > classifier.cut_off else t)
+        return ''.join(text)
+
+    def test_classify(self):
+        classifier = _classifier(self.data, self.glyphs)
+        text = classifier.classify(None)
+        self.assertEqual(text, self.expected(classifier))
+        self.assertNotEqual(text.count('?'), 0)
+        self.assertNotEqual(text.count('?'), len(text))
+
+    def test_ties_go_to_first_character(self):
+        data = [('b', [0.1] * 10), ('a', [0.1] * 10), ('c', [0.9] * 10)]
+        classifier = _classifier(data, [np.array([0.1] * 10)])
+        self.assertEqual(classifier.classify(None), 'a')
+
+    def test_other_distance_function(self):
+        classifier = _classifier(self.data, self.glyphs, cut_off=0.8)
+        classifier.distance_func = distance
+        self.assertEqual(classifier.classify(None), self.expected(classifier))
+
+    def test_index(self):
+        for cut_off in [0.05, 0.3, 1]:
+            expected = _classifier(self.data, self.glyphs, cut_off)
+            classifier = _classifier(self.data, self.glyphs, cut_off)
+            classifier.use_index = True
+            self.assertEqual(classifier.classify(None),
+                             expected.classify(None))
+            self.assertIsNotNone(classifier._tree)
+
+    def test_blocks(self):
+        classifier = _classifier(self.data, self.glyphs)
+        expected = classifier.classify(None)
+        block_size = geist.ocr.DISTANCE_BLOCK_SIZE
+        geist.ocr.DISTANCE_BLOCK_SIZE = 5000
+        try:
+            self.assertEqual(classifier.classify(None), expected)
+        finally:
+            geist.ocr.DISTANCE_BLOCK_SIZE = block_size
+
+    def test_save_and_load(self):
+        classifier = _classifier(self.data, self.glyphs)
+        directory = tempfile.mkdtemp()
+        try:
+            classifier.save(directory)
+            loaded = _classifier([], self.glyphs, cut_off=0)
+            loaded.load(directory)
+            self.assertIsInstance(loaded._adjusted_matrix, np.memmap)
+            self.assertEqual(loaded.cut_off, classifier.cut_off)
+            self.assertEqual(loaded.classify(None), classifier.classify(None))
+            # and can still be saved as JSON
+            from_json = _classifier([], self.glyphs)
+            from_json.from_json(loaded.to_json())
+            self.assertEqual(from_json.classify(None),
+                             classifier.classify(None))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_no_characters(self):
+        self.assertEqual(_classifier(self.data, []).classify(None), '')
+
+    def test_classify_many(self):
+        classifier = _classifier(self.data, self.glyphs)
+        # Each pixel of the image is the index of the glyph it reads as
+        classifier.extract_func = lambda image, max_w_h_ratio: [
+            self.glyphs[i] for i in image.ravel()]
+        image = np.arange(20).reshape((4, 5))
+        rects = [(0, 0, 5, 4), (1, 1, 2, 3), (3, 2, 0, 2), (4, 3, 1, 1)]
+        expected = [classifier.classify(image[y:y + h, x:x + w])
+                    for x, y, w, h in rects]
+        self.assertEqual(expected[2], '')
+        self.assertEqual(classifier.classify_many(image, rects), expected)
+        pool = Pool(2)
+        try:
+            self.assertEqual(classifier.classify_many(image, rects, pool=pool),
+                             expected)
+        finally:
+            pool.close()
+        self.assertEqual(classifier.classify_many(image, []), [])
+
+
+class _Finder(object):
+    def __init__(self, *rects):
+        self.rects = rects
+        self.found = 0
+
+    def find(self, in_location):
+        for x, y, w, h in self.rects:
+            self.found += 1
+            yield Location(x, y, w, h, parent=in_location)
+
+
+class TestTextFinderFilter(unittest.TestCase):
+    def test_find(self):
+        data = [('a', [0.0] * 10), ('b', [1.0] * 10)]
+        glyphs = [np.array([0.0] * 10), np.array([1.0] * 10)]
+        classifier = _classifier(data, glyphs)
+        classifier.extract_func = lambda image, max_w_h_ratio: [
+            glyphs[i] for i in image.ravel()]
+        image = np.array([[0, 1, 1, 0, 1]])
+        screen = Location(0, 0, 5, 1, image=image)
+        finder = _Finder((0, 0, 2, 1), (1, 0, 2, 1), (3, 0, 2, 1),
+                         (2, 0, 2, 1))
+        for batch_size in [1, 3, 64]:
+            text_finder = TextFinderFilter(classifier, finder, 'ab',
+                                           batch_size=batch_size)
+            self.assertEqual([loc.rect for loc in text_finder.find(screen)],
+                             [(0, 0, 2, 1), (3, 0, 2, 1)])
+
+    def test_exists_stops_early(self):
+        read = []
+        glyph = np.array([0.0] * 10)
+        classifier = _classifier([('a', [0.0] * 10), ('b', [1.0] * 10)],
+                                 [glyph])
+        classifier.extract_func = (
+            lambda image, max_w_h_ratio: read.append(image) or [glyph])
+        finder = _Finder(*[(x, 0, 1, 1) for x in range(100)])
+        gui = GUI(GeistFakeBackend())
+        self.assertTrue(gui.exists(TextFinderFilter(classifier, finder, 'a')))
+        self.assertEqual((finder.found, len(read)), (1, 1))
+
+
+class TestProjectedProperties(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(2)
+        self.glyphs = []
+        for i in range(30):
+            h, w = rng.randint(9, 18), rng.randint(4, 12)
+            glyph = np.zeros((h, w), dtype=np.uint8)
+            for j in range(4):
+                y, x = rng.randint(0, h), rng.randint(0, w)
+                glyph[y:y + rng.randint(1, 6),
+                      x:x + rng.randint(1, 3)] = rng.randint(80, 255)
+            self.glyphs.append(glyph)
+
+    def test_close_to_extract_properties(self):
+        expected = np.array([extract_properties(g) for g in self.glyphs])
+        actual = projected_properties_many(self.glyphs)
+        # Only the projections at 30 and 60 degrees are worked out differently
+        exact = [0, 1, 2, 3, 8, 9]
+        assert_array_almost_equal(actual[:, exact], expected[:, exact])
+        self.assertTrue(np.median(abs(actual - expected)[:, 4:8]) < 0.1)
+
+    def test_batch(self):
+        assert_array_almost_equal(
+            projected_properties_many(self.glyphs),
+            [projected_properties(g) for g in self.glyphs])
+        self.assertEqual(projected_properties_many([]).shape, (0, 10))
+
+    def test_json_records_properties(self):
+        data = [('a', [0.0] * 10), ('b', [1.0] * 10)]
+        old = json.dumps({'cut_off': 0.1, 'data': data})
+        classifier = Classifier(properties='projection')
+        self.assertIs(classifier.properties_func, projected_properties)
+        classifier.from_json(old)
+        self.assertIs(classifier.properties_func, extract_properties)
+        classifier.properties_func = projected_properties
+        loaded = Classifier()
+        self.assertIs(loaded.properties_func, extract_properties)
+        loaded.from_json(classifier.to_json())
+        self.assertIs(loaded.properties_func, projected_properties)
+
+    def test_train_with_same_properties(self):
+        classifier = Classifier(properties='projection')
+        classifier.extract_func = lambda image, max_w_h_ratio: self.glyphs[:3]
+        classifier.train(None, 'abc')
+        loaded = Classifier()
+        loaded.extract_func = classifier.extract_func
+        loaded.from_json(classifier.to_json())
+        loaded.train(None, 'abc')
+        self.assertEqual(len(loaded._labels), 6)
+        loaded.properties_func = extract_properties
+        with self.assertRaises(ValueError):
+            loaded.train(None, 'abc')
+
+
+best_n_distances_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestBestNDistances)
+classifier_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestClassifier)
+text_finder_filter_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestTextFinderFilter)
+projected_properties_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestProjectedProperties)
+all_tests = unittest.TestSuite([best_n_distances_suite, classifier_suite,
+                                text_finder_filter_suite,
+                                projected_properties_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)
@@ -1,7 +1,12 @@
 import unittest
 from geist import Location, LocationList, GUI, LocationOperatorFinder
+from geist import MergeLocationsFinderFilter
 from geist.backends.fake import GeistFakeBackend
-from geist.layoutfinders import below, left_of, right_of
+from geist.layoutfinders import (below, above, left_of, right_of,
+                                  max_horizontal_separation,
+                                  max_vertical_separation, intersects,
+                                  row_aligned)
+import random
 
 
 class TestOperators(unittest.TestCase):
@@ -72,8 +77,115 @@ class TestOperators(unittest.TestCase):
         self.assertListEqual(actual, expected)
 
 
+class TestOperatorBounds(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.screen = Location(0, 0, w=800, h=600)
+        self.locs_a = LocationList([
+            Location(rng.randint(0, 700), rng.randint(0, 500),
+                     w=rng.randint(1, 100), h=rng.randint(1, 100),
+                     parent=self.screen)
+            for _ in range(60)])
+        self.locs_b = LocationList([
+            Location(rng.randint(0, 700), rng.randint(0, 500),
+                     w=rng.randint(1, 100), h=rng.randint(1, 100),
+                     parent=self.screen)
+            for _ in range(60)])
+        self.operators = [
+            below, above, left_of, right_of,
+            max_horizontal_separation(10), max_vertical_separation(20),
+            intersects, below & max_horizontal_separation(0),
+            above | below, (above & right_of) | max_vertical_separation(5),
+            ~intersects, ~below & right_of,
+        ]
+
+    def test_bounds_hold(self):
+        for op in self.operators:
+            for a in self.locs_a:
+                bounds = op.bounds(a)
+                if bounds is None:
+                    continue
+                for b in self.locs_b:
+                    if not op(a, b):
+                        continue
+                    values = {'x': b.x, 'y': b.y, 'right': b.x + b.w,
+                              'bottom': b.y + b.h}
+                    for key, (low, high) in bounds.items():
+                        self.assertTrue(low is None or values[key] >= low,
+                                        (op, key))
+                        self.assertTrue(high is None or values[key] <= high,
+                                        (op, key))
+
+    def test_same_as_checking_every_pair(self):
+        for op in self.operators:
+            expected = [a for a in self.locs_a
+                        if any(op(a, b) for b in self.locs_b)]
+            finder = LocationOperatorFinder(self.locs_a, op, self.locs_b)
+            self.assertListEqual(list(finder.find(self.screen)), expected)
+
+    def test_unbounded(self):
+        self.assertIsNone((~below).bounds(self.locs_a[0]))
+        self.assertIsNone((below | ~above).bounds(self.locs_a[0]))
+        self.assertEqual((below & ~above).bounds(Location(5, 10, 2, 2)),
+                         {'bottom': (None, 10)})
+
+
+class TestMergeLocationsFinderFilter(unittest.TestCase):
+    def setUp(self):
+        self.screen = Location(0, 0, w=800, h=600)
+
+    def merged(self, op, locations):
+        finder = MergeLocationsFinderFilter(op, LocationList(locations))
+        return [loc.rect for loc in finder.find(self.screen)]
+
+    def test_chain(self):
+        # Each only intersects its neighbours
+        locations = [Location(x, 5, w=12, h=5, parent=self.screen)
+                     for x in [0, 10, 20, 30, 100]]
+        self.assertEqual(self.merged(intersects, locations),
+                         [(0, 5, 42, 5), (100, 5, 12, 5)])
+
+    def test_order(self):
+        locations = [Location(0, 0, w=5, h=5, parent=self.screen),
+                     Location(50, 0, w=5, h=5, parent=self.screen),
+                     Location(3, 3, w=5, h=5, parent=self.screen)]
+        self.assertEqual(self.merged(intersects, locations),
+                         [(50, 0, 5, 5), (0, 0, 8, 8)])
+
+    def test_same_as_connected_groups(self):
+        rng = random.Random(0)
+        locations = [Location(rng.randint(0, 700), rng.randint(0, 500),
+                              w=rng.randint(1, 30), h=rng.randint(1, 15),
+                              parent=self.screen)
+                     for _ in range(150)]
+        for op in [intersects, max_horizontal_separation(3) & row_aligned,
+                   ~~intersects]:
+            # Groups of indexes, each joining the groups it connects to
+            groups = []
+            for i, loc in enumerate(locations):
+                joined = [g for g in groups
+                          if any(op(loc, locations[j]) or op(locations[j], loc)
+                                 for j in g)]
+                groups = [g for g in groups if g not in joined]
+                groups.append(sum(joined, []) + [i])
+            expected = []
+            for group in sorted(groups, key=max):
+                group = [locations[i] for i in group]
+                x = min(loc.x for loc in group)
+                y = min(loc.y for loc in group)
+                expected.append((x, y,
+                                 max(loc.x + loc.w for loc in group) - x,
+                                 max(loc.y + loc.h for loc in group) - y))
+            self.assertEqual(self.merged(op, locations), expected)
+
+
 operator_suite = unittest.TestLoader().loadTestsFromTestCase(TestOperators)
-all_tests = unittest.TestSuite([operator_suite])
+operator_bounds_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestOperatorBounds)
+merge_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestMergeLocationsFinderFilter)
+all_tests = unittest.TestSuite([operator_suite, operator_bounds_suite,
+                                merge_suite])
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=1)
     runner.run(all_tests)
@@ -0,0 +1,318 @@
+import unittest
+import os
+import multiprocessing
+import shutil
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from geist import DirectoryRepo, CachingRepo, PackedRepo
+from geist import TemplateFinderFromRepo, Location, ExactTemplateFinder
+from geist import ApproxTemplateFinder
+from geist.repo import derived_image
+from geist.vision import TEMPLATE_CACHE
+
+
+class TestDirectoryRepo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.repo = DirectoryRepo(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        image = np.arange(12, dtype=np.uint8).reshape((2, 2, 3))
+        self.repo['a'] = image
+        assert_array_equal(self.repo['a'].image, image)
+        self.assertEqual(self.repo.entries, ['a'])
+        del self.repo['a']
+        self.assertEqual(self.repo.entries, [])
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            self.repo['a']
+        with self.assertRaises(KeyError):
+            del self.repo['a']
+        with self.assertRaises(KeyError):
+            self.repo.signature('a')
+
+    def test_mmap(self):
+        self.repo['a'] = np.ones((4, 4), dtype=np.uint8)
+        image = DirectoryRepo(self.directory, mmap_mode='r')['a'].image
+        self.assertIsInstance(image, np.memmap)
+        assert_array_equal(image, np.ones((4, 4)))
+
+
+class TestCachingRepo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.repo = CachingRepo(DirectoryRepo(self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_cached(self):
+        self.repo['a'] = np.zeros((4, 4), dtype=np.uint8)
+        first = self.repo['a']
+        second = self.repo['a']
+        self.assertIs(first.image, second.image)
+        self.assertIs(first, second)
+        self.assertIs(second.repo, self.repo)
+        self.assertFalse(second.image.flags.writeable)
+        self.assertEqual((self.repo.hits, self.repo.misses), (1, 1))
+
+    def test_changed_on_disk(self):
+        self.repo['a'] = np.zeros((4, 4), dtype=np.uint8)
+        self.repo['a']
+        other = DirectoryRepo(self.directory)
+        other['a'] = np.ones((4, 4), dtype=np.uint8)
+        assert_array_equal(self.repo['a'].image, np.ones((4, 4)))
+        self.assertEqual(self.repo.misses, 2)
+
+    def test_deleted_on_disk(self):
+        self.repo['a'] = np.zeros((4, 4), dtype=np.uint8)
+        self.repo['a']
+        del DirectoryRepo(self.directory)['a']
+        with self.assertRaises(KeyError):
+            self.repo['a']
+
+    def test_byte_budget(self):
+        repo = CachingRepo(DirectoryRepo(self.directory), max_bytes=20)
+        repo['a'] = np.zeros((4, 4), dtype=np.uint8)
+        repo['b'] = np.zeros((4, 4), dtype=np.uint8)
+        repo['a']
+        repo['b']
+        repo['a']
+        self.assertEqual((repo.hits, repo.misses), (0, 3))
+
+
+class TestPackedRepo(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'templates.pack')
+        self.repo = PackedRepo(self.path)
+        rng = np.random.RandomState(0)
+        self.images = {
+            'a': rng.randint(0, 255, (5, 7, 3)).astype(np.uint8),
+            'b': rng.rand(3, 3),
+            'c': np.zeros((0, 4), dtype=np.int32),
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertContains(self, repo, images):
+        self.assertEqual(repo.entries, sorted(images))
+        for key, image in images.items():
+            template = repo[key]
+            self.assertEqual(template.image.dtype, image.dtype)
+            assert_array_equal(template.image, image)
+
+    def test_round_trip(self):
+        self.repo.update(self.images)
+        self.assertContains(self.repo, self.images)
+        self.assertContains(PackedRepo(self.path), self.images)
+        self.assertEqual(self.repo['a'].image.ctypes.data % 64, 0)
+
+    def test_missing(self):
+        with self.assertRaises(KeyError):
+            self.repo['a']
+        with self.assertRaises(KeyError):
+            del self.repo['a']
+        with self.assertRaises(ValueError):
+            self.repo['a'] = [1, 2]
+
+    def test_replace_delete_and_compact(self):
+        self.repo.update(self.images)
+        self.repo['a'] = self.images['b']
+        del self.repo['c']
+        images = {'a': self.images['b'], 'b': self.images['b']}
+        self.assertContains(self.repo, images)
+        size = os.path.getsize(self.path)
+        self.assertTrue(self.repo.unused_bytes > self.images['a'].nbytes)
+        self.repo.compact()
+        self.assertTrue(os.path.getsize(self.path) < size)
+        self.assertContains(self.repo, images)
+
+    def test_changed_by_another_repo(self):
+        self.repo['a'] = self.images['a']
+        PackedRepo(self.path)['b'] = self.images['b']
+        self.assertContains(self.repo, {'a': self.images['a'],
+                                        'b': self.images['b']})
+
+    def test_not_a_pack(self):
+        path = os.path.join(self.directory, 'other')
+        with open(path, 'wb') as f:
+            f.write(b'x' * 100)
+        with self.assertRaises(ValueError):
+            PackedRepo(path)
+
+    def test_finder_from_repo(self):
+        self.repo['a'] = self.images['a']
+        image = np.zeros((20, 30, 3), dtype=np.uint8)
+        image[4:9, 10:17] = self.images['a']
+        screen = Location(0, 0, 30, 20, image=image)
+        finder = TemplateFinderFromRepo(self.repo, ExactTemplateFinder).a
+        self.assertEqual([loc.rect for loc in finder.find(screen)],
+                         [(10, 4, 7, 5)])
+
+
+def _write_templates(path, prefix, start):
+    start.wait()
+    repo = PackedRepo(path)
+    for i in range(20):
+        repo['%s%d' % (prefix, i)] = np.full((3, 3), i, dtype=np.uint8)
+        if i % 5 == 0:
+            repo.compact()
+
+
+class TestPackedRepoLocking(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'templates.pack')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_concurrent_writers(self):
+        start = multiprocessing.Event()
+        writers = [multiprocessing.Process(target=_write_templates,
+                                           args=(self.path, prefix, start))
+                   for prefix in 'abcd']
+        for writer in writers:
+            writer.start()
+        start.set()
+        for writer in writers:
+            writer.join()
+            self.assertEqual(writer.exitcode, 0)
+        repo = PackedRepo(self.path)
+        self.assertEqual(repo.entries, sorted('%s%d' % (prefix, i)
+                                              for prefix in 'abcd'
+                                              for i in range(20)))
+        assert_array_equal(repo['c7'].image, np.full((3, 3), 7))
+
+
+class _CountingBuild(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, image):
+        self.count += 1
+        return image > 100
+
+
+class TestDerivedImages(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.image = np.random.RandomState(0).randint(0, 255, (6, 8))
+        self.image = self.image.astype(np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def assertBuiltOnce(self, make_repo):
+        make_repo()['a'] = self.image
+        build = _CountingBuild()
+        for i in range(2):
+            derived = derived_image(make_repo()['a'], 'test', build)
+            assert_array_equal(derived, self.image > 100)
+        self.assertEqual(build.count, 1)
+        make_repo()['a'] = self.image + 1
+        derived_image(make_repo()['a'], 'test', build)
+        self.assertEqual(build.count, 2)
+
+    def test_directory_repo(self):
+        self.assertBuiltOnce(
+            lambda: DirectoryRepo(self.directory, store_derived=True))
+        self.assertEqual(DirectoryRepo(self.directory).entries, ['a'])
+
+    def test_caching_repo(self):
+        self.assertBuiltOnce(lambda: CachingRepo(
+            DirectoryRepo(self.directory, store_derived=True)))
+
+    def test_packed_repo(self):
+        path = os.path.join(self.directory, 'templates.pack')
+        self.assertBuiltOnce(lambda: PackedRepo(path, store_derived=True))
+        repo = PackedRepo(path)
+        self.assertEqual(repo.entries, ['a'])
+        repo.compact()
+        build = _CountingBuild()
+        derived_image(repo['a'], 'test', build)
+        self.assertEqual(build.count, 0)
+        del repo['a']
+        repo.compact()
+        self.assertEqual(repo.unused_bytes, 0)
+
+    def test_without_repo(self):
+        build = _CountingBuild()
+        template = _TemplateWithoutRepo(self.image)
+        derived_image(template, 'test', build)
+        derived_image(template, 'test', build)
+        self.assertEqual(build.count, 2)
+
+    def test_not_stored_by_default(self):
+        for repo in [DirectoryRepo(self.directory),
+                     PackedRepo(os.path.join(self.directory, 'a.pack'))]:
+            repo['a'] = self.image
+            build = _CountingBuild()
+            derived_image(repo['a'], 'test', build)
+            derived_image(repo['a'], 'test', build)
+            self.assertEqual(build.count, 2)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.directory, '.derived')))
+
+    def assertFinds(self, make_repo, prepare=lambda: None):
+        image = np.zeros((20, 30, 3), dtype=np.uint8)
+        image[5:15, 5:15] = 200
+        make_repo()['a'] = image[2:18, 2:18]
+        prepare()
+        screen = Location(0, 0, 30, 20, image=image)
+        finder = TemplateFinderFromRepo(make_repo(), ApproxTemplateFinder).a
+        TEMPLATE_CACHE.clear()
+        self.assertEqual([loc.rect for loc in finder.find(screen)],
+                         [(2, 2, 16, 16)])
+
+    def test_finder(self):
+        self.assertFinds(
+            lambda: DirectoryRepo(self.directory, store_derived=True))
+        self.assertEqual(
+            os.listdir(os.path.join(self.directory, '.derived')),
+            ['approx_edges_v1'])
+
+    def test_read_only_repo(self):
+        def make_read_only():
+            # A file in the way stops the derived image being saved even
+            # when run as root, who can write to read only directories
+            open(os.path.join(self.directory, '.derived'), 'w').close()
+            os.chmod(self.directory, 0o555)
+        try:
+            self.assertFinds(
+                lambda: DirectoryRepo(self.directory, store_derived=True),
+                make_read_only)
+        finally:
+            os.chmod(self.directory, 0o755)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['.derived', 'a.npy'])
+
+
+class _TemplateWithoutRepo(object):
+    def __init__(self, image):
+        self.image = image
+
+
+directory_repo_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestDirectoryRepo)
+caching_repo_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestCachingRepo)
+packed_repo_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPackedRepo)
+packed_repo_locking_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPackedRepoLocking)
+derived_images_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestDerivedImages)
+all_tests = unittest.TestSuite([directory_repo_suite, caching_repo_suite,
+                                packed_repo_suite, packed_repo_locking_suite,
+                                derived_images_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)
@@ -1,6 +1,8 @@
 import numpy as np
 from numpy.testing import assert_array_equal
-from geist.similar_images import is_similar, find_similar_in_repo
+from geist.similar_images import (is_similar, find_similar_in_repo,
+                                  SimilarImageIndex, perceptual_hash,
+                                  hamming_distances)
 from geist import GUI, DirectoryRepo
 from geist.pyplot import Viewer
 from geist.backends.fake import GeistFakeBackend
@@ -94,8 +96,53 @@ class TestSimilarity(unittest.TestCase):
             del self.repo['test_file_3'] 
         
 
+class TestSimilarImageIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.images = [(rng.rand(rng.randint(10, 14), rng.randint(10, 14)) >
+                        0.6).astype(int) for i in range(40)]
+        self.index = SimilarImageIndex()
+        for i, image in enumerate(self.images):
+            self.index.add(i, image)
+
+    def test_same_as_is_similar(self):
+        query = self.images[5].copy()
+        query[0, 0] = 0
+        expected = [i for i, image in enumerate(self.images)
+                    if is_similar(query, image) is True]
+        self.assertEqual(expected, [5])
+        self.assertEqual(self.index.find_similar(query), expected)
+
+    def test_default_finds_all_is_similar_does(self):
+        for query in self.images[:10]:
+            query = query.copy()
+            query[3:5, 3:6] = 1 - query[3:5, 3:6]
+            expected = [i for i, image in enumerate(self.images)
+                        if is_similar(query, image, match_tolerance=4) is True]
+            index = SimilarImageIndex(match_tolerance=4)
+            for i, image in enumerate(self.images):
+                index.add(i, image)
+            self.assertEqual(index.find_similar(query), expected)
+
+    def test_find_duplicates(self):
+        self.index.add('copy of 3', self.images[3])
+        self.index.add('copy of 7', self.images[7][:, :-1])
+        self.assertEqual(self.index.find_duplicates(),
+                         [[3, 'copy of 3'], [7, 'copy of 7']])
+
+    def test_hash(self):
+        image = self.images[0]
+        self.assertEqual(perceptual_hash(image).shape, (8,))
+        self.assertEqual(perceptual_hash(np.ones((3, 2))).shape, (8,))
+        hashes = np.array([perceptual_hash(image), perceptual_hash(1 - image)])
+        assert_array_equal(hamming_distances(hashes, perceptual_hash(image)),
+                           [0, 64])
+
+
 similar_suite = unittest.TestLoader().loadTestsFromTestCase(TestSimilarity)
-all_tests = unittest.TestSuite([similar_suite])
+index_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestSimilarImageIndex)
+all_tests = unittest.TestSuite([similar_suite, index_suite])
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=1)
     runner.run(all_tests)
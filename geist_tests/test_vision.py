@@ -3,7 +3,12 @@ from numpy.testing import assert_array_equal
 import unittest
 from geist.vision import (best_convolution,
                           convolution, overlapped_convolution,
-                          pad_bin_image_to_shape)
+                          pad_bin_image_to_shape, tile_checksums,
+                          PreparedTemplate, prepared_template_from_image,
+                          batched_convolution, tiled_convolution,
+                          or_pool, pyramid_convolution, rescale2avg,
+                          rescale3avg, bitset_convolution, pack_rows)
+from multiprocessing.pool import ThreadPool
 
 
 class TestOverlappedConvolution(unittest.TestCase):
@@ -30,6 +35,32 @@ class TestOverlappedConvolution(unittest.TestCase):
         actual = overlapped_convolution(template, image)
         self.assertEquals(sorted(expected), sorted(actual))
 
+    def test_match_in_remainder(self):
+        """
+        When the image doesn't divide exactly into splits the last row and
+        column of sections take the remainder.
+        """
+        image = np.zeros((11, 11))
+        image[9:11, 9:11] = [[0, 1], [1, 0]]
+        template = np.array([[0, 1], [1, 0]])
+
+        expected = [(9, 9)]
+        actual = overlapped_convolution(template, image, splits=(3, 3))
+        self.assertEquals(expected, actual)
+
+    def test_no_false_match_from_lower_sections(self):
+        """
+        Points one short of a match in one section with plenty of matching
+        points below it in the stack aren't matches.
+        """
+        rng = np.random.RandomState(0)
+        image = rng.rand(26, 52) < 0.7
+        template = image[:2, :3] & (rng.rand(2, 3) < 0.7)
+        expected = [(x, y) for y in range(25) for x in range(50)
+                    if np.all(image[y:y + 2, x:x + 3][template])]
+        actual = overlapped_convolution(template, image, splits=(4, 4))
+        self.assertEquals(sorted(expected), sorted(actual))
+
     def test_edge_overlap(self):
         """
         When an image is split and reconstructed such that image parts combine
@@ -145,6 +176,216 @@ class TestPadBinImageToShape(unittest.TestCase):
         assert_array_equal(expected, actual)
 
 
+class TestPreparedTemplate(unittest.TestCase):
+    def setUp(self):
+        self.image = np.array([[0, 0, 0, 0, 0, 0, 0, 0],
+                               [0, 0, 0, 0, 0, 0, 0, 0],
+                               [0, 0, 0, 0, 0, 0, 1, 0],
+                               [0, 0, 0, 0, 0, 1, 0, 0],
+                               [0, 0, 0, 1, 0, 0, 0, 0],
+                               [0, 0, 1, 0, 0, 0, 0, 0],
+                               [0, 1, 0, 0, 0, 0, 0, 0],
+                               [0, 0, 0, 0, 0, 0, 0, 0]])
+        self.template = np.array([[0, 1], [1, 0]])
+
+    def test_same_matches(self):
+        prepared = PreparedTemplate(self.template)
+        self.assertEqual(sorted(best_convolution(prepared, self.image)),
+                         sorted(best_convolution(self.template, self.image)))
+        self.assertEqual(convolution(prepared, self.image),
+                         convolution(self.template, self.image))
+
+    def test_spectrum_reused(self):
+        first = PreparedTemplate(self.template).spectrum((8, 8))
+        second = PreparedTemplate(self.template.copy()).spectrum((8, 8))
+        self.assertIs(first, second)
+        self.assertFalse(first.flags.writeable)
+
+    def test_prepared_template_from_image(self):
+        calls = []
+
+        def binarise(image):
+            calls.append(image)
+            return image > 0
+        image = np.array([[0, 3], [5, 0]])
+        first = prepared_template_from_image(image, binarise, 'test > 0')
+        second = prepared_template_from_image(image.copy(), binarise,
+                                              'test > 0')
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(first.count, 2)
+
+
+class TestBatchedConvolution(unittest.TestCase):
+    def test_match(self):
+        image = np.array([[0, 0, 0, 0, 0, 0, 0, 0],
+                          [0, 0, 0, 0, 0, 0, 0, 0],
+                          [0, 0, 0, 0, 0, 0, 1, 0],
+                          [0, 1, 0, 0, 0, 1, 0, 0],
+                          [0, 1, 0, 1, 0, 0, 0, 0],
+                          [0, 0, 1, 0, 0, 0, 0, 0],
+                          [0, 1, 0, 0, 0, 0, 0, 0],
+                          [0, 0, 0, 0, 0, 0, 0, 0]])
+        templates = [np.array([[0, 1], [1, 0]]),
+                     np.array([[1], [1]]),
+                     np.array([[1, 1]])]
+
+        expected = [[(1, 5), (5, 2), (2, 4)], [(1, 3)], []]
+        actual = batched_convolution(templates, image)
+        self.assertEqual([sorted(i) for i in expected],
+                         [sorted(i) for i in actual])
+
+    def test_batches(self):
+        image = np.zeros((8, 8))
+        image[2, 3] = image[5, 6] = 1
+        templates = [np.array([[1]])] * 5
+        actual = batched_convolution(templates, image, max_batch_bytes=1)
+        self.assertEqual([sorted(i) for i in actual], [[(3, 2), (6, 5)]] * 5)
+
+    def test_template_too_big_or_empty(self):
+        image = np.array([[0, 1], [1, 0]])
+        templates = [np.ones((3, 3)), np.zeros((1, 1))]
+        self.assertEqual(batched_convolution(templates, image), [[], []])
+
+
+class TestTiledConvolution(unittest.TestCase):
+    def setUp(self):
+        self.template = np.array([[0, 1, 1],
+                                  [1, 0, 1]], bool)
+        self.image = np.zeros((40, 50), bool)
+        # On tile corners and edges, and touching the image's right edge
+        for x, y in [(0, 0), (8, 6), (9, 9), (14, 20), (47, 30), (20, 38)]:
+            self.image[y:y + 2, x:x + 3] |= self.template
+        self.expected = sorted(
+            [(x, y) for x, y in best_convolution(self.template, self.image)
+             if 0 <= x <= 47 and 0 <= y <= 38],
+            key=lambda point: point[::-1])
+
+    def test_same_as_best_convolution(self):
+        self.assertEqual(len(self.expected), 6)
+        for tile_size in [(10, 10), (7, 13), (40, 50), (100, 100)]:
+            self.assertEqual(
+                tiled_convolution(self.template, self.image,
+                                  tile_size=tile_size),
+                self.expected)
+
+    def test_pool(self):
+        pool = ThreadPool(4)
+        try:
+            actual = tiled_convolution(self.template, self.image,
+                                       tile_size=(8, 8), pool=pool)
+        finally:
+            pool.close()
+        self.assertEqual(actual, self.expected)
+
+    def test_template_too_big(self):
+        self.assertEqual(tiled_convolution(np.ones((3, 3)), np.ones((2, 2))),
+                         [])
+
+
+class TestPyramidConvolution(unittest.TestCase):
+    def test_or_pool(self):
+        image = np.zeros((5, 7), bool)
+        image[1, 2] = image[4, 6] = True
+        assert_array_equal(or_pool(image, 2),
+                           [[0, 1, 0, 0], [0, 0, 0, 0], [0, 0, 0, 1]])
+        assert_array_equal(or_pool(image, 2, size=3),
+                           [[1, 1, 0, 0], [0, 0, 1, 1], [0, 0, 1, 1]])
+
+    def test_same_as_exhaustive_search(self):
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            image = rng.rand(30, 40) < 0.6
+            th, tw = rng.randint(1, 9, 2)
+            y, x = rng.randint(0, 30 - th), rng.randint(0, 40 - tw)
+            template = image[y:y + th, x:x + tw] & (rng.rand(th, tw) < 0.7)
+            if not template.any():
+                continue
+            expected = [(x, y) for x in range(41 - tw) for y in range(31 - th)
+                        if np.all(image[y:y + th, x:x + tw][template])]
+            for factor in [2, 3, 4]:
+                self.assertEqual(
+                    sorted(pyramid_convolution(template, image, factor)),
+                    expected)
+
+    def test_template_too_big(self):
+        self.assertEqual(pyramid_convolution(np.ones((3, 3)),
+                                             np.ones((2, 2))), [])
+
+
+class TestBitsetConvolution(unittest.TestCase):
+    def test_pack_rows(self):
+        image = np.zeros((2, 70), bool)
+        image[0, 0] = image[0, 63] = image[1, 64] = image[1, 69] = True
+        assert_array_equal(pack_rows(image),
+                           [[2 ** 63 + 1, 0], [0, 2 ** 63 + 2 ** 58]])
+        self.assertEqual(pack_rows(image, 3).shape, (2, 3))
+
+    def test_same_as_exhaustive_search(self):
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            ih, iw = rng.randint(5, 150, 2)
+            th, tw = rng.randint(1, 70, 2)
+            if th > ih or tw > iw:
+                continue
+            image = rng.rand(ih, iw) < rng.rand()
+            y, x = rng.randint(0, ih - th + 1), rng.randint(0, iw - tw + 1)
+            template = image[y:y + th, x:x + tw] & (rng.rand(th, tw) < 0.7)
+            expected = [(x, y) for x in range(iw - tw + 1)
+                        for y in range(ih - th + 1)
+                        if template.any() and
+                        np.all(image[y:y + th, x:x + tw][template])]
+            self.assertEqual(sorted(bitset_convolution(template, image)),
+                             expected)
+
+    def test_edge_overlap(self):
+        image = np.zeros((12, 12))
+        image[7:10, 0:2] = [[1, 1], [1, 0], [1, 1]]
+        image[7, 7] = image[9, 7] = 1
+        template = np.array([[1, 1, 1],
+                             [0, 1, 0],
+                             [1, 1, 1]])
+        self.assertEqual(bitset_convolution(template, image), [])
+
+    def test_best_convolution_methods_agree(self):
+        rng = np.random.RandomState(1)
+        image = rng.rand(60, 90) < 0.5
+        template = image[10:15, 20:28] & (rng.rand(5, 8) < 0.5)
+        ih, iw = image.shape
+        fft_matches = [(x, y) for x, y in
+                       best_convolution(template, image, bitset_max_count=0)
+                       if 0 <= x <= iw - 8 and 0 <= y <= ih - 5]
+        self.assertEqual(sorted(best_convolution(template, image)),
+                         sorted(fft_matches))
+
+
+class TestRescale(unittest.TestCase):
+    def test_rescale2avg(self):
+        image = np.array([[10, 0, 20], [0, 21, 0]], np.uint8)
+        assert_array_equal(rescale2avg(image), [[15]])
+
+    def test_rescale3avg(self):
+        image = np.array([[10, 0, 0], [0, 20, 0], [0, 0, 31]], np.uint8)
+        assert_array_equal(rescale3avg(image), [[20]])
+
+
+class TestTileChecksums(unittest.TestCase):
+    def test_shape(self):
+        image = np.zeros((100, 130, 3), np.uint8)
+        self.assertEqual(tile_checksums(image, tile_size=32).shape, (4, 5))
+
+    def test_equal_images(self):
+        image = np.arange(100 * 130 * 3, dtype=np.uint8).reshape((100, 130, 3))
+        assert_array_equal(tile_checksums(image), tile_checksums(image.copy()))
+
+    def test_changed_tile(self):
+        image = np.zeros((100, 130, 3), np.uint8)
+        changed = image.copy()
+        changed[40, 70, 1] = 1
+        different = tile_checksums(image, 32) != tile_checksums(changed, 32)
+        self.assertEqual(list(zip(*np.nonzero(different))), [(1, 2)])
+
+
 best_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
     TestBestConvolution)
 convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
@@ -153,10 +394,30 @@ overlapped_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
     TestOverlappedConvolution)
 pad_bin_image_to_shape_suite = unittest.TestLoader().loadTestsFromTestCase(
     TestPadBinImageToShape)
+tile_checksums_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestTileChecksums)
+prepared_template_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPreparedTemplate)
+batched_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestBatchedConvolution)
+tiled_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestTiledConvolution)
+pyramid_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestPyramidConvolution)
+rescale_suite = unittest.TestLoader().loadTestsFromTestCase(TestRescale)
+bitset_convolution_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestBitsetConvolution)
 all_tests = unittest.TestSuite([best_convolution_suite,
                                 convolution_suite,
                                 overlapped_convolution_suite,
                                 pad_bin_image_to_shape_suite,
+                                tile_checksums_suite,
+                                prepared_template_suite,
+                                batched_convolution_suite,
+                                tiled_convolution_suite,
+                                pyramid_convolution_suite,
+                                rescale_suite,
+                                bitset_convolution_suite,
                                 ])
 if __name__ == "__main__":
     runner = unittest.TextTestRunner(verbosity=1)
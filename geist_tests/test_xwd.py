@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+from numpy.testing import assert_array_equal
+from geist.backends._xwd import XwdToNumpyReader, XwdToNumpyMemmapReader
+
+
+def _write_xwd(path, bgrx):
+    h, w = bgrx.shape[:2]
+    header = struct.pack('>lllllllhhhhhh', 3232, 7, 2, 24, w, h,
+                         0, 0, 0, 0, 0, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(header.ljust(3232, b'\0'))
+        f.write(bgrx.astype(np.uint8).tobytes())
+
+
+class TestXwdToNumpyMemmapReader(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'Xvfb_screen0')
+        rng = np.random.RandomState(0)
+        self.bgrx = rng.randint(0, 255, (5, 7, 4)).astype(np.uint8)
+        _write_xwd(self.path, self.bgrx)
+        self.reader = XwdToNumpyMemmapReader(self.path)
+
+    def tearDown(self):
+        self.reader.close()
+        shutil.rmtree(self.directory)
+
+    def test_header(self):
+        self.assertEqual(self.reader.get_rect(), (0, 0, 7, 5))
+        self.assertEqual(XwdToNumpyReader(self.path).get_rect(), (0, 0, 7, 5))
+
+    def test_same_as_reading(self):
+        image = self.reader.get_image()
+        assert_array_equal(image, XwdToNumpyReader(self.path).get_image())
+        assert_array_equal(image, self.bgrx[:, :, 2::-1])
+
+    def test_snapshot_is_a_copy(self):
+        snapshot = self.reader.snapshot()
+        with open(self.path, 'r+b') as f:
+            f.seek(3232)
+            f.write((255 - self.bgrx).tobytes())
+        assert_array_equal(snapshot, self.bgrx[:, :, 2::-1])
+        assert_array_equal(self.reader.get_image(),
+                           (255 - self.bgrx)[:, :, 2::-1])
+
+    def test_not_24_bit(self):
+        path = os.path.join(self.directory, 'other')
+        _write_xwd(path, self.bgrx)
+        with open(path, 'r+b') as f:
+            f.seek(12)
+            f.write(struct.pack('>l', 16))
+        with self.assertRaises(AssertionError):
+            XwdToNumpyMemmapReader(path)
+
+
+memmap_reader_suite = unittest.TestLoader().loadTestsFromTestCase(
+    TestXwdToNumpyMemmapReader)
+all_tests = unittest.TestSuite([memmap_reader_suite])
+if __name__ == "__main__":
+    runner = unittest.TextTestRunner(verbosity=1)
+    runner.run(all_tests)